@@ -0,0 +1,437 @@
+'''
+Inference backends underneath the model classes.
+A backend reads networks and loads them into executable networks whose infer
+requests are run by InferRequestPool. Networks and requests of every backend
+look like those of the OpenVINO Inference Engine (inputs & outputs with shapes,
+batch_size, requests with async_infer, outputs and a completion callback), so
+models run unchanged on any of them:
+
+- openvino: OpenVINO Inference Engine, running the IR files of models.
+- onnxruntime: ONNX Runtime, running an .onnx file next to the IR (or given instead of it).
+- synthetic: Returns deterministic, correctly shaped outputs after a simulated
+  latency, so orchestration, preprocessing and scheduling overhead of the app can
+  be measured without any runtime or model files.
+'''
+import logging as log
+import os
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+try:
+    from openvino.inference_engine import IECore, IENetwork
+except ImportError:
+    IECore = IENetwork = None
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+try:
+    import onnx
+except ImportError:
+    onnx = None
+
+class OpenVINOBackend:
+    '''
+    Backend running models with one IECore.
+    '''
+    name = "openvino"
+    # Compiled networks can be cached on disk by ModelRegistry
+    supports_cache = True
+
+    def __init__(self):
+        if IECore is None:
+            raise ImportError("OpenVINO backend requires the openvino package")
+        self.core = IECore()
+
+    def read_network(self, model_xml):
+        model_bin = os.path.splitext(model_xml)[0] + ".bin"
+        return IENetwork(model_xml, model_bin)
+
+    def query_network(self, network, device):
+        return self.core.query_network(network, device)
+
+    def load_network(self, network, device, num_requests=1):
+        return self.core.load_network(network, device, num_requests=num_requests)
+
+    def set_config(self, config, device):
+        self.core.set_config(config, device)
+
+    def supports_export(self, device):
+        try:
+            metrics = self.core.get_metric(device, "SUPPORTED_METRICS")
+            return "IMPORT_EXPORT_SUPPORT" in metrics and self.core.get_metric(device, "IMPORT_EXPORT_SUPPORT")
+        except Exception:
+            return False
+
+    def import_network(self, path, device, num_requests=1):
+        return self.core.import_network(path, device, num_requests=num_requests)
+
+    def export_network(self, exec_network, path):
+        exec_network.export(path)
+
+class PortInfo:
+    '''
+    Shape of an input or output of a Network.
+    '''
+    def __init__(self, shape):
+        self.shape = list(shape)
+
+class Network:
+    '''
+    Network of backends other than OpenVINO, with the attributes of IENetwork used by the models.
+
+    inputs, outputs: dicts of name to shape, in order of the model.
+    fixed_batch: True if batch size of the model can not be changed.
+    fixed_shape: True if other dimensions of inputs can not be changed by reshape.
+    session: Optional (key, session) of a session built while reading the
+             network, which loading reuses if it is for the same device & config.
+    '''
+    def __init__(self, name, path, inputs, outputs, fixed_batch=False, fixed_shape=False, session=None):
+        self.name = name
+        self.path = path
+        self.session = session
+        self.inputs = {blob: PortInfo(shape) for blob, shape in inputs.items()}
+        self.outputs = {blob: PortInfo(shape) for blob, shape in outputs.items()}
+        # All layers run on any device of these backends
+        self.layers = {}
+        self.fixed_batch = fixed_batch
+        self.fixed_shape = fixed_shape
+        self._batch_size = 1
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        if self.fixed_batch and batch_size != self._batch_size:
+            raise ValueError(f"Model {self.name} has a fixed batch size of {self._batch_size}")
+        self._batch_size = batch_size
+        for port in list(self.inputs.values()) + list(self.outputs.values()):
+            port.shape[0] = batch_size
+
+    def reshape(self, shapes):
+        '''
+        Sets shapes of inputs, given as dict of input name to shape, like IENetwork.reshape.
+        '''
+        for name, shape in shapes.items():
+            if self.fixed_shape and list(shape[1:]) != self.inputs[name].shape[1:]:
+                raise ValueError(f"Model {self.name} has a fixed input shape of {self.inputs[name].shape}")
+            self.inputs[name].shape = list(shape)
+        self.batch_size = list(shapes.values())[0][0]
+
+class ExecutableNetwork:
+    def __init__(self, requests):
+        self.requests = requests
+
+class InferRequest(ABC):
+    '''
+    Infer request run on an executor thread, calling its completion callback
+    with status 0 on success like an OpenVINO infer request. Backends implement _infer.
+    A failed request has status -1 and keeps the exception which failed it.
+    '''
+    def __init__(self, executor):
+        self.executor = executor
+        self.outputs = {}
+        self.exception = None
+        self.callback = None
+        self.callback_data = None
+
+    def set_completion_callback(self, callback, data=None):
+        self.callback = callback
+        self.callback_data = data
+
+    def async_infer(self, inputs):
+        # Inputs are copied here, so the caller may reuse its buffers right away
+        inputs = self._copy_inputs(inputs)
+        self.executor.submit(self._run, inputs)
+
+    def _run(self, inputs):
+        try:
+            self.outputs = self._infer(inputs)
+            self.exception = None
+            status = 0
+        except Exception as e:
+            self.outputs = {}
+            self.exception = e
+            status = -1
+        if self.callback is not None:
+            self.callback(status, self.callback_data)
+
+    def _copy_inputs(self, inputs):
+        return {name: np.array(blob) for name, blob in inputs.items()}
+
+    @abstractmethod
+    def _infer(self, inputs):
+        '''
+        Returns dict of output name to output array of copied inputs.
+        '''
+
+### Numpy types of ONNX tensor types
+onnx_types = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(uint8)": np.uint8,
+    "tensor(int8)": np.int8,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+}
+
+### SessionOptions of ONNX Runtime, with a conversion of the value, for plugin config keys
+onnx_options = {
+    "CPU_THREADS_NUM": ("intra_op_num_threads", int),
+}
+
+### Execution providers of ONNX Runtime for device names of the app
+onnx_providers = {
+    "CPU": ["CPUExecutionProvider"],
+    "GPU": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+}
+
+class ONNXRuntimeRequest(InferRequest):
+    def __init__(self, session, executor, input_types):
+        super().__init__(executor)
+        self.session = session
+        self.input_types = input_types
+        self.output_names = [output.name for output in session.get_outputs()]
+
+    def _copy_inputs(self, inputs):
+        # Blobs of the app are uint8 images, ONNX models mostly take float inputs
+        return {name: blob.astype(self.input_types[name]) for name, blob in inputs.items()}
+
+    def _infer(self, inputs):
+        return dict(zip(self.output_names, self.session.run(self.output_names, inputs)))
+
+class ONNXRuntimeBackend:
+    '''
+    Backend running .onnx models with ONNX Runtime. The model is read from the
+    .onnx file with the name of the IR, or from the path itself if it is an .onnx file.
+    Shapes of inputs and outputs are read from the graph with the onnx package if
+    it is installed, so each model is compiled once, into the session of its
+    device. Without it a CPU session is built to read them, which loading on CPU
+    with the same config reuses.
+    '''
+    name = "onnxruntime"
+    supports_cache = False
+
+    def __init__(self):
+        if onnxruntime is None:
+            raise ImportError("ONNX Runtime backend requires the onnxruntime package")
+        self.config = {}
+
+    def read_network(self, model_xml):
+        path = os.path.splitext(model_xml)[0] + ".onnx"
+        session = None
+        if onnx is not None:
+            graph = onnx.load(path, load_external_data=False).graph
+            # Weights may be listed as graph inputs too
+            weights = {initializer.name for initializer in graph.initializer}
+            inputs = {port.name: _onnx_shape(port) for port in graph.input if port.name not in weights}
+            outputs = {port.name: _onnx_shape(port) for port in graph.output}
+        else:
+            session = (self._session_key("CPU"), self._create_session(path, "CPU"))
+            inputs = {port.name: port.shape for port in session[1].get_inputs()}
+            outputs = {port.name: port.shape for port in session[1].get_outputs()}
+
+        # Symbolic (dynamic) dimensions are given as names or None
+        fixed_batch = all(isinstance(shape[0], int) for shape in inputs.values())
+        fixed_shape = all(isinstance(dim, int) for shape in inputs.values() for dim in shape[1:])
+        inputs = {name: [dim if isinstance(dim, int) else 1 for dim in shape] for name, shape in inputs.items()}
+        outputs = {name: [dim if isinstance(dim, int) else 1 for dim in shape] for name, shape in outputs.items()}
+        return Network(os.path.basename(path), path, inputs, outputs, fixed_batch, fixed_shape, session)
+
+    def query_network(self, network, device):
+        return {layer: device for layer in network.layers}
+
+    def load_network(self, network, device, num_requests=1):
+        # Batch size and shapes are dynamic dimensions of the session, it does not depend on them
+        if network.session is not None and network.session[0] == self._session_key(device):
+            session = network.session[1]
+        else:
+            session = self._create_session(network.path, device)
+        network.session = None
+
+        # Session runs are thread safe, each request gets its own thread
+        executor = ThreadPoolExecutor(max_workers=num_requests)
+        input_types = {port.name: onnx_types.get(port.type, np.float32) for port in session.get_inputs()}
+        return ExecutableNetwork([ONNXRuntimeRequest(session, executor, input_types) for _ in range(num_requests)])
+
+    def set_config(self, config, device):
+        for key, value in config.items():
+            if key in onnx_options:
+                self.config.setdefault(device, {})[key] = value
+            else:
+                log.warning(f"ONNX Runtime backend ignores config {key} of {device}")
+
+    def supports_export(self, device):
+        return False
+
+    def _session_key(self, device):
+        return (device, tuple(sorted(self.config.get(device, {}).items())))
+
+    def _create_session(self, path, device):
+        options = onnxruntime.SessionOptions()
+        for key, value in self.config.get(device, {}).items():
+            name, convert = onnx_options[key]
+            setattr(options, name, convert(value))
+        return onnxruntime.InferenceSession(path, options, providers=onnx_providers.get(device, [device]))
+
+def _onnx_shape(port):
+    # Symbolic dimensions as their names, unknown ones as None, as ONNX Runtime gives them
+    return [dim.dim_value if dim.HasField("dim_value") else (dim.dim_param or None) \
+        for dim in port.type.tensor_type.shape.dim]
+
+### Latency of precisions of synthetic models relative to FP16-INT8, FP16 runs as FP32 on CPU
+synthetic_precision_scale = {"FP32": 1.6, "FP16": 1.6, "FP16-INT8": 1.0}
+
+### Models known to the synthetic backend: inputs, outputs (in order of the IR),
+### range of output values and default latency (seconds) at FP16-INT8
+synthetic_models = {
+    "face-detection-adas-0001": {
+        "inputs": {"data": [1, 3, 384, 672]},
+        "outputs": {"detection_out": [1, 1, 200, 7]},
+        "latency": 0.012,
+    },
+    "landmarks-regression-retail-0009": {
+        "inputs": {"0": [1, 3, 48, 48]},
+        "outputs": {"95": [1, 10, 1, 1]},
+        "values": (0.25, 0.75),
+        "latency": 0.001,
+    },
+    "head-pose-estimation-adas-0001": {
+        "inputs": {"data": [1, 3, 60, 60]},
+        "outputs": {"angle_p_fc": [1, 1], "angle_r_fc": [1, 1], "angle_y_fc": [1, 1]},
+        "values": (-20.0, 20.0),
+        "latency": 0.002,
+    },
+    "gaze-estimation-adas-0002": {
+        "inputs": {"head_pose_angles": [1, 3], "left_eye_image": [1, 3, 60, 60], "right_eye_image": [1, 3, 60, 60]},
+        "outputs": {"gaze_vector": [1, 3]},
+        "values": (-0.5, 0.5),
+        "latency": 0.002,
+    },
+}
+
+class SyntheticRequest(InferRequest):
+    def __init__(self, network, executor, outputs, latency):
+        super().__init__(executor)
+        self.input_shapes = {name: tuple(port.shape) for name, port in network.inputs.items()}
+        self.fixed_outputs = outputs
+        self.latency = latency
+
+    def _copy_inputs(self, inputs):
+        # Input data is never read, only its shape is checked
+        return {name: blob.shape for name, blob in inputs.items()}
+
+    def _infer(self, inputs):
+        for name, shape in inputs.items():
+            if shape != self.input_shapes[name]:
+                raise ValueError(f"Input {name} has shape {shape}, expected {self.input_shapes[name]}")
+        time.sleep(self.latency)
+        return self.fixed_outputs
+
+class SyntheticBackend:
+    '''
+    Backend which runs no model. Each inference sleeps for a simulated latency
+    and returns outputs of the right shape, the same for every inference.
+    Latency scales with batch size, input size (of reshaped networks) and precision.
+    Detection outputs (last dimension 7) hold one face in the middle of the frame.
+
+    latency: Seconds per inference for all models. If None, each model uses its
+             default from synthetic_models.
+    batch_scale: Fraction of latency added for each item of a batch after the first.
+    parallelism: Number of inferences run at once on a device, like streams of a plugin.
+    seed: Seed of the generated output values.
+    '''
+    name = "synthetic"
+    supports_cache = False
+
+    def __init__(self, latency=None, batch_scale=0.5, parallelism=1, seed=0):
+        self.latency = latency
+        self.batch_scale = batch_scale
+        self.parallelism = parallelism
+        self.seed = seed
+        self.executors = {}
+        self.lock = threading.Lock()
+
+    def read_network(self, model_xml):
+        name = os.path.splitext(os.path.basename(model_xml))[0]
+        if name not in synthetic_models:
+            raise ValueError(f"Unknown model {name} for synthetic backend. Known models are {list(synthetic_models)}")
+        spec = synthetic_models[name]
+        return Network(name, model_xml, spec["inputs"], spec["outputs"])
+
+    def query_network(self, network, device):
+        return {layer: device for layer in network.layers}
+
+    def load_network(self, network, device, num_requests=1):
+        spec = synthetic_models[network.name]
+        latency = self.latency if self.latency is not None else spec["latency"]
+        latency *= 1 + self.batch_scale * (network.batch_size - 1)
+        first_input = next(iter(spec["inputs"]))
+        latency *= np.prod(network.inputs[first_input].shape[1:]) / np.prod(spec["inputs"][first_input][1:])
+        precision = os.path.basename(os.path.dirname(os.path.abspath(network.path)))
+        latency *= synthetic_precision_scale.get(precision, 1.0)
+        outputs = self._make_outputs(network, spec.get("values", (0.0, 1.0)))
+
+        with self.lock:
+            executor = self.executors.get(device)
+            if executor is None:
+                executor = self.executors[device] = ThreadPoolExecutor(max_workers=self.parallelism)
+        return ExecutableNetwork([SyntheticRequest(network, executor, outputs, latency) for _ in range(num_requests)])
+
+    def set_config(self, config, device):
+        pass
+
+    def supports_export(self, device):
+        return False
+
+    def _make_outputs(self, network, values):
+        rng = np.random.RandomState(zlib.crc32(network.name.encode()) ^ self.seed)
+        outputs = {}
+        for name, port in network.outputs.items():
+            if port.shape[-1] == 7:
+                # Rows of [image_id, label, confidence, xmin, ymin, xmax, ymax], id -1 ends the list
+                blob = np.zeros(port.shape, dtype=np.float32)
+                blob[..., 0] = -1
+                blob[..., 0, :] = [0, 1, 0.99, 0.35, 0.2, 0.65, 0.8]
+            else:
+                blob = rng.uniform(values[0], values[1], port.shape).astype(np.float32)
+            outputs[name] = blob
+        return outputs
+
+def create_backend(spec):
+    '''
+    Creates backend from spec: 'openvino', 'onnxruntime' or 'synthetic[:<latency ms>]'.
+    '''
+    kind, _, arg = spec.partition(":")
+    if kind == "openvino":
+        return OpenVINOBackend()
+    if kind == "onnxruntime":
+        return ONNXRuntimeBackend()
+    if kind == "synthetic":
+        return SyntheticBackend(float(arg) / 1000 if arg else None)
+    raise ValueError(f"Invalid backend '{spec}'. Valid values are 'openvino', 'onnxruntime', 'synthetic[:<latency ms>]'")
+
+### Backend used by models and registries created without an explicit backend
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+def set_default_backend(backend):
+    global _default_backend
+    with _default_backend_lock:
+        _default_backend = backend
+
+def get_default_backend():
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = OpenVINOBackend()
+        return _default_backend
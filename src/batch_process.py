@@ -0,0 +1,250 @@
+'''
+Headless batch processing of recorded videos.
+Each video is split into shards of consecutive frames, and shards are run by a
+pool of worker processes, each with its own loaded models and a share of the
+CPU cores. Per-face results of all shards are merged in order of frames and
+saved with ResultRecorder (fields are listed in result_store.py), as a columnar
+.npz file or as raw binary which can be memory mapped.
+
+Frames without a face have no rows. Metadata holds the paths of `videos`, the
+index of a row's video in the `video` field, and `frame_counts`, the number of
+frames processed of each video.
+'''
+import logging as log
+import math
+import mimetypes
+import multiprocessing
+import os
+import time
+from argparse import ArgumentParser
+
+import cv2
+import numpy as np
+
+from face_detection import Face_Detection
+from facial_landmarks_detection import Facial_Landmarks_Detection
+from head_pose_estimation import Head_Pose_Estimation
+from gaze_estimation import Gaze_Estimation
+from model_registry import ModelRegistry
+from backends import create_backend, set_default_backend
+from model_manager import ModelSet, model_names
+from pipeline import Pipeline
+from stages import GroupStages
+from result_store import ResultRecorder
+
+### Fewest frames of a shard cut shorter so that all workers get one, as each shard starts with a seek
+min_shard_frames = 60
+
+### ModelSet of the worker process, loaded once by init_worker
+models = None
+worker_options = None
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--input", required=True, type=str, \
+        help="Path to video file or to directory of video files")
+
+    parser.add_argument("-o", "--output", required=False, type=str, default="results.npz", \
+        help="Path of file results are saved to, as .npz or as raw binary for any other extension (default results.npz)")
+
+    parser.add_argument("-w", "--workers", required=False, type=int, default=os.cpu_count(), \
+        help="Number of worker processes (default number of CPU cores)")
+
+    parser.add_argument("-s", "--shard_seconds", required=False, type=float, default=60.0, \
+        help="Length of video processed by a worker at a time, in seconds of video (default 60)")
+
+    parser.add_argument("-d", "--device", required=False, type=str, default="CPU", \
+        help="Device to run inference on (default CPU)")
+
+    parser.add_argument("-p", "--precision", required=False, type=str, default="FP16-INT8", \
+        help="Precision of models (default FP16-INT8)")
+
+    parser.add_argument("-be", "--backend", required=False, type=str, default="openvino", \
+        help="Inference backend: 'openvino', 'onnxruntime' or 'synthetic[:<latency ms>]' (default openvino)")
+
+    parser.add_argument("-b", "--batch_size", required=False, type=int, default=1, \
+        help="Number of faces per inference of landmarks, head pose and gaze models (default 1)")
+
+    parser.add_argument("-nr", "--num_requests", required=False, type=int, default=2, \
+        help="Number of infer requests of each model kept in flight by a worker (default 2)")
+
+    parser.add_argument("-es", "--eye_scale", required=False, type=float, default=0.7, \
+        help="Width of eye crops relative to the distance between the eyes (default 0.7)")
+
+    parser.add_argument("-c", "--cache_dir", required=False, type=str, default="models/cache", \
+        help="Directory to cache loaded networks in (default models/cache)")
+
+    return parser
+
+def get_model_path(model, precision):
+    name = model_names[model]
+    return f"models/intel/{name}/{precision}/{name}.xml"
+
+### List video files at path, sorted by name for directories
+def list_videos(input_path):
+    if not os.path.isdir(input_path):
+        return [input_path]
+    videos = []
+    for name in sorted(os.listdir(input_path)):
+        path = os.path.join(input_path, name)
+        mime_type = mimetypes.guess_type(path)[0]
+        if os.path.isfile(path) and mime_type is not None and mime_type.startswith("video"):
+            videos.append(path)
+    return videos
+
+def make_shards(videos, shard_seconds, workers=1):
+    '''
+    Returns list of (video index, start frame, end frame, fps) of shards, in order.
+    End frame is None if the frame count of the video is unknown, then the
+    whole video is one shard. Videos which would give fewer shards than workers
+    are cut into shards of about frame_count / workers frames instead, but not
+    shorter than min_shard_frames.
+    '''
+    shards = []
+    for video_index, path in enumerate(videos):
+        cap = cv2.VideoCapture(path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        cap.release()
+        if frame_count <= 0:
+            shards.append((video_index, 0, None, fps))
+            continue
+        shard_frames = max(int(round(shard_seconds * fps)), 1)
+        if math.ceil(frame_count / shard_frames) < workers:
+            shard_frames = min(shard_frames, max(math.ceil(frame_count / workers), min_shard_frames))
+        for start in range(0, frame_count, shard_frames):
+            shards.append((video_index, start, min(start + shard_frames, frame_count), fps))
+    return shards
+
+### Load models of the worker process, with inference threads limited to its share of cores
+def init_worker(options, videos):
+    global models
+    global worker_options
+
+    worker_options = dict(options, videos=videos)
+    cv2.setNumThreads(1)
+    set_default_backend(create_backend(options["backend"]))
+
+    config = {}
+    if options["device"] == "CPU":
+        config["CPU"] = {"CPU_THREADS_NUM": str(options["threads"])}
+    registry = ModelRegistry(options["cache_dir"], config)
+
+    precision = options["precision"]
+    batch_size = options["batch_size"]
+    face_detection = Face_Detection(get_model_path("face_detection", precision), options["device"])
+    facial_landmarks_detection = Facial_Landmarks_Detection( \
+        get_model_path("facial_landmarks_detection", precision), options["device"], batch_size)
+    head_pose_estimation = Head_Pose_Estimation( \
+        get_model_path("head_pose_estimation", precision), options["device"], batch_size)
+    gaze_estimation = Gaze_Estimation(get_model_path("gaze_estimation", precision), options["device"], batch_size)
+    registry.load_models([face_detection, facial_landmarks_detection, head_pose_estimation, gaze_estimation], \
+        options["num_requests"])
+    models = ModelSet(face_detection, facial_landmarks_detection, head_pose_estimation, gaze_estimation, precision, 1.0)
+
+### Yield groups of one frame of a shard, seeking to its first frame
+def read_shard(path, start, end, counter):
+    cap = cv2.VideoCapture(path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    index = start
+    while end is None or index < end:
+        flag, frame = cap.read()
+        if not flag:
+            break
+        counter[0] += 1
+        yield {"records": [{"index": index, "frame": frame}], "models": models}
+        index += 1
+    cap.release()
+
+def process_shard(shard):
+    '''
+    Runs all models on frames of shard in the worker process.
+    Returns (shard, number of frames read, dict of result columns, seconds taken).
+    '''
+    video_index, start, end, fps = shard
+    # All faces of each frame are processed, frames without a face are dropped
+    stages = GroupStages(multi_face=True, eye_scale=worker_options["eye_scale"], drop_empty=True)
+    pipeline = Pipeline(stages.get_stages(worker_options["num_requests"]))
+
+    start_time = time.perf_counter()
+    counter = [0]
+    rows = {"frame": [], "face": [], "face_box": [], "landmarks": [], "head_pose_angles": [], "gaze_vector": []}
+    for group in pipeline.run(read_shard(worker_options["videos"][video_index], start, end, counter)):
+        record = group["records"][0]
+        for i, face in enumerate(record["faces"]):
+            rows["frame"].append(record["index"])
+            rows["face"].append(i)
+            rows["face_box"].append(face["face_box"])
+            rows["landmarks"].append(face["landmarks"])
+            rows["head_pose_angles"].append(face["head_pose_angles"])
+            rows["gaze_vector"].append(face["gaze_vector"])
+
+    count = len(rows["frame"])
+    columns = {
+        "video": np.full(count, video_index, dtype=np.int32),
+        "frame": np.array(rows["frame"], dtype=np.int64),
+        "time": np.array(rows["frame"], dtype=np.float64) / fps,
+        "face": np.array(rows["face"], dtype=np.int16),
+        "face_box": np.array(rows["face_box"], dtype=np.float32).reshape(count, 4),
+        "landmarks": np.array(rows["landmarks"], dtype=np.float32).reshape(count, 2, 2),
+        "head_pose_angles": np.array(rows["head_pose_angles"], dtype=np.float32).reshape(count, 3),
+        "gaze_vector": np.array(rows["gaze_vector"], dtype=np.float32).reshape(count, 3),
+        "variant": np.full(count, worker_options["precision"], dtype="S16"),
+    }
+    return shard, counter[0], columns, time.perf_counter() - start_time
+
+def run(videos, args, recorder):
+    '''
+    Processes videos with a pool of worker processes, appending results to recorder in order.
+    Returns number of frames processed of each video.
+    '''
+    shards = make_shards(videos, args.shard_seconds, args.workers)
+    workers = max(min(args.workers, len(shards)), 1)
+    options = {
+        "backend": args.backend,
+        "device": args.device,
+        "precision": args.precision,
+        "batch_size": args.batch_size,
+        "num_requests": args.num_requests,
+        "eye_scale": args.eye_scale,
+        "cache_dir": args.cache_dir,
+        # Each worker gets its share of cores, so that workers do not compete for them
+        "threads": max(os.cpu_count() // workers, 1),
+    }
+    log.info(f"Processing {len(videos)} videos in {len(shards)} shards with {workers} workers")
+
+    frame_counts = [0] * len(videos)
+    # Workers are spawned, so no runtime state of this process is inherited
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, init_worker, (options, videos)) as pool:
+        # imap returns results in order of shards, so merged rows are in order of frames
+        for (video_index, start, _, _), count, columns, seconds in pool.imap(process_shard, shards):
+            frame_counts[video_index] += count
+            recorder.append_columns(columns)
+            log.info(f"{os.path.basename(videos[video_index])} frames {start}-{start + count}: " \
+                f"{len(columns['frame'])} faces, {round(count / max(seconds, 1e-6), 1)} frames/s")
+    return frame_counts
+
+def main():
+    args = build_argparser().parse_args()
+    log.basicConfig(level = log.INFO, format = '%(levelname)s: %(message)s')
+
+    videos = list_videos(args.input)
+    if len(videos) == 0:
+        log.error("No video files found at input path!")
+        exit(1)
+
+    start = time.perf_counter()
+    recorder = ResultRecorder(args.output, metadata={"videos": videos, "eye_scale": args.eye_scale})
+    frame_counts = run(videos, args, recorder)
+    recorder.metadata["frame_counts"] = frame_counts
+    recorder.close()
+    elapsed = time.perf_counter() - start
+
+    total = sum(frame_counts)
+    log.info(f"Processed {total} frames in {round(elapsed, 1)} s ({round(total / elapsed, 1)} frames/s), " \
+        f"{recorder.count} faces saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
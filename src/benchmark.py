@@ -1,58 +1,91 @@
+'''
+Benchmark suite for the models of the app.
+Runs every combination of backend, precision, device, batch size, number of
+infer requests and number of CPU threads given on the command line, and reports
+load times, per-model latency percentiles & fps, and end-to-end fps.
+Results can be saved as JSON or CSV, and compared against a saved baseline.
+'''
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
 import cv2
+import numpy as np
+
 from face_detection import Face_Detection
 from head_pose_estimation import Head_Pose_Estimation
 from facial_landmarks_detection import Facial_Landmarks_Detection
 from gaze_estimation import Gaze_Estimation
+from model_registry import ModelRegistry
+from model_manager import model_names
+from backends import create_backend
+from input_feeder import InputFeeder
+from pipeline import Pipeline
+from infer_request_pool import chain
+from eye_roi import extract_eyes
+from postprocessing import scale_boxes
 
-import time
+path_cache = "models/cache/benchmark"
+
+### Frames decoded for the throughput of face detection, submitted in turn so memory stays bounded
+throughput_frames = 32
+
+### Metrics compared against the baseline, with True if a higher value is better
+compared_metrics = {
+    "fps": True,
+    "throughput_fps": True,
+    "p95_ms": False,
+}
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--input", required=False, type=str, default="media/demo.mp4", \
+        help="Path to input video (default media/demo.mp4)")
+
+    parser.add_argument("-be", "--backends", required=False, type=str, nargs="+", default=["openvino"], \
+        help="Inference backends to run: openvino, onnxruntime, synthetic[:<latency ms>] (default openvino)")
+
+    parser.add_argument("-p", "--precisions", required=False, type=str, nargs="+", default=["FP16-INT8"], \
+        help="Precisions of models to run, e.g. FP32 FP16 FP16-INT8 (default FP16-INT8)")
+
+    parser.add_argument("-d", "--devices", required=False, type=str, nargs="+", default=["CPU"], \
+        help="Devices to run inference on (default CPU)")
+
+    parser.add_argument("-b", "--batch_sizes", required=False, type=int, nargs="+", default=[1], \
+        help="Batch sizes of landmarks, head pose and gaze models (default 1)")
+
+    parser.add_argument("-nr", "--num_requests", required=False, type=int, nargs="+", default=[1], \
+        help="Numbers of infer requests per model (default 1)")
+
+    parser.add_argument("-nt", "--num_threads", required=False, type=int, nargs="+", default=[0], \
+        help="Numbers of CPU inference threads, 0 for plugin default (default 0)")
+
+    parser.add_argument("-w", "--warmup", required=False, type=int, default=10, \
+        help="Number of frames run before timing starts (default 10)")
+
+    parser.add_argument("-f", "--frames", required=False, type=int, default=300, \
+        help="Max number of frames timed, 0 for the whole input (default 300)")
+
+    parser.add_argument("-o", "--output", required=False, type=str, default=None, \
+        help="Save results to this .json or .csv file")
+
+    parser.add_argument("--compare", required=False, type=str, default=None, \
+        help="Compare results against baseline .json file saved with -o, exit with 1 on regression")
+
+    parser.add_argument("--tolerance", required=False, type=float, default=0.1, \
+        help="Fraction by which a metric may be worse than baseline before it is a regression (default 0.1)")
 
-prec_face_detection = "FP16-INT8"
-prec_landmarks_detection = "FP16-INT8"
-prec_head_pose_estimation = "FP16-INT8"
-prec_gaze_estimation = "FP16-INT8"
-
-path_input = "media/demo.mp4"
-
-path_face_detection = "models/intel/face-detection-adas-0001/" + prec_face_detection + "/face-detection-adas-0001.xml"
-path_facial_landmarks_detection = "models/intel/landmarks-regression-retail-0009/" + prec_landmarks_detection + "/landmarks-regression-retail-0009.xml"
-path_head_pose_estimation = "models/intel/head-pose-estimation-adas-0001/" + prec_head_pose_estimation + "/head-pose-estimation-adas-0001.xml"
-path_gaze_estimation = "models/intel/gaze-estimation-adas-0002/" + prec_gaze_estimation + "/gaze-estimation-adas-0002.xml"
-
-### Model global variables
-face_detection = None
-facial_landmarks_detection = None
-head_pose_estimation = None
-gaze_estimation = None
-
-### Initiate & load all required models
-def init_models(device="CPU"):
-    # Using global variables, not defining new variables
-    global face_detection
-    global facial_landmarks_detection
-    global head_pose_estimation
-    global gaze_estimation
-
-    start = time.time()
-    face_detection = Face_Detection(path_face_detection, device)
-    face_detection.load_model()
-    fd_load_time = (time.time() - start)
-
-    start = time.time()
-    facial_landmarks_detection = Facial_Landmarks_Detection(path_facial_landmarks_detection, device)
-    facial_landmarks_detection.load_model()
-    fld_load_time = (time.time() - start)
-
-    start = time.time()
-    head_pose_estimation = Head_Pose_Estimation(path_head_pose_estimation, device)
-    head_pose_estimation.load_model()
-    hpe_load_time = (time.time() - start)
-
-    start = time.time()
-    gaze_estimation = Gaze_Estimation(path_gaze_estimation, device)
-    gaze_estimation.load_model()
-    ge_load_time = (time.time() - start)
-
-    return (fd_load_time, fld_load_time, hpe_load_time, ge_load_time)
+    return parser
+
+def get_model_path(model, precision):
+    name = model_names[model]
+    return f"models/intel/{name}/{precision}/{name}.xml"
+
+def get_millis(seconds):
+    return int(round(seconds * 1000))
 
 ### Crop rectangle from given coordinates
 def crop_rect(image, coords):
@@ -65,90 +98,349 @@ def crop_rect(image, coords):
 
     return crop
 
-def get_millis(seconds):
-    return int(round(seconds * 1000))
-
-def run_face_benchmark():
-    fd_load_time, fld_load_time, hpe_load_time, ge_load_time = init_models()
-
-    cap = cv2.VideoCapture(path_input)
-    cap.open(path_input)
-
-    width = int(cap.get(3))
-    height = int(cap.get(4))
-
-    fd_total_time = 0
-    fld_total_time = 0
-    hpe_total_time = 0
-    ge_total_time = 0
-
-    counter = 0
-    while(cap.isOpened()):
-        flag, frame = cap.read()
-        if not flag:
-            break
-
-        counter += 1
-        
-        fd_start = time.time()
-        box_coords = face_detection.predict(frame)
-        fd_total_time += (time.time() - fd_start)
-
-        face_coords = box_coords[0]
-        xmin = int(face_coords[0] * width)
-        ymin = int(face_coords[1] * height)
-        xmax = int(face_coords[2] * width)
-        ymax = int(face_coords[3] * height)
-        face = crop_rect(frame, (xmin, ymin, xmax, ymax))
-        face_height, face_width, _ = face.shape
-
-        fld_start = time.time()
-        eye_landmarks = facial_landmarks_detection.predict(face)
-        fld_total_time += (time.time() - fld_start)
-
-        landmarks_pos = [(int(l[0] * face_width), int(l[1] * face_height)) for l in eye_landmarks]
-        left_eye_pos = landmarks_pos[0]
-        right_eye_pos = landmarks_pos[1]
-        left_eye_coords = [left_eye_pos[0] - 35, left_eye_pos[1] - 20, left_eye_pos[0] + 35, left_eye_pos[1] + 20]
-        right_eye_coords = [right_eye_pos[0] - 35, right_eye_pos[1] - 20, right_eye_pos[0] + 35, right_eye_pos[1] + 20]
-        
-        # Zero out any negative values
-        for i in range(4):
-            left_eye_coords[i] = max(left_eye_coords[i], 0)
-            right_eye_coords[i] = max(right_eye_coords[i], 0)
-        left_eye = crop_rect(face, left_eye_coords)
-        right_eye = crop_rect(face, right_eye_coords)
-
-        hpe_start = time.time()
-        head_pose_angles = head_pose_estimation.predict(face)
-        hpe_total_time += (time.time() - hpe_start)
-
-        ge_start = time.time()
-        gaze_vector = gaze_estimation.predict(left_eye, right_eye, head_pose_angles)
-        ge_total_time += (time.time() - ge_start)
-
-    print("\n")
-    print(f"Total frames in input: {counter}")
-    print("=========== BENCHMARK ============")
-
-    print(f"Face Detection ({prec_face_detection})")
-    print(f"Load Time: {get_millis(fd_load_time)} ms   Total time: {get_millis(fd_total_time)} ms   fps: {round(counter / fd_total_time, 2)} frames/s")
-    print("\n")
-
-    print(f"Face Landmarks Detection ({prec_landmarks_detection})")
-    print(f"Load Time: {get_millis(fld_load_time)} ms   Total time: {get_millis(fld_total_time)} ms   fps: {round(counter / fld_total_time, 2)} frames/s")
-    print("\n")
-
-    print(f"Head Pose Estimation ({prec_head_pose_estimation})")
-    print(f"Load Time: {get_millis(hpe_load_time)} ms   Total time: {get_millis(hpe_total_time)} ms   fps: {round(counter / hpe_total_time, 2)} frames/s")
-    print("\n")
-
-    print(f"Gaze Estimation ({prec_gaze_estimation})")
-    print(f"Load Time: {get_millis(ge_load_time)} ms   Total time: {get_millis(ge_total_time)} ms   fps: {round(counter / ge_total_time, 2)} frames/s")
+### Crop all detected faces, frames without a face give an empty list
+def crop_faces(frame, box_coords):
+    height, width, _ = frame.shape
+    faces = []
+    for face_box in scale_boxes(box_coords, width, height):
+        face = crop_rect(frame, face_box)
+        if face.size > 0:
+            faces.append(face)
+    return faces
+
+### Copies of images resized to the input size of model, so they keep no frame in memory
+def copy_inputs(model, images):
+    size = tuple(model.get_input_size())
+    return [cv2.resize(image, size) for image in images]
+
+def crop_all_eyes(faces, batch_eye_landmarks, eye_size=(60, 60)):
+    eyes = [extract_eyes(face, eye_landmarks, out_size=eye_size)[0] \
+        for face, eye_landmarks in zip(faces, batch_eye_landmarks)]
+    return [e[0] for e in eyes], [e[1] for e in eyes]
+
+def read_frames(input_path, max_frames=0):
+    feed = InputFeeder("video", input_path, "all")
+    feed.load_data()
+    try:
+        count = 0
+        for frame in feed.next_batch():
+            if frame is None or (max_frames > 0 and count == max_frames):
+                break
+            count += 1
+            yield frame
+    finally:
+        feed.close()
+
+def summarize_latencies(latencies):
+    '''
+    Returns count, fps and mean, p50, p95 & p99 latency (ms) of latencies in seconds.
+    '''
+    if len(latencies) == 0:
+        return {"count": 0, "fps": 0.0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    values = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(latencies),
+        "fps": round(len(latencies) * 1000 / values.sum(), 2),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+### Load models one after another to time each of them separately
+def load_models(config, registry):
+    _, precision, device, batch_size, num_requests, _ = config
+    backend = registry.backend
+    models = {
+        "face_detection": Face_Detection(get_model_path("face_detection", precision), device, backend=backend),
+        "facial_landmarks_detection": Facial_Landmarks_Detection( \
+            get_model_path("facial_landmarks_detection", precision), device, batch_size, backend),
+        "head_pose_estimation": Head_Pose_Estimation( \
+            get_model_path("head_pose_estimation", precision), device, batch_size, backend),
+        "gaze_estimation": Gaze_Estimation( \
+            get_model_path("gaze_estimation", precision), device, batch_size, backend),
+    }
+    load_times = {}
+    for name, model in models.items():
+        model.load_model(num_requests, registry)
+        load_times[name] = registry.load_times[model.model_xml][0]
+    return models, load_times
+
+### Initiate & load all models of a configuration, returns models and their load times
+def init_models(config):
+    backend, device, num_threads = config[0], config[2], config[5]
+    plugin_config = {}
+    if num_threads > 0 and device == "CPU":
+        plugin_config[device] = {"CPU_THREADS_NUM": str(num_threads)}
+
+    # Cold load compiles every network into an empty cache
+    registry = ModelRegistry(path_cache, plugin_config, create_backend(backend))
+    registry.clear_cache()
+    _, cold_load_times = load_models(config, registry)
+
+    # Warm load with a new backend, as on restart of the app
+    models, warm_load_times = load_models(config, ModelRegistry(path_cache, plugin_config, create_backend(backend)))
+
+    load_times = {name: {"load_cold_ms": get_millis(cold_load_times[name]), \
+        "load_warm_ms": get_millis(warm_load_times[name])} for name in models}
+    return models, load_times
+
+### Run models one after another on each frame to time their latency
+def run_latency_benchmark(models, args):
+    latencies = {name: [] for name in models}
+    end_to_end = []
+    frame_count = 0
+    no_face_count = 0
+    # Inputs of downstream models resized to their input sizes, reused by the throughput benchmark
+    face_inputs = []
+    # Time spent cropping faces and eyes
+    crop_time = 0.0
+    eye_size = models["gaze_estimation"].get_input_size()
+
+    max_frames = args.warmup + args.frames if args.frames > 0 else 0
+    for i, frame in enumerate(read_frames(args.input, max_frames)):
+        if i == args.warmup:
+            for model in models.values():
+                model.preprocess_time = 0
+            crop_time = 0.0
+        times = {}
+        start = time.perf_counter()
+        box_coords = models["face_detection"].predict(frame)
+        times["face_detection"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        faces = crop_faces(frame, box_coords)
+        crop_time += time.perf_counter() - start
+        if len(faces) > 0:
+            start = time.perf_counter()
+            landmarks_model = models["facial_landmarks_detection"]
+            batch_eye_landmarks = landmarks_model.predict_batch(faces)
+            times["facial_landmarks_detection"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            left_eyes, right_eyes = crop_all_eyes(faces, batch_eye_landmarks, eye_size)
+            crop_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            head_pose_model = models["head_pose_estimation"]
+            batch_head_pose_angles = head_pose_model.predict_batch(faces)
+            times["head_pose_estimation"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            models["gaze_estimation"].predict_batch(left_eyes, right_eyes, batch_head_pose_angles)
+            times["gaze_estimation"] = time.perf_counter() - start
+
+        if i < args.warmup:
+            continue
+        frame_count += 1
+        if len(faces) == 0:
+            # Downstream models have nothing to run on
+            no_face_count += 1
+        else:
+            face_inputs.append((copy_inputs(landmarks_model, faces), copy_inputs(head_pose_model, faces), \
+                copy_inputs(models["gaze_estimation"], left_eyes), copy_inputs(models["gaze_estimation"], right_eyes), \
+                batch_head_pose_angles))
+        for name, seconds in times.items():
+            latencies[name].append(seconds)
+        end_to_end.append(sum(times.values()))
+
+    results = {name: summarize_latencies(latencies[name]) for name in models}
+    for name, model in models.items():
+        results[name]["preprocess_ms_per_frame"] = round(model.preprocess_time * 1000 / max(frame_count, 1), 3)
+    results["end_to_end"] = summarize_latencies(end_to_end)
+    results["end_to_end"]["crop_ms_per_frame"] = round(crop_time * 1000 / max(frame_count, 1), 3)
+    return results, frame_count, no_face_count, face_inputs
+
+### Submit all inputs of each model at once, keeping all its infer requests busy
+def run_throughput_benchmark(models, args, face_inputs, frame_count):
+    submits = {
+        "facial_landmarks_detection": lambda landmarks_inputs, head_pose_inputs, left_eyes, right_eyes, angles: \
+            models["facial_landmarks_detection"].predict_batch_async(landmarks_inputs),
+        "head_pose_estimation": lambda landmarks_inputs, head_pose_inputs, left_eyes, right_eyes, angles: \
+            models["head_pose_estimation"].predict_batch_async(head_pose_inputs),
+        "gaze_estimation": lambda landmarks_inputs, head_pose_inputs, left_eyes, right_eyes, angles: \
+            models["gaze_estimation"].predict_batch_async(left_eyes, right_eyes, angles),
+    }
+
+    # As many detections as frames were timed, on a bounded set of frames
+    frames = list(read_frames(args.input, min(frame_count, throughput_frames)))
+    count = frame_count if len(frames) > 0 else 0
+    start = time.perf_counter()
+    futures = [models["face_detection"].predict_async(frames[i % len(frames)]) for i in range(count)]
+    for future in futures:
+        future.result()
+    throughput = {"face_detection": count / (time.perf_counter() - start) if count > 0 else 0.0}
+
+    for name, submit in submits.items():
+        if len(face_inputs) == 0:
+            throughput[name] = 0.0
+            continue
+        start = time.perf_counter()
+        futures = [submit(*inputs) for inputs in face_inputs]
+        for future in futures:
+            future.result()
+        throughput[name] = len(face_inputs) / (time.perf_counter() - start)
+
+    return {name: round(fps, 2) for name, fps in throughput.items()}
+
+### Run all models as a pipeline, as the app does, returns frames per second
+def run_pipeline_benchmark(models, args, num_requests):
+    eye_size = models["gaze_estimation"].get_input_size()
+
+    def detect_face(frame):
+        return chain(models["face_detection"].predict_async(frame), \
+            lambda box_coords: crop_faces(frame, box_coords) or None)
+
+    def detect_landmarks(faces):
+        landmarks_model = models["facial_landmarks_detection"]
+        return chain(landmarks_model.predict_batch_async(faces), \
+            lambda batch_eye_landmarks: (faces, *crop_all_eyes(faces, batch_eye_landmarks, eye_size)))
+
+    def estimate_head_pose(item):
+        faces, left_eyes, right_eyes = item
+        return chain(models["head_pose_estimation"].predict_batch_async(faces), \
+            lambda batch_head_pose_angles: (left_eyes, right_eyes, batch_head_pose_angles))
+
+    def estimate_gaze(item):
+        return models["gaze_estimation"].predict_batch_async(*item)
+
+    pipeline = Pipeline([
+        ("face_detection", detect_face, num_requests),
+        ("facial_landmarks_detection", detect_landmarks, num_requests),
+        ("head_pose_estimation", estimate_head_pose, num_requests),
+        ("gaze_estimation", estimate_gaze, num_requests),
+    ])
+
+    # Frames are streamed, decoded by the feeder thread next to inference as in the app
+    frame_count = 0
+    start = time.perf_counter()
+    for frame in pipeline.run(read_frames(args.input, args.frames)):
+        frame_count += 1
+    elapsed = time.perf_counter() - start
+    return round(frame_count / elapsed, 2) if frame_count > 0 else 0.0
+
+def run_config(config, args):
+    backend, precision, device, batch_size, num_requests, num_threads = config
+    models, load_times = init_models(config)
+    latencies, frame_count, no_face_count, face_inputs = run_latency_benchmark(models, args)
+    throughput = run_throughput_benchmark(models, args, face_inputs, frame_count)
+
+    result = {
+        "backend": backend,
+        "precision": precision,
+        "device": device,
+        "batch_size": batch_size,
+        "num_requests": num_requests,
+        "num_threads": num_threads,
+        "frames": frame_count,
+        "frames_without_face": no_face_count,
+        "models": {},
+    }
+    for name in models:
+        result["models"][name] = dict(latencies[name], throughput_fps=throughput[name], **load_times[name])
+    result["end_to_end"] = dict(latencies["end_to_end"], \
+        throughput_fps=run_pipeline_benchmark(models, args, num_requests))
+    return result
+
+def get_config_key(result):
+    # Baselines saved before backends were added ran on OpenVINO
+    return (result.get("backend", "openvino"), result["precision"], result["device"], result["batch_size"], result["num_requests"], result["num_threads"])
+
+def print_result(result):
     print("\n")
+    print(f"=========== {result['backend']} {result['precision']} on {result['device']}, batch size {result['batch_size']}, " \
+        f"{result['num_requests']} requests, {result['num_threads'] or 'default'} threads ============")
+    print(f"Frames timed: {result['frames']}   without face: {result['frames_without_face']}")
+    for name, stats in result["models"].items():
+        print(f"{name}")
+        print(f"Load Time: {stats['load_cold_ms']} ms cold, {stats['load_warm_ms']} ms warm   " \
+            f"Preprocess time per frame: {stats['preprocess_ms_per_frame']} ms")
+        print(f"fps: {stats['fps']}   throughput: {stats['throughput_fps']} fps   " \
+            f"Latency: p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms")
+    stats = result["end_to_end"]
+    print("end_to_end")
+    print(f"fps: {stats['fps']}   pipelined: {stats['throughput_fps']} fps   " \
+        f"Latency: p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms")
+    print(f"Face and eye crop time per frame: {stats['crop_ms_per_frame']} ms")
+
+### Flatten result into one CSV row, with columns named <model>.<metric>
+def flatten_result(result):
+    row = {key: value for key, value in result.items() if key not in ("models", "end_to_end")}
+    for name, stats in list(result["models"].items()) + [("end_to_end", result["end_to_end"])]:
+        for key, value in stats.items():
+            row[f"{name}.{key}"] = value
+    return row
+
+def save_results(results, path):
+    if path.endswith(".csv"):
+        rows = [flatten_result(result) for result in results]
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, "w") as file:
+            json.dump({"time": time.time(), "results": results}, file, indent=2)
+
+def compare_results(results, baseline_path, tolerance):
+    '''
+    Returns list of regressions of results against baseline JSON file.
+    A metric regresses when it is worse than baseline by more than tolerance (fraction).
+    '''
+    with open(baseline_path) as file:
+        baseline = {get_config_key(result): result for result in json.load(file)["results"]}
+
+    regressions = []
+    for result in results:
+        key = get_config_key(result)
+        base = baseline.get(key)
+        if base is None:
+            print(f"No baseline for configuration {key}")
+            continue
+        sections = list(result["models"].items()) + [("end_to_end", result["end_to_end"])]
+        base_sections = dict(base["models"], end_to_end=base["end_to_end"])
+        for name, stats in sections:
+            base_stats = base_sections.get(name, {})
+            for metric, higher_is_better in compared_metrics.items():
+                value = stats.get(metric)
+                base_value = base_stats.get(metric)
+                if value is None or not base_value:
+                    continue
+                if higher_is_better:
+                    regressed = value < base_value * (1 - tolerance)
+                else:
+                    regressed = value > base_value * (1 + tolerance)
+                if regressed:
+                    regressions.append(f"{key} {name} {metric}: {value} (baseline {base_value})")
+    return regressions
 
 def main():
-    run_face_benchmark()
+    args = build_argparser().parse_args()
+    if not os.path.isfile(args.input):
+        print(f"Input file {args.input} not found")
+        sys.exit(1)
+
+    results = []
+    configs = itertools.product(args.backends, args.precisions, args.devices, args.batch_sizes, \
+        args.num_requests, args.num_threads)
+    for config in configs:
+        result = run_config(config, args)
+        print_result(result)
+        results.append(result)
+
+    if args.output is not None:
+        save_results(results, args.output)
+        print(f"\nResults saved to {args.output}")
+
+    if args.compare is not None:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        print("\n=========== COMPARISON ============")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
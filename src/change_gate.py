@@ -0,0 +1,117 @@
+'''
+Skips the models on frames where nothing changed. On kiosk and desk cameras
+long runs of frames are nearly identical while the user reads, so gaze stays
+the same. Before a frame goes through the models, its face region (the faces
+of the last processed frame, with a margin) is downsampled to a small
+thumbnail and compared with the thumbnail of the last processed frame. Gaze
+moves with the eyes alone, which hardly change a thumbnail of the whole face,
+so both eye boxes of the last processed frame are compared as well, each at a
+higher resolution. While all mean differences stay below a threshold, results
+of the last processed frame are reused, up to a max age after which the
+models run again anyway.
+'''
+import threading
+import cv2
+import numpy as np
+
+class ChangeGate:
+    '''
+    threshold: Mean absolute difference of thumbnails (0 to 255) below which a
+               frame counts as unchanged.
+    max_age: Max seconds results of a processed frame are reused.
+    thumbnail_size: (width, height) face regions are downsampled to.
+    margin: Fraction of face size the region extends beyond the face boxes, so
+            movement into the face region is noticed as well.
+    eye_size: (width, height) eye boxes are downsampled to.
+    fps: Frame rate of a video file. Ages are then in video time, from the
+         'index' of records, as files are read faster or slower than real
+         time. Else they are in capture time, from the 'time' of records.
+    '''
+    def __init__(self, threshold=3.0, max_age=1.0, thumbnail_size=(16, 16), margin=0.2, eye_size=(24, 24), fps=None):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.thumbnail_size = thumbnail_size
+        self.margin = margin
+        self.eye_size = eye_size
+        self.fps = fps
+
+        # Last processed record with its face region and eye boxes (px) and their thumbnails
+        self.reference = None
+        self.lock = threading.Lock()
+
+        self.frame_count = 0
+        self.reused_count = 0
+        self.inferences_saved = 0
+
+    def check(self, record):
+        '''
+        Returns the last processed record if the frame of record did not change
+        since, so its results can be reused, else None and the frame is processed.
+        '''
+        with self.lock:
+            reference = self.reference
+            self.frame_count += 1
+        source = None
+        if reference is not None and self._get_time(record) - reference["time"] <= self.max_age:
+            frame = record["frame"]
+            regions = [(reference["region"], self.thumbnail_size)] + [(box, self.eye_size) for box in reference["eyes"]]
+            if all(cv2.absdiff(self._get_thumbnail(frame, region, size), thumbnail).mean() < self.threshold \
+                for (region, size), thumbnail in zip(regions, reference["thumbnails"])):
+                source = reference["record"]
+        if source is not None:
+            with self.lock:
+                self.reused_count += 1
+                # Face detection once, landmarks, head pose and gaze once per face
+                self.inferences_saved += 1 + 3 * reference["faces"]
+        return source
+
+    def update(self, record, face_boxes, eye_boxes=()):
+        '''
+        Makes record, with faces at face_boxes and eyes at eye_boxes (px, as
+        (xmin, ymin, xmax, ymax)), the last processed one which following frames
+        are compared with.
+        '''
+        frame = record["frame"]
+        height, width, _ = frame.shape
+        boxes = np.asarray(face_boxes, dtype=np.float32).reshape(-1, 4)
+        if len(boxes) == 0:
+            return
+        mins = boxes[:, 0:2].min(axis=0)
+        maxs = boxes[:, 2:4].max(axis=0)
+        pad = (maxs - mins) * self.margin
+        xmin, ymin = np.maximum(mins - pad, 0).astype(np.int32)
+        xmax, ymax = np.minimum(maxs + pad, [width, height]).astype(np.int32)
+        if xmax - xmin < 2 or ymax - ymin < 2:
+            return
+        region = (xmin, ymin, xmax, ymax)
+        eyes = np.clip(np.asarray(eye_boxes, dtype=np.int32).reshape(-1, 4), 0, [width, height, width, height])
+        eyes = [tuple(box) for box in eyes if box[2] - box[0] >= 2 and box[3] - box[1] >= 2]
+        thumbnails = [self._get_thumbnail(frame, region, self.thumbnail_size)] + \
+            [self._get_thumbnail(frame, box, self.eye_size) for box in eyes]
+        reference = {"record": record, "time": self._get_time(record), "region": region, "eyes": eyes, \
+            "faces": len(boxes), "thumbnails": thumbnails}
+        with self.lock:
+            self.reference = reference
+
+    def get_stats(self):
+        '''
+        Returns counters of frames checked, frames whose results were reused and
+        model inferences saved by it.
+        '''
+        with self.lock:
+            return {
+                "frames": self.frame_count,
+                "reused": self.reused_count,
+                "reuse_rate": round(self.reused_count / self.frame_count, 3) if self.frame_count > 0 else 0.0,
+                "inferences_saved": self.inferences_saved,
+            }
+
+    def _get_time(self, record):
+        return record["index"] / self.fps if self.fps is not None else record["time"]
+
+    def _get_thumbnail(self, frame, region, size):
+        # Every step-th pixel is averaged, so the cost does not grow with the size of the region
+        xmin, ymin, xmax, ymax = region
+        crop = frame[ymin:ymax, xmin:xmax]
+        step = max(1, min(crop.shape[0], crop.shape[1]) // (4 * min(size)))
+        return cv2.resize(crop[::step, ::step], size, interpolation=cv2.INTER_AREA)
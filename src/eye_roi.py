@@ -0,0 +1,72 @@
+'''
+Extraction of left and right eye regions from a face, for the gaze model.
+Both eye boxes are computed in one step from the eye landmarks and kept
+inside the face, so a crop near an edge of the face is never empty.
+By default eye boxes are sized from the distance between the eyes, so that
+they cover the same part of the face whatever its size in frame.
+'''
+import cv2
+import numpy as np
+
+def get_scaled_half_size(centers, out_size=(60, 60), iod_scale=0.7, snap_tolerance=0.1):
+    '''
+    Returns (x, y) half size of eye boxes with aspect ratio of out_size and width
+    iod_scale times the inter-ocular distance (distance between eye centers).
+    Width within snap_tolerance (fraction) of out_size is snapped to it, so those
+    crops are used at native size of the gaze model without resizing.
+    '''
+    iod = np.linalg.norm(centers[1] - centers[0])
+    width = max(iod * iod_scale, 2.0)
+    if abs(width - out_size[0]) <= snap_tolerance * out_size[0]:
+        width = out_size[0]
+    height = width * out_size[1] / out_size[0]
+    return (int(round(width / 2)), int(round(height / 2)))
+
+def get_eye_boxes(face_shape, eye_landmarks, half_size=None, out_size=(60, 60), iod_scale=0.7, snap_tolerance=0.1):
+    '''
+    Returns (boxes, centers) of both eyes in pixels of the face.
+
+    face_shape: shape of the face image.
+    eye_landmarks: normalized (x, y) of left and right eye, as returned by
+                   Facial_Landmarks_Detection.predict.
+    half_size: (x, y) half size of eye box in pixels. If None, it is scaled from
+               the inter-ocular distance with get_scaled_half_size.
+    boxes: int array of shape (2, 4) as (xmin, ymin, xmax, ymax) for each eye.
+    centers: int array of shape (2, 2) of eye positions.
+    '''
+    face_size = np.array([face_shape[1], face_shape[0]])
+    centers = (np.asarray(eye_landmarks, dtype=np.float32)[0:2] * face_size).astype(np.int32)
+    if half_size is None:
+        half_size = get_scaled_half_size(centers, out_size, iod_scale, snap_tolerance)
+
+    # Boxes keep their size and are moved inside the face instead of being cut at its edges
+    box_size = np.minimum(2 * np.asarray(half_size, dtype=np.int32), face_size)
+    mins = np.clip(centers - box_size // 2, 0, face_size - box_size)
+    boxes = np.concatenate([mins, mins + box_size], axis=1)
+
+    return boxes, centers
+
+def extract_eyes(face, eye_landmarks, half_size=None, out_size=(60, 60), out=None, iod_scale=0.7, snap_tolerance=0.1):
+    '''
+    Crops both eyes from face and resizes them to the input size of the gaze model.
+    Crops already at that size are copied without resizing.
+    Returns (eyes, boxes, centers) where eyes is an array of shape (2, height, width, 3)
+    holding left and right eye, and boxes & centers are as from get_eye_boxes.
+
+    out_size: (width, height) of eye images.
+    out: Optional preallocated array for eyes, which is then filled in place.
+    '''
+    boxes, centers = get_eye_boxes(face.shape, eye_landmarks, half_size, out_size, iod_scale, snap_tolerance)
+
+    if out is None:
+        out = np.empty((2, out_size[1], out_size[0], face.shape[2]), dtype=face.dtype)
+    for eye, (xmin, ymin, xmax, ymax) in zip(out, boxes):
+        crop = face[ymin:ymax, xmin:xmax]
+        if crop.size == 0:
+            eye[:] = 0
+        elif crop.shape == eye.shape:
+            eye[:] = crop
+        else:
+            cv2.resize(crop, out_size, dst=eye)
+
+    return out, boxes, centers
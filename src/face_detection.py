@@ -1,65 +1,92 @@
-import os
-import cv2
-from openvino.inference_engine import IENetwork, IECore
+import time
+import numpy as np
+from infer_request_pool import InferRequestPool
+from model_registry import get_default_registry
+from backends import get_default_backend
+from preprocessing import InputBuffers
+from postprocessing import postprocess_detections
 
 class Face_Detection:
     '''
     Class for the Face Detection Model.
+
+    iou_threshold: Boxes overlapping a more confident box by more than this are
+                   suppressed. No suppression if None (SSD output is already suppressed).
+    top_k: Number of faces kept, all if None.
+    order: Faces are returned largest first by 'confidence' or 'area'.
     '''
-    def __init__(self, model_xml, device='CPU', conf_threshold=0.5):
+    def __init__(self, model_xml, device='CPU', conf_threshold=0.5, backend=None, input_scale=1.0, \
+        iou_threshold=None, top_k=None, order="confidence"):
         ### Initialize any class variables desired
-        self.core = None
+        self.registry = None
         self.exec_network = None
+        self.pool = None
+        self.input_buffers = InputBuffers()
+        self.preprocess_time = 0.0
         self.device = device
+        self.model_xml = model_xml
         self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.top_k = top_k
+        self.order = order
+        self.backend = backend if backend is not None else get_default_backend()
         
-        model_bin = os.path.splitext(model_xml)[0] + ".bin"
         try:
-            self.network = IENetwork(model_xml, model_bin)
+            self.network = self.backend.read_network(model_xml)
         except Exception as e:
             raise ValueError("Failed to load model: " + str(e))
 
         self.input_blob = next(iter(self.network.inputs))
         self.output_blob = next(iter(self.network.outputs))
 
-    def load_model(self):
-        ### Load the model 
-        self.core = IECore()
+        ### Reshape network to detect on a smaller input, cost falls with its area
+        self.input_scale = input_scale
+        if input_scale != 1.0:
+            n, c, h, w = self.network.inputs[self.input_blob].shape
+            # Sides stay multiples of 32, the stride of the network
+            height = max(int(round(h * input_scale / 32)) * 32, 32)
+            width = max(int(round(w * input_scale / 32)) * 32, 32)
+            self.network.reshape({self.input_blob: [n, c, height, width]})
+
+    def load_model(self, num_requests=1, registry=None):
+        ### Load the model with backend shared by the registry
+        self.registry = registry if registry is not None else get_default_registry()
         self.check_model()
 
         ### Return the loaded inference plugin 
-        self.exec_network = self.core.load_network(self.network, self.device)
+        self.exec_network = self.registry.load_network(self.network, self.model_xml, self.device, num_requests)
+        self.pool = InferRequestPool(self.exec_network)
 
     def predict(self, image):
+        try:
+            return self.predict_async(image).result()
+        except RuntimeError:
+            return np.zeros((0, 4), dtype=np.float32)
+
+    def predict_async(self, image, callback=None):
+        ### Start inference without waiting, returns future of box coords
+        start = time.perf_counter()
         p_image = self.preprocess_input(image)
-        self.exec_network.start_async(0, {self.input_blob: p_image})
-        status = self.exec_network.requests[0].wait(-1)
-        box_coords = []
-        if status == 0:
-            output = self.exec_network.requests[0].outputs[self.output_blob]
-            box_coords = self.preprocess_output(output)
-        return box_coords
+        self.preprocess_time += time.perf_counter() - start
+        return self.pool.submit({self.input_blob: p_image}, \
+            lambda outputs: self.preprocess_output(outputs[self.output_blob]), callback)
 
     def check_model(self):
         ### Check for supported layers
-        supported_layers = self.core.query_network(self.network, self.device)
+        supported_layers = self.registry.query_network(self.network, self.model_xml, self.device)
         unsupported_layers = [l for l in self.network.layers.keys() if l not in supported_layers]
         if (len(unsupported_layers) > 0):
             print("ERROR: Unsupported layers found!")
             exit(1)
 
     def preprocess_input(self, image):
+        ### Resize image straight into reusable input blob
         net_input_shape = self.network.inputs[self.input_blob].shape
-        p_image = cv2.resize(image, (net_input_shape[3], net_input_shape[2]))
-        p_image = p_image.transpose((2, 0, 1))
-        p_image = p_image.reshape(1, *p_image.shape)
-        return p_image
+        return self.input_buffers.get(self.input_blob, net_input_shape).fill_images([image])
 
     def preprocess_output(self, outputs):
-        box_coords=[]
-        for box in outputs[0][0]:
-            if box[2] >= self.conf_threshold:
-                coord = (box[3], box[4], box[5], box[6])
-                box_coords.append(coord)
+        ### Returns float32 array of shape (faces, 4) of normalized box coords
+        box_coords, _ = postprocess_detections(outputs, self.conf_threshold, self.iou_threshold, \
+            self.top_k, self.order)
         return box_coords
 
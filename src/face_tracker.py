@@ -0,0 +1,187 @@
+'''
+Tracks face boxes between full runs of the face detection model.
+Face detection runs on the whole frame and is the most expensive model, while
+heads barely move between consecutive frames. The tracker re-runs detection
+only every few frames, or when tracking confidence drops, and in between
+follows each face by matching a small template of it around its last position.
+'''
+import threading
+import cv2
+import numpy as np
+
+class FaceTracker:
+    '''
+    redetect_interval: Run face detection at least once every this many frames.
+                       1 runs detection on every frame (no tracking).
+    min_confidence: Run face detection when template match score of any
+                    tracked face drops below this value (0 to 1).
+    search_scale: Size of area searched for face relative to its last box.
+    template_size: Width (px) the face template is scaled down to for matching.
+    '''
+    def __init__(self, redetect_interval=5, min_confidence=0.6, search_scale=1.5, template_size=32):
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+        self.search_scale = search_scale
+        self.template_size = template_size
+
+        # Each track is a dict of face box (px), template, scale and eye offset
+        self.tracks = []
+        self.frames_since_detection = 0
+        self.confidence = 0.0
+        # Incremented on every detection, so late corrections of older tracks are ignored
+        self.generation = 0
+        self.lock = threading.Lock()
+
+        self.frame_count = 0
+        self.detection_count = 0
+        self.low_confidence_count = 0
+
+    def needs_detection(self):
+        '''
+        Returns True if face detection has to run on the next frame.
+        '''
+        with self.lock:
+            return len(self.tracks) == 0 or self.frames_since_detection + 1 >= self.redetect_interval
+
+    def update_detection(self, frame, box_coords):
+        '''
+        Restarts tracking from box coords (normalized, as returned by
+        Face_Detection.predict) detected in frame. Returns box coords of the
+        tracked faces (array of shape (faces, 4)), without boxes too small to
+        track, so faces cropped from them are in order of the tracks.
+        '''
+        height, width, _ = frame.shape
+        tracks = []
+        kept = []
+        for coords in box_coords:
+            box = self._to_pixels(coords, width, height)
+            track = self._make_track(frame, box)
+            if track is not None:
+                tracks.append(track)
+                kept.append(coords)
+
+        with self.lock:
+            self.tracks = tracks
+            self.generation += 1
+            self.frames_since_detection = 0
+            self.confidence = 1.0
+            self.frame_count += 1
+            self.detection_count += 1
+        return np.array(kept, dtype=np.float32).reshape(-1, 4)
+
+    def track(self, frame):
+        '''
+        Returns box coords (normalized, array of shape (faces, 4)) of tracked faces in frame, or None if
+        tracking is lost and face detection has to run on this frame.
+        '''
+        height, width, _ = frame.shape
+        with self.lock:
+            tracks = list(self.tracks)
+
+        new_boxes = []
+        confidence = 1.0
+        for track in tracks:
+            box, score = self._match(frame, track)
+            confidence = min(confidence, score)
+            new_boxes.append(box)
+
+        with self.lock:
+            self.confidence = confidence
+            if len(tracks) == 0 or confidence < self.min_confidence:
+                self.low_confidence_count += 1
+                return None
+            for track, box in zip(tracks, new_boxes):
+                track["box"] = box
+            self.frames_since_detection += 1
+            self.frame_count += 1
+
+        return np.array([self._to_normalized(box, width, height) for box in new_boxes], dtype=np.float32)
+
+    def recenter(self, generation, index, face_box, eye_landmarks):
+        '''
+        Uses eye landmarks (normalized to face_box) of tracked face at index to
+        correct drift of its box. Offset of the eyes from the box centre is
+        remembered on detected frames and restored on tracked ones.
+        generation: Value of `generation` when the face box was produced.
+        '''
+        xmin, ymin, xmax, ymax = face_box
+        box_width = max(xmax - xmin, 1)
+        box_height = max(ymax - ymin, 1)
+        eyes = np.asarray(eye_landmarks[0:2], dtype=np.float32)
+        # Eye midpoint relative to box centre, in units of box size
+        offset = eyes.mean(axis=0) - 0.5
+
+        with self.lock:
+            if generation != self.generation or index >= len(self.tracks):
+                return
+            track = self.tracks[index]
+            if track["eye_offset"] is None:
+                track["eye_offset"] = offset
+                return
+            shift = (offset - track["eye_offset"]) * (box_width, box_height)
+            track["box"] = self._shift_box(track["box"], shift)
+
+    def get_stats(self):
+        with self.lock:
+            skip_rate = 0.0
+            if self.frame_count > 0:
+                skip_rate = 1 - self.detection_count / self.frame_count
+            return {
+                "frames": self.frame_count,
+                "detections": self.detection_count,
+                "low_confidence_redetections": self.low_confidence_count,
+                "skip_rate": round(skip_rate, 3),
+                "confidence": round(self.confidence, 3),
+            }
+
+    def _make_track(self, frame, box):
+        xmin, ymin, xmax, ymax = box
+        if xmax - xmin < 2 or ymax - ymin < 2:
+            return None
+        scale = self.template_size / (xmax - xmin)
+        crop = cv2.cvtColor(frame[ymin:ymax, xmin:xmax], cv2.COLOR_BGR2GRAY)
+        template = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return {"box": box, "template": template, "scale": scale, "eye_offset": None}
+
+    def _match(self, frame, track):
+        # Search for template in area around last box, scaled down like the template
+        height, width, _ = frame.shape
+        xmin, ymin, xmax, ymax = track["box"]
+        margin_x = int((xmax - xmin) * (self.search_scale - 1) / 2)
+        margin_y = int((ymax - ymin) * (self.search_scale - 1) / 2)
+        sx = max(xmin - margin_x, 0)
+        sy = max(ymin - margin_y, 0)
+        ex = min(xmax + margin_x, width)
+        ey = min(ymax + margin_y, height)
+
+        scale = track["scale"]
+        template = track["template"]
+        search = cv2.cvtColor(frame[sy:ey, sx:ex], cv2.COLOR_BGR2GRAY)
+        search = cv2.resize(search, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if search.shape[0] < template.shape[0] or search.shape[1] < template.shape[1]:
+            return track["box"], 0.0
+
+        result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(result)
+        shift = (sx + location[0] / scale - xmin, sy + location[1] / scale - ymin)
+        return self._shift_box(track["box"], shift), score
+
+    def _shift_box(self, box, shift):
+        dx = int(round(shift[0]))
+        dy = int(round(shift[1]))
+        return (box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy)
+
+    def _to_pixels(self, coords, width, height):
+        # Detections can slightly exceed the frame, clamp them to it
+        xmin = int(min(max(coords[0], 0.0), 1.0) * width)
+        ymin = int(min(max(coords[1], 0.0), 1.0) * height)
+        xmax = int(min(max(coords[2], 0.0), 1.0) * width)
+        ymax = int(min(max(coords[3], 0.0), 1.0) * height)
+        return (xmin, ymin, xmax, ymax)
+
+    def _to_normalized(self, box, width, height):
+        xmin = min(max(box[0] / width, 0.0), 1.0)
+        ymin = min(max(box[1] / height, 0.0), 1.0)
+        xmax = min(max(box[2] / width, 0.0), 1.0)
+        ymax = min(max(box[3] / height, 0.0), 1.0)
+        return (xmin, ymin, xmax, ymax)
@@ -1,62 +1,101 @@
-import os
-import cv2
-from openvino.inference_engine import IENetwork, IECore
+import time
+import numpy as np
+from infer_request_pool import InferRequestPool, chain, gather
+from model_registry import get_default_registry
+from backends import get_default_backend
+from preprocessing import InputBuffers
+from postprocessing import reshape_landmarks
 
 class Facial_Landmarks_Detection:
     '''
     Class for the Face Detection Model.
     '''
-    def __init__(self, model_xml, device='CPU'):
+    def __init__(self, model_xml, device='CPU', batch_size=1, backend=None):
         ### Initialize any class variables desired
-        self.core = None
+        self.registry = None
         self.exec_network = None
+        self.pool = None
+        self.input_buffers = InputBuffers()
+        self.preprocess_time = 0.0
         self.device = device
+        self.model_xml = model_xml
+        self.backend = backend if backend is not None else get_default_backend()
         
-        model_bin = os.path.splitext(model_xml)[0] + ".bin"
         try:
-            self.network = IENetwork(model_xml, model_bin)
+            self.network = self.backend.read_network(model_xml)
         except Exception as e:
             raise ValueError("Failed to load model. Check path for suitable file.")
 
+        ### Reshape network to process batch_size faces per inference
+        self.batch_size = batch_size
+        self.network.batch_size = batch_size
+
         self.input_blob = next(iter(self.network.inputs))
         self.output_blob = next(iter(self.network.outputs))
 
-    def load_model(self):
-        ### Load the model 
-        self.core = IECore()
+    def load_model(self, num_requests=1, registry=None):
+        ### Load the model with backend shared by the registry
+        self.registry = registry if registry is not None else get_default_registry()
         self.check_model()
 
         ### Return the loaded inference plugin 
-        self.exec_network = self.core.load_network(self.network, self.device)
+        self.exec_network = self.registry.load_network(self.network, self.model_xml, self.device, num_requests)
+        self.pool = InferRequestPool(self.exec_network)
 
     def predict(self, image):
+        try:
+            return self.predict_async(image).result()
+        except RuntimeError:
+            return np.zeros((0, 2), dtype=np.float32)
+
+    def predict_async(self, image, callback=None):
+        ### Start inference without waiting, returns future of eye landmarks
+        start = time.perf_counter()
         p_image = self.preprocess_input(image)
-        self.exec_network.start_async(0, {self.input_blob: p_image})
-        status = self.exec_network.requests[0].wait(-1)
-        eye_landmarks = []
-        if status == 0:
-            outputs = self.exec_network.requests[0].outputs
-            landmarks_coords = self.preprocess_output(outputs)
-            eye_landmarks = landmarks_coords[0:2]
-        return eye_landmarks
+        self.preprocess_time += time.perf_counter() - start
+        return self.pool.submit({self.input_blob: p_image}, \
+            lambda outputs: self.preprocess_output(outputs)[0][0:2], callback)
+
+    def predict_batch(self, images):
+        return self.predict_batch_async(images).result()
+
+    def predict_batch_async(self, images, callback=None):
+        ### Start inference on faces stacked in batches, returns future of eye landmarks of each face
+        futures = []
+        for i in range(0, len(images), self.batch_size):
+            batch = images[i:i + self.batch_size]
+            start = time.perf_counter()
+            p_images = self.preprocess_batch(batch)
+            self.preprocess_time += time.perf_counter() - start
+            futures.append(self.pool.submit({self.input_blob: p_images}, \
+                lambda outputs, count=len(batch): self.preprocess_output(outputs, count)[:, 0:2]))
+        future = chain(gather(futures), lambda results: np.concatenate(results) if len(results) > 0 \
+            else np.zeros((0, 2, 2), dtype=np.float32))
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def get_input_size(self):
+        ### (width, height) face images are resized to
+        _, _, height, width = self.network.inputs[self.input_blob].shape
+        return (width, height)
 
     def check_model(self):
         ### Check for supported layers
-        supported_layers = self.core.query_network(self.network, self.device)
+        supported_layers = self.registry.query_network(self.network, self.model_xml, self.device)
         unsupported_layers = [l for l in self.network.layers.keys() if l not in supported_layers]
         if (len(unsupported_layers) > 0):
             print("ERROR: Unsupported layers found!")
             exit(1)
 
     def preprocess_input(self, image):
+        return self.preprocess_batch([image])
+
+    def preprocess_batch(self, images):
+        ### Resize images straight into reusable input blob, unused slots of batch are left blank
         net_input_shape = self.network.inputs[self.input_blob].shape
-        p_image = cv2.resize(image, (net_input_shape[3], net_input_shape[2]))
-        p_image = p_image.transpose((2, 0, 1))
-        p_image = p_image.reshape(1, *p_image.shape)
-        return p_image
-
-    def preprocess_output(self, outputs):
-        landmarks = outputs[self.output_blob].flatten()
-        # Get landmarks as tuple of coordinates for each landmark
-        landmarks_coords = [(landmarks[i], landmarks[i + 1]) for i in range(0, len(landmarks) - 1, 2)]
-        return landmarks_coords
+        return self.input_buffers.get(self.input_blob, net_input_shape).fill_images(images)
+
+    def preprocess_output(self, outputs, count=1):
+        ### Returns array of shape (count, landmarks, 2) of (x, y) of landmarks of first count images of batch
+        return reshape_landmarks(outputs[self.output_blob], self.batch_size, count)
@@ -0,0 +1,378 @@
+'''
+Passing of frames between processes through shared memory, so capture and
+decoding can run in a process of their own without each frame being pickled
+through a pipe. FrameRing is a ring of fixed size frame slots in one shared
+memory block with two small queues of slot indices: slots free to write, and
+slots holding frames ready to read. A producer writes a frame in place into a
+free slot (OpenCV decodes straight into it) and publishes the slot, a consumer
+reads it as a numpy view without copying and releases the slot once done
+with the frame, which makes the slot free again.
+
+    ring = FrameRing(8, (1080, 1920, 3))
+    # producer process                    # consumer process
+    slot = ring.claim()                   item = ring.get()
+    cap.read(ring.view(slot, shape))      ...item.frame...
+    ring.publish(slot, seq, time, shape)  ring.release(item)
+
+RingFeeder runs an InputFeeder in a capture process feeding such a ring, and
+has the interface of InputFeeder for the consumer.
+'''
+import multiprocessing as mp
+import queue
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from input_feeder import InputFeeder
+
+### Frame read from a ring, frame is a view of its slot valid until released
+RingFrame = namedtuple("RingFrame", ["slot", "generation", "seq", "capture_time", "frame"])
+
+overflow_policies = ["block", "drop_oldest", "drop_newest"]
+
+# Counters in the block header after the slot generations
+_WRITTEN, _DROPPED, _SKIPPED, _RELEASED, _COUNTERS = range(5)
+_ALIGN = 64
+
+class FrameRing:
+    '''
+    slots: Number of frame slots.
+    frame_shape: Shape of the largest frame (height, width, channels), frames are uint8.
+    policy: What the producer does when no slot is free: 'block' waits for one to be
+            released, 'drop_oldest' takes back the oldest frame not read yet (for live
+            cameras), 'drop_newest' drops the new frame.
+    '''
+    def __init__(self, slots, frame_shape, policy="block"):
+        if policy not in overflow_policies:
+            raise ValueError(f"Invalid overflow policy '{policy}'. Valid values are {', '.join(overflow_policies)}")
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self.policy = policy
+        self.slot_size = _aligned(int(np.prod(self.frame_shape)))
+        self.block = shared_memory.SharedMemory(create=True, size=_header_size(slots) + slots * self.slot_size)
+        self.free = mp.Queue()
+        self.ready = mp.Queue()
+        self.stopped = mp.Event()
+        self._attach()
+        self.header[:] = 0
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def __getstate__(self):
+        # Passed to a process started with spawn, which attaches to the block
+        state = self.__dict__.copy()
+        for name in ("block", "header", "ended"):
+            state.pop(name)
+        state["name"] = self.block.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop("name")
+        self.__dict__.update(state)
+        self.block = attach_shared_memory(name, shared_tracker=True)
+        self._attach()
+
+    def _attach(self):
+        # Generation of each slot, bumped on every write, then the counters
+        self.header = np.ndarray(self.slots + _COUNTERS, dtype=np.int64, buffer=self.block.buf)
+        self.ended = False
+
+    def view(self, slot, shape=None):
+        '''
+        Returns slot as a uint8 array of shape (default frame_shape of the ring), without copying.
+        '''
+        shape = self.frame_shape if shape is None else tuple(shape)
+        if int(np.prod(shape)) > self.slot_size:
+            raise ValueError(f"Frame of shape {shape} does not fit slots of shape {self.frame_shape}")
+        offset = _header_size(self.slots) + slot * self.slot_size
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.block.buf, offset=offset)
+
+    ### Producer side
+
+    def claim(self, timeout=None):
+        '''
+        Returns index of a slot to write the next frame into, applying the overflow
+        policy while no slot is free. Returns None if the frame is dropped, the ring
+        is stopped, or no slot is free within timeout seconds (None waits as long
+        as needed).
+        '''
+        # Counted once put, a released slot may still be on its way through the pipe of the
+        # queue, the producer is its only reader
+        if self.free.qsize() > 0:
+            return self.free.get()
+        if self.policy == "drop_newest":
+            self.header[self.slots + _DROPPED] += 1
+            return None
+        if self.policy == "drop_oldest" and self.ready.qsize() > 0:
+            try:
+                # Whichever of producer and consumer gets the oldest frame owns its slot
+                item = self.ready.get(timeout=0.01)
+                if item is not None:
+                    self.header[self.slots + _DROPPED] += 1
+                    return item[0]
+                self.ready.put(None)
+            except queue.Empty:
+                pass
+        # All slots are held by consumers, wait for one to be released
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.stopped.is_set():
+            wait = 0.1 if deadline is None else min(deadline - time.perf_counter(), 0.1)
+            if wait <= 0:
+                return None
+            try:
+                return self.free.get(timeout=wait)
+            except queue.Empty:
+                pass
+        return None
+
+    def publish(self, slot, seq, capture_time, shape=None):
+        '''
+        Hands frame written into slot to consumers.
+        '''
+        self.header[slot] += 1
+        self.header[self.slots + _WRITTEN] += 1
+        shape = self.frame_shape if shape is None else tuple(shape)
+        self.ready.put((slot, int(self.header[slot]), seq, capture_time, shape))
+
+    def abandon(self, slot):
+        '''
+        Returns a claimed slot without publishing a frame in it.
+        '''
+        self.free.put(slot)
+
+    def put(self, frame, seq, capture_time, timeout=None):
+        '''
+        Copies frame into a slot and publishes it. Returns False if it was dropped.
+        '''
+        slot = self.claim(timeout)
+        if slot is None:
+            return False
+        self.view(slot, frame.shape)[:] = frame
+        self.publish(slot, seq, capture_time, frame.shape)
+        return True
+
+    def count_skipped(self, count=1):
+        self.header[self.slots + _SKIPPED] += count
+
+    def end(self):
+        '''
+        Marks the end of frames, consumers get None once all frames are read.
+        '''
+        self.ready.put(None)
+
+    ### Consumer side
+
+    def get(self, timeout=None):
+        '''
+        Returns next RingFrame, whose frame is a view of its slot valid until it is
+        released. Returns None if no frame is ready within timeout seconds (None
+        waits until one is, 0 does not wait) or all frames were read, see is_done.
+        '''
+        if self.ended:
+            return None
+        try:
+            if timeout == 0:
+                item = self.ready.get_nowait()
+            else:
+                item = self.ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is None:
+            # Other consumers of the ring end too
+            self.ready.put(None)
+            self.ended = True
+            return None
+        slot, generation, seq, capture_time, shape = item
+        return RingFrame(slot, generation, seq, capture_time, self.view(slot, shape))
+
+    def release(self, item):
+        '''
+        Makes slot of a RingFrame free for the next frame, its frame must not be used any more.
+        '''
+        if self.header[item.slot] != item.generation:
+            raise RuntimeError(f"Slot {item.slot} of frame {item.seq} was reused before it was released")
+        self.header[self.slots + _RELEASED] += 1
+        self.free.put(item.slot)
+
+    def is_done(self):
+        return self.ended
+
+    def stop(self):
+        '''
+        Asks the producer to stop, a producer waiting for a free slot gives up.
+        '''
+        self.stopped.set()
+
+    def get_stats(self):
+        '''
+        Returns counters of frames written, dropped on overflow, skipped by the
+        producer and released, and frames waiting to be read.
+        '''
+        counters = self.header[self.slots:]
+        return {
+            "written": int(counters[_WRITTEN]),
+            "dropped": int(counters[_DROPPED]),
+            "skipped": int(counters[_SKIPPED]),
+            "released": int(counters[_RELEASED]),
+            "ready": self.ready.qsize(),
+        }
+
+    def close(self):
+        '''
+        Detaches this process from the block.
+        '''
+        self.header = None
+        self.block.close()
+
+    def unlink(self):
+        '''
+        Removes the block once all processes have closed it, called by the process which created the ring.
+        '''
+        self.block.unlink()
+
+class RingFeeder:
+    '''
+    InputFeeder whose video or webcam is read and decoded by a capture process,
+    frames coming through a FrameRing of slots frames. Frames stay valid until
+    release(seq), so the ring must hold at least as many frames as are in
+    inference at once plus those read ahead. Arguments are those of InputFeeder;
+    'latest' frame policy drops the oldest unread frame when all slots are in use,
+    others wait for a free slot.
+    '''
+    def __init__(self, input_type, input_file=None, frame_policy=None, frame_step=10, slots=8, camera=0):
+        if input_type not in ("video", "cam"):
+            raise ValueError(f"Frames of input type '{input_type}' can not be read by a capture process")
+        self.input_type = input_type
+        self.input_file = input_file
+        self.frame_policy = frame_policy if frame_policy is not None else ("latest" if input_type == "cam" else "nth")
+        self.frame_step = frame_step if self.frame_policy == "nth" else 1
+        self.slots = slots
+        self.camera = camera
+        self.ring = None
+        self.process = None
+        self.held = {}
+        # Frames are released by the consumer and by pipeline stages dropping them
+        self.held_lock = threading.Lock()
+        self.max_queue_depth = 0
+
+    def load_data(self):
+        # Frame size and rate are probed here, the capture process opens the input again
+        probe = InputFeeder(self.input_type, self.input_file, self.frame_policy, self.frame_step, camera=self.camera)
+        probe.load_data()
+        self.input_shape = probe.get_input_shape()
+        self.fps = probe.get_fps()
+        probe.close()
+
+        width, height = self.input_shape
+        policy = "drop_oldest" if self.frame_policy == "latest" else "block"
+        self.ring = FrameRing(self.slots, (height, width, 3), policy)
+        self.shared_frame_step = mp.Value("i", self.frame_step, lock=False)
+        self.process = mp.Process(target=_capture, name="capture", daemon=True, args=(self.ring, self.input_type, \
+            self.input_file, self.frame_policy, self.shared_frame_step, self.camera))
+        self.process.start()
+
+    def next_frames(self):
+        '''
+        Yields (seq, capture_time, frame) for each frame fed, as InputFeeder does.
+        '''
+        while True:
+            item = self.next_frame()
+            if item is None:
+                break
+            yield item
+
+    def next_frame(self, timeout=None):
+        '''
+        Returns next (seq, capture_time, frame) or None, as InputFeeder does.
+        '''
+        depth = self.ring.ready.qsize()
+        item = self.ring.get(timeout)
+        if item is None:
+            return None
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        with self.held_lock:
+            self.held[item.seq] = item
+        return item.seq, item.capture_time, item.frame
+
+    def release(self, seq):
+        '''
+        Frees slot of frame seq for the next frame, after which its frame must not be used.
+        '''
+        with self.held_lock:
+            item = self.held.pop(seq, None)
+            if item is not None:
+                self.ring.release(item)
+
+    def is_done(self):
+        return self.ring.is_done()
+
+    def get_stats(self):
+        stats = self.ring.get_stats()
+        return {
+            "read": stats["written"],
+            "skipped": stats["skipped"],
+            "dropped": stats["dropped"],
+            "queue_depth": stats["ready"],
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def set_frame_step(self, frame_step):
+        # Only 'nth' policy skips frames, as with InputFeeder
+        if self.frame_policy != "nth":
+            raise ValueError(f"Frame step can not be changed with '{self.frame_policy}' frame policy")
+        self.frame_step = frame_step
+        self.shared_frame_step.value = frame_step
+
+    def get_fps(self):
+        return self.fps
+
+    def get_input_shape(self):
+        return self.input_shape
+
+    def close(self):
+        self.ring.stop()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        # Views of slots must be gone before the block is closed
+        self.held.clear()
+        self.ring.unlink()
+        try:
+            self.ring.close()
+        except BufferError:
+            # A frame is still referenced, the mapping is released with it
+            pass
+
+def _capture(ring, input_type, input_file, frame_policy, frame_step, camera):
+    feed = InputFeeder(input_type, input_file, frame_policy, frame_step.value, camera=camera)
+    feed.load_data()
+    try:
+        feed.feed_ring(ring, frame_step)
+    finally:
+        ring.end()
+        feed.close()
+        ring.close()
+
+def attach_shared_memory(name, shared_tracker=False):
+    '''
+    Attaches to an existing shared memory block, which is left to its creator to unlink.
+    shared_tracker: True in processes started by the creator, which share its resource tracker.
+    '''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name)
+        if not shared_tracker:
+            # Python before 3.13 registers attached blocks for unlinking at exit
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+def _aligned(size):
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _header_size(slots):
+    return _aligned((slots + _COUNTERS) * 8)
@@ -0,0 +1,134 @@
+'''
+Client library of the gaze server (gaze_server.py).
+
+    client = await GazeClient.connect("127.0.0.1", 9000)
+    result = await client.infer(frame)          # {"id", "faces", "latency"}
+    for face in result["faces"]:
+        print(face["gaze_vector"])
+    await client.close()
+
+infer() waits for the result of one frame. submit() only sends the frame and
+returns a future of its result, so several frames can be in flight; it waits
+while max_in_flight frames have no result yet. Frames are sent JPEG encoded
+by default. Encoding 'shm' passes raw frames in shared memory blocks instead,
+for clients on the same machine, so frames are neither encoded nor copied
+through the socket.
+'''
+import asyncio
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from gaze_protocol import read_message, write_message, encode_frame
+
+class GazeClient:
+    '''
+    encoding: 'jpeg', 'png', 'raw' or 'shm'.
+    max_in_flight: Max frames sent without a result yet.
+    quality: JPEG quality of frames.
+    '''
+    def __init__(self, reader, writer, encoding="jpeg", max_in_flight=4, quality=90):
+        self.reader = reader
+        self.writer = writer
+        self.encoding = encoding
+        self.quality = quality
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.pending = {}
+        self.next_id = 0
+        # Shared memory blocks free for the next frame, and blocks of frames in flight by id
+        self.free_blocks = deque()
+        self.used_blocks = {}
+        self.all_blocks = []
+        self.receiver = asyncio.get_running_loop().create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=9000, path=None, **kwargs):
+        '''
+        Connects to the server on the Unix socket at path if given, else on TCP host:port.
+        Keyword arguments are those of GazeClient.
+        '''
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, **kwargs)
+
+    async def submit(self, frame, scheduled=None):
+        '''
+        Sends BGR frame, waiting while max_in_flight frames have no result.
+        Returns future of its result: dict of 'id', 'faces' and 'latency'
+        (seconds from sending until the result arrived). The future raises
+        RuntimeError if the server could not process the frame.
+
+        scheduled: perf_counter time the frame was due to be sent, e.g. by a
+                   fixed send rate. Latency is then counted from it, including
+                   any wait for a free slot.
+        '''
+        await self.slots.acquire()
+        id = self.next_id
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[id] = (future, scheduled if scheduled is not None else time.perf_counter())
+
+        if self.encoding == "shm":
+            block = self._get_block(frame.nbytes)
+            np.ndarray(frame.shape, dtype=np.uint8, buffer=block.buf)[:] = frame
+            self.used_blocks[id] = block
+            header, payload = {"encoding": "shm", "shm": block.name, "shape": list(frame.shape)}, b""
+        else:
+            header, payload = encode_frame(frame, self.encoding, self.quality)
+        write_message(self.writer, dict(header, type="frame", id=id), payload)
+        await self.writer.drain()
+        return future
+
+    async def infer(self, frame):
+        '''
+        Returns result of frame, see submit.
+        '''
+        return await (await self.submit(frame))
+
+    async def close(self):
+        '''
+        Waits for results of frames in flight, then closes the connection.
+        '''
+        if len(self.pending) > 0:
+            await asyncio.wait([future for future, _ in self.pending.values()])
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.receiver
+        for block in self.all_blocks:
+            block.close()
+            block.unlink()
+
+    async def _receive(self):
+        while True:
+            message = await read_message(self.reader)
+            if message is None:
+                break
+            header, _ = message
+            future, start = self.pending.pop(header["id"])
+            block = self.used_blocks.pop(header["id"], None)
+            if block is not None:
+                self.free_blocks.append(block)
+            self.slots.release()
+            if header["type"] == "error":
+                future.set_exception(RuntimeError(header["message"]))
+            else:
+                future.set_result({"id": header["id"], "faces": header["faces"], \
+                    "latency": time.perf_counter() - start})
+        # Results which will not come any more
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection to gaze server closed"))
+        self.pending.clear()
+
+    def _get_block(self, size):
+        while len(self.free_blocks) > 0:
+            block = self.free_blocks.popleft()
+            if block.size >= size:
+                return block
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self.all_blocks.append(block)
+        return block
@@ -1,70 +1,109 @@
-import os
-import cv2
+import time
 import numpy as np
-from openvino.inference_engine import IENetwork, IECore
+from infer_request_pool import InferRequestPool, chain, gather
+from model_registry import get_default_registry
+from backends import get_default_backend
+from preprocessing import InputBuffers
 
 class Gaze_Estimation:
     '''
     Class for the Gaze Estimation Model.
     '''
-    def __init__(self, model_xml, device='CPU'):
+    def __init__(self, model_xml, device='CPU', batch_size=1, backend=None):
         ### Initialize any class variables desired
-        self.core = None
+        self.registry = None
         self.exec_network = None
+        self.pool = None
+        self.input_buffers = InputBuffers()
+        self.preprocess_time = 0.0
         self.device = device
+        self.model_xml = model_xml
+        self.backend = backend if backend is not None else get_default_backend()
         
-        model_bin = os.path.splitext(model_xml)[0] + ".bin"
         try:
-            self.network = IENetwork(model_xml, model_bin)
+            self.network = self.backend.read_network(model_xml)
         except Exception as e:
             raise ValueError("Failed to load model. Check path for suitable file.")
 
+        ### Reshape network to process batch_size pairs of eyes per inference
+        self.batch_size = batch_size
+        self.network.batch_size = batch_size
+
         self.input_blobs = [blob for blob in self.network.inputs]
         self.output_blob = next(iter(self.network.outputs))
 
-    def load_model(self):
-        ### Load the model 
-        self.core = IECore()
+    def load_model(self, num_requests=1, registry=None):
+        ### Load the model with backend shared by the registry
+        self.registry = registry if registry is not None else get_default_registry()
         self.check_model()
 
         ### Return the loaded inference plugin 
-        self.exec_network = self.core.load_network(self.network, self.device)
+        self.exec_network = self.registry.load_network(self.network, self.model_xml, self.device, num_requests)
+        self.pool = InferRequestPool(self.exec_network)
 
     def predict(self, image_left_eye, image_right_eye, head_pose_angles):
+        try:
+            return self.predict_async(image_left_eye, image_right_eye, head_pose_angles).result()
+        except RuntimeError:
+            return []
+
+    def predict_async(self, image_left_eye, image_right_eye, head_pose_angles, callback=None):
+        ### Start inference without waiting, returns future of gaze vector
+        start = time.perf_counter()
         p_left_eye, p_right_eye, p_head_pose_angles = self.preprocess_input(image_left_eye, image_right_eye, head_pose_angles)
-        self.exec_network.start_async(0, {self.input_blobs[0]: p_head_pose_angles, self.input_blobs[1]: p_left_eye, \
-            self.input_blobs[2]: p_right_eye})
-        status = self.exec_network.requests[0].wait(-1)
-        gaze_vector = []
-        if status == 0:
-            outputs = self.exec_network.requests[0].outputs
-            gaze_vector = self.preprocess_output(outputs)
-        return gaze_vector
+        self.preprocess_time += time.perf_counter() - start
+        return self.pool.submit({self.input_blobs[0]: p_head_pose_angles, self.input_blobs[1]: p_left_eye, \
+            self.input_blobs[2]: p_right_eye}, lambda outputs: self.preprocess_output(outputs)[0], callback)
+
+    def predict_batch(self, images_left_eye, images_right_eye, head_pose_angles):
+        return self.predict_batch_async(images_left_eye, images_right_eye, head_pose_angles).result()
+
+    def predict_batch_async(self, images_left_eye, images_right_eye, head_pose_angles, callback=None):
+        ### Start inference on eyes stacked in batches, returns future of gaze vector of each face
+        futures = []
+        for i in range(0, len(images_left_eye), self.batch_size):
+            end = i + self.batch_size
+            count = len(images_left_eye[i:end])
+            start = time.perf_counter()
+            p_left_eyes, p_right_eyes, p_head_pose_angles = self.preprocess_batch(images_left_eye[i:end], \
+                images_right_eye[i:end], head_pose_angles[i:end])
+            self.preprocess_time += time.perf_counter() - start
+            futures.append(self.pool.submit({self.input_blobs[0]: p_head_pose_angles, self.input_blobs[1]: p_left_eyes, \
+                self.input_blobs[2]: p_right_eyes}, lambda outputs, count=count: self.preprocess_output(outputs, count)))
+        future = chain(gather(futures), lambda results: [vector for result in results for vector in result])
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def get_input_size(self):
+        ### (width, height) eye images are resized to
+        _, _, height, width = self.network.inputs[self.input_blobs[1]].shape
+        return (width, height)
 
     def check_model(self):
         ### Check for supported layers
-        supported_layers = self.core.query_network(self.network, self.device)
+        supported_layers = self.registry.query_network(self.network, self.model_xml, self.device)
         unsupported_layers = [l for l in self.network.layers.keys() if l not in supported_layers]
         if (len(unsupported_layers) > 0):
             print("ERROR: Unsupported layers found!")
             exit(1)
 
     def preprocess_input(self, image_left_eye, image_right_eye, head_pose_angles):
+        return self.preprocess_batch([image_left_eye], [image_right_eye], [head_pose_angles])
+
+    def preprocess_batch(self, images_left_eye, images_right_eye, head_pose_angles):
+        ### Write eyes and angles straight into reusable input blobs, unused slots of batch are left blank
         image_input_shape = self.network.inputs[self.input_blobs[1]].shape
         angles_input_shape = self.network.inputs[self.input_blobs[0]].shape
-        
-        p_left_eye = cv2.resize(image_left_eye, (image_input_shape[3], image_input_shape[2]))
-        p_left_eye = p_left_eye.transpose((2, 0, 1))
-        p_left_eye = p_left_eye.reshape(1, *p_left_eye.shape)
-
-        p_right_eye = cv2.resize(image_right_eye, (image_input_shape[3], image_input_shape[2]))
-        p_right_eye = p_right_eye.transpose((2, 0, 1))
-        p_right_eye = p_right_eye.reshape(1, *p_right_eye.shape)
 
-        p_head_pose_angles = np.array(head_pose_angles).reshape(*angles_input_shape)
+        p_left_eyes = self.input_buffers.get(self.input_blobs[1], image_input_shape).fill_images(images_left_eye)
+        p_right_eyes = self.input_buffers.get(self.input_blobs[2], image_input_shape).fill_images(images_right_eye)
+        p_head_pose_angles = self.input_buffers.get(self.input_blobs[0], angles_input_shape, np.float32) \
+            .fill_values(head_pose_angles)
 
-        return p_left_eye, p_right_eye, p_head_pose_angles
+        return p_left_eyes, p_right_eyes, p_head_pose_angles
 
-    def preprocess_output(self, outputs):
-        gaze_vector = outputs[self.output_blob].flatten()
-        return gaze_vector
+    def preprocess_output(self, outputs, count=1):
+        ### Returns gaze vectors of first count items of batch
+        gaze_vectors = outputs[self.output_blob].reshape(self.batch_size, -1)
+        return list(gaze_vectors[:count])
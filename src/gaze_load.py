@@ -0,0 +1,145 @@
+'''
+Load generator of the gaze server. Runs a number of clients, each sending
+frames with up to max_in_flight frames waiting for results, or at a fixed
+rate, and reports throughput and latency percentiles (submit until result,
+at a fixed rate from the time each frame was due) of all of them. Frames are
+read from a video or image, or are synthetic.
+
+    python3 src/gaze_server.py -be synthetic &
+    python3 src/gaze_load.py -n 8 -f 200
+'''
+import asyncio
+import json
+import logging as log
+import time
+from argparse import ArgumentParser
+
+import cv2
+import numpy as np
+
+from gaze_client import GazeClient
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument("-H", "--host", required=False, type=str, default="127.0.0.1", \
+        help="Host of the gaze server (default 127.0.0.1)")
+
+    parser.add_argument("-P", "--port", required=False, type=int, default=9000, \
+        help="TCP port of the gaze server (default 9000)")
+
+    parser.add_argument("-u", "--unix_socket", required=False, type=str, default=None, \
+        help="Connect to a Unix socket at this path instead of TCP")
+
+    parser.add_argument("-n", "--clients", required=False, type=int, default=4, \
+        help="Number of concurrent clients (default 4)")
+
+    parser.add_argument("-f", "--frames", required=False, type=int, default=200, \
+        help="Frames sent by each client (default 200)")
+
+    parser.add_argument("-r", "--rate", required=False, type=float, default=0, \
+        help="Frames per second sent by each client, 0 to send as fast as results come back (default 0)")
+
+    parser.add_argument("-e", "--encoding", required=False, type=str, default="jpeg", \
+        help="Frame encoding: 'jpeg', 'png', 'raw' or 'shm' (default jpeg)")
+
+    parser.add_argument("-mif", "--max_in_flight", required=False, type=int, default=2, \
+        help="Max frames of a client waiting for results (default 2)")
+
+    parser.add_argument("-i", "--input", required=False, type=str, default=None, \
+        help="Video or image to send frames of (default synthetic frames)")
+
+    parser.add_argument("-s", "--size", required=False, type=str, default="640x480", \
+        help="Size of synthetic frames, <width>x<height> (default 640x480)")
+
+    parser.add_argument("-o", "--output", required=False, type=str, default=None, \
+        help="Save report to this JSON file")
+
+    return parser
+
+### Frames sent by clients, in turn
+def load_frames(input_path, size, count=16):
+    if input_path is not None:
+        cap = cv2.VideoCapture(input_path)
+        frames = []
+        while len(frames) < count:
+            flag, frame = cap.read()
+            if not flag:
+                break
+            frames.append(frame)
+        cap.release()
+        if len(frames) == 0:
+            raise ValueError(f"No frames could be read from {input_path}")
+        return frames
+    # Smooth gradient with a moving bright disc, compresses like a camera image
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    background = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), \
+        np.full((height, width), 96, np.float32)], axis=2).astype(np.uint8)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        center = (int(width * (0.3 + 0.4 * i / count)), height // 2)
+        cv2.circle(frame, center, min(width, height) // 6, (220, 200, 190), -1)
+        frames.append(frame)
+    return frames
+
+async def run_client(args, frames, latencies, errors):
+    client = await GazeClient.connect(args.host, args.port, args.unix_socket, encoding=args.encoding, \
+        max_in_flight=args.max_in_flight)
+    futures = []
+    start = time.perf_counter()
+    for i in range(args.frames):
+        scheduled = None
+        if args.rate > 0:
+            # Frames are due on schedule, latency counts from then, so time a late frame waited
+            # for a free slot is not omitted
+            scheduled = start + i / args.rate
+            await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+        futures.append(await client.submit(frames[i % len(frames)], scheduled))
+    for future in futures:
+        try:
+            latencies.append((await future)["latency"])
+        except RuntimeError:
+            errors.append(1)
+    await client.close()
+    return time.perf_counter() - start
+
+async def run(args):
+    width, height = (int(side) for side in args.size.split("x"))
+    frames = load_frames(args.input, (width, height))
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    client_times = await asyncio.gather(*[run_client(args, frames, latencies, errors) for _ in range(args.clients)])
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000 if len(latencies) > 0 else np.zeros(1)
+    return {
+        "clients": args.clients,
+        "encoding": args.encoding,
+        "frames": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 2),
+        "throughput_fps": round(len(latencies) / elapsed, 2),
+        "client_fps": round(float(np.mean([args.frames / seconds for seconds in client_times])), 2),
+        "latency_ms": {name: round(float(np.percentile(latencies_ms, q)), 2) \
+            for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+    }
+
+def main():
+    args = build_argparser().parse_args()
+    log.basicConfig(level = log.INFO, format = '%(levelname)s: %(message)s')
+
+    report = asyncio.run(run(args))
+    latency = report["latency_ms"]
+    log.info(f"{report['frames']} frames from {report['clients']} clients in {report['seconds']} s: " \
+        f"{report['throughput_fps']} frames/s ({report['client_fps']} per client), {report['errors']} errors")
+    log.info(f"Latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, " \
+        f"max {latency['max']} ms")
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == "__main__":
+    main()
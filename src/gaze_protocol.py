@@ -0,0 +1,106 @@
+'''
+Wire format of the gaze server (gaze_server.py) and its client (gaze_client.py).
+Each message is an 8 byte prefix holding the lengths of a JSON header and of
+a binary payload (big-endian uint32 each), followed by both:
+
+- client to server: {"type": "frame", "id": <int>, "encoding": ..., "shape": [h, w, 3]}
+  with the frame as payload, encoded as 'jpeg' or 'png', or 'raw' BGR bytes.
+  Encoding 'shm' has no payload, the raw frame is in the shared memory block
+  named by "shm" of the header, which the client does not touch until the
+  result of the frame arrives.
+- server to client: {"type": "result", "id": <int>, "faces": [...]} with per face
+  "face_box" (normalized xmin, ymin, xmax, ymax), "landmarks" (normalized to the
+  face box), "head_pose_angles" and "gaze_vector"; or {"type": "error", "id":
+  <int>, "message": <str>} if the frame could not be processed.
+
+Results of a connection are sent in the order its frames were sent.
+'''
+import asyncio
+import json
+import struct
+import cv2
+import numpy as np
+
+_prefix = struct.Struct(">II")
+
+### Frames larger than this are refused, so a corrupt prefix can not exhaust memory
+max_message_size = 64 * 1024 * 1024
+
+async def read_message(reader):
+    '''
+    Returns (header dict, payload bytes) of the next message of an
+    asyncio.StreamReader, or None once the connection is closed.
+    '''
+    try:
+        header_size, payload_size = _prefix.unpack(await reader.readexactly(_prefix.size))
+        if header_size + payload_size > max_message_size:
+            raise ValueError(f"Message of {header_size + payload_size} bytes exceeds limit")
+        header = json.loads(await reader.readexactly(header_size))
+        payload = await reader.readexactly(payload_size) if payload_size > 0 else b""
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        # Connection closed by the peer
+        return None
+    return header, payload
+
+def write_message(writer, header, payload=b""):
+    '''
+    Writes message to an asyncio.StreamWriter. Callers await writer.drain()
+    to wait while the peer does not keep up.
+    '''
+    header = json.dumps(header, separators=(",", ":")).encode()
+    writer.write(_prefix.pack(len(header), len(payload)) + header)
+    if len(payload) > 0:
+        writer.write(payload)
+
+def encode_frame(frame, encoding="jpeg", quality=90):
+    '''
+    Returns (header fields, payload) of a BGR frame: 'jpeg', 'png' or 'raw'.
+    '''
+    if encoding == "raw":
+        payload = np.ascontiguousarray(frame, dtype=np.uint8).tobytes()
+    elif encoding in ("jpeg", "png"):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality] if encoding == "jpeg" else []
+        ok, data = cv2.imencode("." + ("jpg" if encoding == "jpeg" else "png"), frame, params)
+        if not ok:
+            raise ValueError(f"Frame could not be encoded as {encoding}")
+        payload = data.tobytes()
+    else:
+        raise ValueError(f"Invalid frame encoding '{encoding}'. Valid values are 'jpeg', 'png', 'raw', 'shm'")
+    return {"encoding": encoding, "shape": list(frame.shape)}, payload
+
+def check_shape(shape):
+    '''
+    Returns shape of a frame header as a tuple, raises ValueError unless it is [h, w, 3].
+    '''
+    if not isinstance(shape, (list, tuple)) or len(shape) != 3 or shape[2] != 3 or \
+        not all(isinstance(side, int) and side > 0 for side in shape):
+        raise ValueError(f"Frame shape {shape} is not [height, width, 3]")
+    return tuple(shape)
+
+def decode_frame(header, payload):
+    '''
+    Returns BGR frame of a frame message with a 'jpeg', 'png' or 'raw' payload.
+    '''
+    encoding = header.get("encoding")
+    if encoding == "raw":
+        shape = check_shape(header.get("shape"))
+        if len(payload) != int(np.prod(shape)):
+            raise ValueError(f"Raw frame of {len(payload)} bytes does not match shape {shape}")
+        return np.frombuffer(payload, dtype=np.uint8).reshape(shape)
+    if encoding in ("jpeg", "png"):
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError(f"Frame could not be decoded as {encoding}")
+        return frame
+    raise ValueError(f"Invalid frame encoding '{encoding}'")
+
+def encode_faces(faces):
+    '''
+    Returns list of JSON serializable dicts of faces of a processed frame.
+    '''
+    return [{
+        "face_box": np.asarray(face["face_box"], dtype=np.float32).tolist(),
+        "landmarks": np.asarray(face["landmarks"], dtype=np.float32).tolist(),
+        "head_pose_angles": np.asarray(face["head_pose_angles"], dtype=np.float32).tolist(),
+        "gaze_vector": np.asarray(face["gaze_vector"], dtype=np.float32).tolist(),
+    } for face in faces]
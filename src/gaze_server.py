@@ -0,0 +1,333 @@
+'''
+Gaze inference server, so thin clients can use the models of one machine.
+Clients connect over TCP or a Unix socket and send frames (see
+gaze_protocol.py for the wire format), and get back the face boxes, eye
+landmarks, head pose angles and gaze vectors of each frame.
+
+Frames of all clients are collected into groups of up to max_batch frames,
+waiting at most batch_timeout for more after the first frame of a group, and
+groups run through one Pipeline of the four models (stages.GroupStages),
+so faces of frames of different clients share the same inference batches.
+Frames of a group failing in inference get an error, and frames in flight
+when the pipeline itself fails get one too before it is restarted, so no
+client waits for results which will not come.
+Backpressure: each client has at most max_in_flight frames queued or in
+inference, further frames are not read from its socket until results come
+back, and reading also waits while results are not read by the client.
+
+    python3 src/gaze_server.py -be synthetic -P 9000
+'''
+import asyncio
+import logging as log
+import queue
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+
+import numpy as np
+
+from gaze_protocol import read_message, write_message, check_shape, decode_frame, encode_faces
+from model_manager import ModelManager
+from model_registry import ModelRegistry
+from backends import create_backend, set_default_backend
+from metrics import Metrics, LogSink
+from pipeline import Pipeline
+from stages import GroupStages
+from frame_ring import attach_shared_memory
+
+# Marks the end of requests to the inference thread
+_END = object()
+
+class ClientConnection:
+    '''
+    Connection of a client. Results are sent in the order frames arrived,
+    those finished early (e.g. errors) wait for the ones before them.
+    '''
+    def __init__(self, writer, max_in_flight):
+        self.writer = writer
+        self.slots = asyncio.Semaphore(max_in_flight)
+        # Sequence numbers of frames without a result sent yet, in order of arrival
+        self.order = deque()
+        self.finished = {}
+        self.next_seq = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.closed = False
+        # Shared memory blocks of the client by name, attached on first use
+        self.shared_memory = {}
+
+    def frame_received(self):
+        seq = self.next_seq
+        self.next_seq += 1
+        self.order.append(seq)
+        self.idle.clear()
+        return seq
+
+    def finish(self, seq, message):
+        self.finished[seq] = message
+        while len(self.order) > 0 and self.order[0] in self.finished:
+            header = self.finished.pop(self.order.popleft())
+            if not self.closed:
+                write_message(self.writer, header)
+            self.slots.release()
+        if len(self.order) == 0:
+            self.idle.set()
+
+    def get_shared_frame(self, name, shape):
+        block = self.shared_memory.get(name)
+        if block is None:
+            block = self.shared_memory[name] = attach_shared_memory(name)
+        if int(np.prod(shape)) > block.size:
+            raise ValueError(f"Shared memory block {name} is smaller than frame of shape {shape}")
+        return np.ndarray(shape, dtype=np.uint8, buffer=block.buf)
+
+    def release(self):
+        for block in self.shared_memory.values():
+            try:
+                block.close()
+            except BufferError:
+                # A frame view is still referenced, the mapping is released with it
+                pass
+        self.shared_memory.clear()
+
+class GazeServer:
+    '''
+    models: ModelManager whose active variant runs each group, or a ModelSet.
+    num_requests: Infer requests of each model kept in flight.
+    depth: Max groups waiting in front of each pipeline stage.
+    max_batch: Max frames, of any clients, run together as a group.
+    batch_timeout: Seconds a group waits for more frames after its first one.
+    max_in_flight: Max frames of one client queued or in inference.
+    multi_face: Process all faces of each frame instead of the first one.
+    eye_scale: Width of eye crops relative to the distance between the eyes.
+    metrics: Optional Metrics, stage latencies and 'server_latency' (frame
+             received until its result is sent) are recorded to it.
+    '''
+    def __init__(self, models, num_requests=2, depth=2, max_batch=8, batch_timeout=0.002, max_in_flight=4, \
+        multi_face=False, eye_scale=0.7, metrics=None):
+        self.models = models
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self.max_in_flight = max_in_flight
+        self.metrics = metrics
+        self.pipeline = Pipeline(GroupStages(multi_face, eye_scale, isolate_errors=True).get_stages(num_requests), \
+            depth, metrics)
+
+        self.requests = queue.Queue()
+        # Groups fed to the pipeline without results yet, oldest first
+        self.in_flight = deque()
+        self.ended = False
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+        self.connections = 0
+        self.clients = 0
+        self.frames = 0
+        self.groups = 0
+        self.errors = 0
+
+    async def start(self, host="127.0.0.1", port=9000, path=None):
+        '''
+        Starts serving on a Unix socket at path if given, else on TCP host:port.
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.thread = threading.Thread(target=self._run, name="inference", daemon=True)
+        self.thread.start()
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._serve_client, path)
+        else:
+            self.server = await asyncio.start_server(self._serve_client, host, port)
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.requests.put(_END)
+        await self.loop.run_in_executor(None, self.thread.join)
+
+    def get_stats(self):
+        return {
+            "connections": self.connections,
+            "clients": self.clients,
+            "frames": self.frames,
+            "groups": self.groups,
+            "mean_group": round(self.frames / self.groups, 2) if self.groups > 0 else 0.0,
+            "errors": self.errors,
+        }
+
+    async def _serve_client(self, reader, writer):
+        client = ClientConnection(writer, self.max_in_flight)
+        self.connections += 1
+        self.clients += 1
+        try:
+            while True:
+                # Next frame is read only once the client has a free slot and reads its results
+                await client.slots.acquire()
+                await writer.drain()
+                message = await read_message(reader)
+                if message is None:
+                    break
+                header, payload = message
+                id = header.get("id")
+                seq = client.frame_received()
+                try:
+                    if header.get("type") != "frame":
+                        raise ValueError(f"Invalid message type '{header.get('type')}'")
+                    if header.get("encoding") == "shm":
+                        frame = client.get_shared_frame(header["shm"], check_shape(header.get("shape")))
+                    else:
+                        frame = await self.loop.run_in_executor(None, decode_frame, header, payload)
+                except Exception as e:
+                    self.errors += 1
+                    client.finish(seq, {"type": "error", "id": id, "message": str(e)})
+                    continue
+                self.requests.put({"client": client, "seq": seq, "id": id, "frame": frame, "time": time.perf_counter()})
+        except (ConnectionError, ValueError) as e:
+            log.warning(f"Client connection failed: {e}")
+        finally:
+            # Frames in flight still use shared memory of the client
+            await client.idle.wait()
+            client.closed = True
+            client.release()
+            writer.close()
+            self.clients -= 1
+
+    def _run(self):
+        while not self.ended:
+            try:
+                for group in self.pipeline.run(self._groups()):
+                    self.in_flight.popleft()
+                    self.loop.call_soon_threadsafe(self._send_results, group)
+            except Exception as e:
+                log.exception("Inference failed, frames in flight get an error and the pipeline is restarted")
+                # Stage threads have stopped, groups fed to them will not come out
+                while len(self.in_flight) > 0:
+                    group = self.in_flight.popleft()
+                    group["error"] = e
+                    self.loop.call_soon_threadsafe(self._send_results, group)
+
+    def _groups(self):
+        # Frames of any clients which arrive within batch_timeout of the first one
+        while True:
+            request = self.requests.get()
+            if request is _END:
+                self.ended = True
+                return
+            records = [request]
+            deadline = time.perf_counter() + self.batch_timeout
+            while len(records) < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is _END:
+                    self.requests.put(_END)
+                    break
+                records.append(request)
+            models = self.models.active if hasattr(self.models, "active") else self.models
+            group = {"records": records, "models": models}
+            self.in_flight.append(group)
+            yield group
+
+    def _send_results(self, group):
+        self.groups += 1
+        error = group.get("error")
+        if error is not None:
+            log.warning(f"Inference of {len(group['records'])} frames failed: {error!r}")
+        for record in group["records"]:
+            self.frames += 1
+            if error is not None:
+                self.errors += 1
+                message = {"type": "error", "id": record["id"], "message": f"Inference failed: {error}"}
+            else:
+                message = {"type": "result", "id": record["id"], "faces": encode_faces(record.get("faces", []))}
+            record["client"].finish(record["seq"], message)
+            if self.metrics is not None:
+                self.metrics.record("server_latency", time.perf_counter() - record["time"])
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument("-H", "--host", required=False, type=str, default="127.0.0.1", \
+        help="Host to listen on (default 127.0.0.1)")
+
+    parser.add_argument("-P", "--port", required=False, type=int, default=9000, \
+        help="TCP port to listen on (default 9000)")
+
+    parser.add_argument("-u", "--unix_socket", required=False, type=str, default=None, \
+        help="Listen on a Unix socket at this path instead of TCP")
+
+    parser.add_argument("-d", "--device", required=False, type=str, default="CPU", \
+        help="Device to run inference on (default CPU)")
+
+    parser.add_argument("-p", "--precision", required=False, type=str, default="FP16-INT8", \
+        help="Precision of models (default FP16-INT8)")
+
+    parser.add_argument("-be", "--backend", required=False, type=str, default="openvino", \
+        help="Inference backend: 'openvino', 'onnxruntime' or 'synthetic[:<latency ms>]' (default openvino)")
+
+    parser.add_argument("-b", "--batch_size", required=False, type=int, default=8, \
+        help="Number of faces per inference of landmarks, head pose and gaze models (default 8)")
+
+    parser.add_argument("-g", "--max_batch", required=False, type=int, default=8, \
+        help="Max frames of any clients run together (default 8)")
+
+    parser.add_argument("-bt", "--batch_timeout", required=False, type=float, default=2.0, \
+        help="Milliseconds a group of frames waits for more frames after its first one (default 2)")
+
+    parser.add_argument("-mif", "--max_in_flight", required=False, type=int, default=4, \
+        help="Max frames of one client queued or in inference (default 4)")
+
+    parser.add_argument("-nr", "--num_requests", required=False, type=int, default=2, \
+        help="Number of infer requests of each model kept in flight (default 2)")
+
+    parser.add_argument("-dp", "--pipeline_depth", required=False, type=int, default=2, \
+        help="Max groups of frames queued in front of each model stage (default 2)")
+
+    parser.add_argument("-mf", "--multi_face", required=False, action="store_true", \
+        help="Process all detected faces instead of only the first one")
+
+    parser.add_argument("-es", "--eye_scale", required=False, type=float, default=0.7, \
+        help="Width of eye crops relative to the distance between the eyes (default 0.7)")
+
+    parser.add_argument("-c", "--cache_dir", required=False, type=str, default="models/cache", \
+        help="Directory to cache loaded networks in (default models/cache)")
+
+    parser.add_argument("-si", "--stats_interval", required=False, type=float, default=10.0, \
+        help="Seconds between logs of server stats and latency percentiles (default 10)")
+
+    return parser
+
+async def serve(args):
+    set_default_backend(create_backend(args.backend))
+    log.info("Loading models...")
+    manager = ModelManager("models/intel", args.device, args.num_requests, args.batch_size, \
+        ModelRegistry(args.cache_dir), {"top_k": None if args.multi_face else 1})
+    manager.swap(args.precision)
+
+    metrics = Metrics()
+    server = GazeServer(manager, args.num_requests, args.pipeline_depth, args.max_batch, args.batch_timeout / 1000, \
+        args.max_in_flight, args.multi_face, args.eye_scale, metrics)
+    await server.start(args.host, args.port, args.unix_socket)
+    log.info(f"Serving on {args.unix_socket or f'{args.host}:{args.port}'}")
+
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            log.info(f"Server stats: {server.get_stats()}")
+            LogSink().emit(metrics.snapshot())
+    finally:
+        await server.close()
+        manager.close()
+
+def main():
+    args = build_argparser().parse_args()
+    log.basicConfig(level = log.INFO, format = '%(levelname)s: %(message)s')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        log.info("Server stopped")
+
+if __name__ == "__main__":
+    main()
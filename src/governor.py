@@ -0,0 +1,237 @@
+'''
+Adaptive governor of quality against performance for live input.
+The governor measures frame rate, capture to gaze latency and load of each
+pipeline stage over short windows, and moves knobs (detection interval,
+detector input size, frame skip, infer requests in flight, model precision)
+one step at a time to hold a target frame rate or latency: quality is lowered
+while the target is missed and raised again while there is headroom. A raise
+which makes the target missed again is reverted and not retried for a while,
+growing each time, so the governor settles instead of oscillating.
+Every change is logged with the measurements that caused it. Knobs which
+take a while to apply (e.g. loading models of another precision) do so in the
+background, frames keep flowing meanwhile and are not measured: the next
+window starts with the first frame captured after the change took effect.
+'''
+import logging as log
+import time
+from concurrent.futures import Future
+import numpy as np
+
+class Knob:
+    '''
+    Setting moved by the Governor.
+
+    name: Name of the knob in logs.
+    values: Values in order from best quality to lowest cost.
+    apply: Function called with a new value. If applying takes a while, e.g. to
+           load a model, it returns a Future resolved once the value is in effect.
+    value: Current value, one of values.
+    stages: Names of pipeline stages whose cost the knob lowers. Knobs lowering
+            the bottleneck stage are lowered first.
+    free: True if the knob trades no quality (e.g. infer requests in flight),
+          it is then never raised back.
+    allowed: Optional function returning whether a value may be used.
+    '''
+    def __init__(self, name, values, apply, value, stages=None, free=False, allowed=None):
+        self.name = name
+        self.values = list(values)
+        self.apply = apply
+        self.level = self.values.index(value)
+        self.stages = stages if stages is not None else []
+        self.free = free
+        self.allowed = allowed
+        # Windows left before raising is tried again, and length of next wait
+        self.backoff = 0
+        self.backoff_length = 2
+
+    @property
+    def value(self):
+        return self.values[self.level]
+
+    def can_lower(self):
+        return self.level + 1 < len(self.values) and self._is_allowed(self.values[self.level + 1])
+
+    def can_raise(self):
+        return not self.free and self.level > 0 and self.backoff == 0 and self._is_allowed(self.values[self.level - 1])
+
+    def _is_allowed(self, value):
+        return self.allowed is None or self.allowed(value)
+
+class Governor:
+    '''
+    Holds target frame rate or latency by moving knobs.
+
+    knobs: Knobs in the order they are lowered, least loss of quality first.
+           They are raised in reverse order, most valuable quality first.
+    pipeline: Pipeline whose stage statistics show the bottleneck stage.
+    target_fps: Frames per second to hold.
+    target_latency: p95 of capture to gaze latency (seconds) to hold.
+    interval: Seconds of each measurement window, one decision per window.
+    headroom: Load (fraction of the budget used) below which quality is raised.
+    '''
+    def __init__(self, knobs, pipeline=None, target_fps=None, target_latency=None, interval=2.0, headroom=0.7):
+        if target_fps is None and target_latency is None:
+            raise ValueError("Governor needs a target fps or a target latency")
+        self.knobs = knobs
+        self.pipeline = pipeline
+        self.target_fps = target_fps
+        self.target_latency = target_latency
+        self.interval = interval
+        self.headroom = headroom
+
+        self.latencies = []
+        self.window_start = time.perf_counter()
+        self.stage_totals = self._get_stage_totals()
+        # Knob raised by the last decision, reverted if target is missed right after
+        self.last_raised = None
+        self.decisions = []
+        # Change still being applied, as (knob, level, reason, start, future)
+        self.pending = None
+        # Frames captured before this time ran before the last change took effect
+        self.measure_from = 0.0
+
+    def frame_done(self, capture_time):
+        '''
+        Counts frame whose gaze is ready, making a decision once a window is complete.
+        Knobs are applied from here, in the thread of the caller, between frames.
+        Frames are not counted while a change is applied in the background, nor
+        ones captured before it took effect.
+        '''
+        if self.pending is not None:
+            if not self.pending[4].done():
+                return
+            self._applied()
+        if capture_time < self.measure_from:
+            return
+        now = time.perf_counter()
+        if self.window_start is None:
+            # First frame since the change, the window starts here
+            self._start_window()
+            return
+        self.latencies.append(now - capture_time)
+        if now - self.window_start >= self.interval:
+            self._decide(now)
+
+    def get_stats(self):
+        return {
+            "decisions": len(self.decisions),
+            "knobs": {knob.name: knob.value for knob in self.knobs},
+        }
+
+    def _decide(self, now):
+        elapsed = now - self.window_start
+        fps = len(self.latencies) / elapsed
+        p95 = float(np.percentile(self.latencies, 95)) if len(self.latencies) > 0 else float("inf")
+        stage_loads = self._get_stage_loads(elapsed)
+        bottleneck = max(stage_loads, key=stage_loads.get) if len(stage_loads) > 0 else None
+
+        if self.target_fps is not None:
+            # Load of the bottleneck stage if it ran at the target frame rate
+            stage_load = stage_loads[bottleneck] if bottleneck is not None else 1.0
+            load = stage_load * self.target_fps / max(fps, 1e-6)
+            # Frame rate missed while stages are idle is limited by the input, not by the models
+            missed = fps < 0.95 * self.target_fps
+            over = missed and load >= self.headroom
+            measured = f"fps {fps:.1f} (target {self.target_fps:g})"
+        else:
+            load = p95 / self.target_latency
+            missed = over = load > 1.0
+            measured = f"p95 latency {p95 * 1000:.0f} ms (target {self.target_latency * 1000:.0f} ms)"
+        measured += f", load {load:.2f}"
+        if bottleneck is not None:
+            measured += f", bottleneck {bottleneck} {stage_loads[bottleneck]:.2f}"
+
+        for knob in self.knobs:
+            knob.backoff = max(knob.backoff - 1, 0)
+
+        if over and self.last_raised is not None and self.last_raised.can_lower():
+            knob = self.last_raised
+            self._change(knob, knob.level + 1, f"target missed after raise, reverting ({measured})")
+            knob.backoff = knob.backoff_length
+            knob.backoff_length *= 2
+            self.last_raised = None
+        elif over:
+            knob = self._knob_to_lower(bottleneck)
+            if knob is not None:
+                self._change(knob, knob.level + 1, f"target missed ({measured})")
+            self.last_raised = None
+        elif not missed and load < self.headroom:
+            knob = next((knob for knob in reversed(self.knobs) if knob.can_raise()), None)
+            if knob is not None:
+                self._change(knob, knob.level - 1, f"headroom ({measured})")
+            self.last_raised = knob
+        else:
+            self.last_raised = None
+            log.debug(f"Governor: holding ({measured})")
+
+        # Next window starts after knobs are applied, frames of the change are not measured
+        if self.pending is None:
+            self._start_window()
+
+    def _start_window(self):
+        self.latencies = []
+        self.window_start = time.perf_counter()
+        self.stage_totals = self._get_stage_totals()
+
+    def _knob_to_lower(self, bottleneck):
+        knobs = [knob for knob in self.knobs if knob.can_lower()]
+        for knob in knobs:
+            if bottleneck in knob.stages:
+                return knob
+        return knobs[0] if len(knobs) > 0 else None
+
+    def _change(self, knob, level, reason):
+        start = time.perf_counter()
+        try:
+            result = knob.apply(knob.values[level])
+        except Exception as e:
+            self._failed(knob, level, e)
+            return
+        if isinstance(result, Future):
+            # Applied in the background, frames are not measured until it is done
+            log.info(f"Governor: {reason}: {knob.name} {knob.value} -> {knob.values[level]} (applying)")
+            self.pending = (knob, level, reason, start, result)
+            self.latencies = []
+            self.window_start = None
+            return
+        self._done(knob, level, reason, start)
+
+    def _applied(self):
+        knob, level, reason, start, future = self.pending
+        self.pending = None
+        # Frames in flight meanwhile ran with the old value
+        self.measure_from = time.perf_counter()
+        if future.exception() is not None:
+            self._failed(knob, level, future.exception())
+            return
+        self._done(knob, level, reason, start)
+
+    def _done(self, knob, level, reason, start):
+        old = knob.value
+        knob.level = level
+        apply_time = time.perf_counter() - start
+        self.decisions.append((time.time(), knob.name, old, knob.value, reason))
+        log.info(f"Governor: {reason}: {knob.name} {old} -> {knob.value}" + \
+            (f" (applied in {int(apply_time * 1000)} ms)" if apply_time >= 0.01 else ""))
+
+    def _failed(self, knob, level, error):
+        # E.g. a network which can not be reshaped, the value is not tried again
+        old = knob.value
+        log.warning(f"Governor: {knob.name} {knob.values[level]} failed, value dropped: {error}")
+        knob.values.pop(level)
+        knob.level = knob.values.index(old)
+
+    def _get_stage_totals(self):
+        if self.pipeline is None:
+            return {}
+        totals = {}
+        for stats in self.pipeline.stats:
+            with stats.lock:
+                totals[stats.name] = stats.busy_time
+        return totals
+
+    def _get_stage_loads(self, elapsed):
+        # Fraction of the window each stage was busy, per item it may keep in flight
+        totals = self._get_stage_totals()
+        return {name: (busy - self.stage_totals.get(name, 0.0)) / elapsed / self.pipeline.max_in_flight[name] \
+            for name, busy in totals.items()}
@@ -0,0 +1,161 @@
+'''
+Pool of infer requests of a loaded network, so that several inferences of
+the same model can be in flight at once. Requests are submitted without
+blocking and their results are delivered through futures.
+'''
+import threading
+from concurrent.futures import Future, wait
+from queue import Queue
+
+class InferRequestPool:
+    '''
+    Wraps infer requests of an executable network.
+
+    exec_network: Network loaded with `load_network(..., num_requests=N)`.
+    keep_completed: If True, futures are also queued in order of completion
+                    and can be retrieved with `get_completed()`.
+    '''
+    def __init__(self, exec_network, keep_completed=False):
+        self.requests = exec_network.requests
+        self.keep_completed = keep_completed
+        self.idle_requests = Queue()
+        self.completed = Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        for request_id, request in enumerate(self.requests):
+            request.set_completion_callback(self._on_complete, request_id)
+            self.idle_requests.put(request_id)
+
+    def get_num_requests(self):
+        return len(self.requests)
+
+    def submit(self, inputs, postprocess=None, callback=None):
+        '''
+        Starts inference on next idle request, blocking only if all requests are busy.
+
+        inputs: dict of input blob name to input data.
+        postprocess: Function called with outputs of request once it completes.
+                     Its return value is the result of the future. If not given,
+                     a copy of the outputs dict is the result.
+        callback: Function called with the future once it is done.
+        Returns a concurrent.futures.Future.
+        '''
+        request_id = self.idle_requests.get()
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        with self.lock:
+            self.pending[request_id] = (future, postprocess)
+        self.requests[request_id].async_infer(inputs)
+        return future
+
+    def get_completed(self, timeout=None):
+        '''
+        Returns the next future in order of completion.
+        '''
+        if not self.keep_completed:
+            raise ValueError("Pool was not created with keep_completed=True")
+        return self.completed.get(timeout=timeout)
+
+    def wait_all(self):
+        '''
+        Blocks until all submitted requests are completed.
+        '''
+        with self.lock:
+            futures = [future for future, _ in self.pending.values()]
+        wait(futures)
+
+    def _on_complete(self, status, request_id):
+        with self.lock:
+            future, postprocess = self.pending.pop(request_id)
+
+        result = None
+        error = None
+        try:
+            if status != 0:
+                # Requests of the Python backends keep the exception which failed them
+                exception = getattr(self.requests[request_id], "exception", None)
+                if exception is not None:
+                    raise RuntimeError(f"Inference request failed: {exception!r}") from exception
+                raise RuntimeError(f"Inference request failed with status {status}")
+            outputs = self.requests[request_id].outputs
+            if postprocess is not None:
+                result = postprocess(outputs)
+            else:
+                result = {name: blob.copy() for name, blob in outputs.items()}
+        except Exception as e:
+            error = e
+
+        # Outputs are processed, request can be reused now
+        self.idle_requests.put(request_id)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        if self.keep_completed:
+            self.completed.put(future)
+
+def chain(future, function):
+    '''
+    Returns a future resolved with function applied to the result of given future.
+    '''
+    chained = Future()
+    chained.set_running_or_notify_cancel()
+
+    def on_done(done):
+        try:
+            chained.set_result(function(done.result()))
+        except Exception as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return chained
+
+def recover(future, function):
+    '''
+    Returns a future resolved with the result of given future, or with function
+    applied to its exception if it failed.
+    '''
+    recovered = Future()
+    recovered.set_running_or_notify_cancel()
+
+    def on_done(done):
+        try:
+            recovered.set_result(done.result())
+        except Exception as e:
+            recovered.set_result(function(e))
+
+    future.add_done_callback(on_done)
+    return recovered
+
+def gather(futures):
+    '''
+    Returns a future resolved with list of results of given futures, in order.
+    '''
+    gathered = Future()
+    gathered.set_running_or_notify_cancel()
+    if len(futures) == 0:
+        gathered.set_result([])
+        return gathered
+
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        try:
+            gathered.set_result([future.result() for future in futures])
+        except Exception as e:
+            gathered.set_exception(e)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return gathered
@@ -1,25 +1,62 @@
 '''
 This class can be used to feed input from an image, webcam, or video to your model.
+Frames of video and webcam are read by a background thread into a bounded buffer,
+so decoding overlaps with inference. Each frame is tagged with its sequence number
+and capture time, to measure latency from capture to pointer movement.
 '''
+import threading
+import time
+from collections import deque
 import cv2
+import numpy as np
 from numpy import ndarray
 
 class InputFeeder:
-    def __init__(self, input_type, input_file=None):
+    def __init__(self, input_type, input_file=None, frame_policy=None, frame_step=10, buffer_size=4, camera=0):
         '''
         input_type: str, The type of input. Can be 'video' for video file, 'image' for image file,
                     or 'cam' to use webcam feed.
         input_file: str, The file that contains the input image or video file. Leave empty for cam input_type.
+        frame_policy: str, Which frames are fed. Can be 'all' to feed every frame, 'nth' to feed every
+                      frame_step-th frame, or 'latest' to feed the newest frame (for live cameras):
+                      one frame is read ahead, and frames arriving while it waits for inference are
+                      dropped. Defaults to 'latest' for cam and 'nth' otherwise.
+        frame_step: int, Feed every this many frames with 'nth' policy. Skipped frames are not decoded.
+        buffer_size: int, Max number of frames read ahead of inference, 1 with 'latest' policy.
+        camera: int, Index of webcam for cam input_type.
         '''
         self.input_type=input_type
         if input_type=='video' or input_type=='image':
             self.input_file=input_file
-    
+        if frame_policy is None:
+            frame_policy='latest' if input_type=='cam' else 'nth'
+        if frame_policy not in ('all', 'nth', 'latest'):
+            raise ValueError(f"Invalid frame policy '{frame_policy}'. Valid values are 'all', 'nth', 'latest'")
+        self.frame_policy=frame_policy
+        self.frame_step=frame_step if frame_policy=='nth' else 1
+        self.camera=camera
+        if frame_policy=='latest':
+            # A frame read ahead gets older until inference takes it
+            buffer_size=1
+
+        self.buffer=deque(maxlen=buffer_size)
+        self.buffer_size=buffer_size
+        self.condition=threading.Condition()
+        self.thread=None
+        self.stopped=False
+        self.ended=False
+        self.image_fed=False
+
+        self.frames_read=0
+        self.frames_skipped=0
+        self.frames_dropped=0
+        self.max_queue_depth=0
+
     def load_data(self):
         if self.input_type=='video':
             self.cap=cv2.VideoCapture(self.input_file)
         elif self.input_type=='cam':
-            self.cap=cv2.VideoCapture(0)
+            self.cap=cv2.VideoCapture(self.camera)
         else:
             self.cap=cv2.imread(self.input_file)
 
@@ -27,20 +64,141 @@ class InputFeeder:
         '''
         Returns the next image from either a video file or webcam.
         If input_type is 'image', then it returns the same image.
+        Yields None once the end of video is reached.
+        '''
+        for _, _, frame in self.next_frames():
+            yield frame
+        if self.input_type!="image":
+            yield None
+
+    def next_frames(self):
+        '''
+        Yields (seq, capture_time, frame) for each frame fed, where seq is the index
+        of the frame in the input (counting skipped frames) and capture_time is
+        time.perf_counter() when the frame was read. Ends at the end of video.
         '''
         if self.input_type=="image":
-            itr=iter([self.cap])
-            try:
-                frame=next(itr)
-                yield frame
-            except StopIteration:
-                yield None
+            yield 0, time.perf_counter(), self.cap
         else:
+            self._start_capture()
             while True:
-                for _ in range(10):
-                    _, frame=self.cap.read()
-                yield frame
-    
+                with self.condition:
+                    while len(self.buffer)==0 and not self.ended:
+                        self.condition.wait()
+                    if len(self.buffer)==0:
+                        break
+                    item=self.buffer.popleft()
+                    self.condition.notify_all()
+                yield item
+
+    def next_frame(self, timeout=None):
+        '''
+        Returns next (seq, capture_time, frame) as next_frames does, or None if
+        no frame is buffered within timeout seconds (None waits until one is, 0
+        does not wait) or the input has ended, see is_done. Lets one thread
+        poll several feeders without waiting on any of them.
+        '''
+        if self.input_type=="image":
+            if self.image_fed:
+                return None
+            self.image_fed=True
+            return 0, time.perf_counter(), self.cap
+        self._start_capture()
+        with self.condition:
+            if len(self.buffer)==0 and not self.ended:
+                self.condition.wait_for(lambda: len(self.buffer)>0 or self.ended, timeout)
+            if len(self.buffer)==0:
+                return None
+            item=self.buffer.popleft()
+            self.condition.notify_all()
+        return item
+
+    def is_done(self):
+        '''
+        Returns True once all frames of the input have been returned.
+        '''
+        if self.input_type=="image":
+            return self.image_fed
+        with self.condition:
+            return self.ended and len(self.buffer)==0
+
+    def get_stats(self):
+        '''
+        Returns counters of frames read, skipped without decoding, dropped on
+        overflow of the buffer, and current & max depth of the buffer.
+        '''
+        with self.condition:
+            return {
+                "read": self.frames_read,
+                "skipped": self.frames_skipped,
+                "dropped": self.frames_dropped,
+                "queue_depth": len(self.buffer),
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+    def release(self, seq):
+        '''
+        Frames of InputFeeder are never reused, kept for the interface of frame_ring.RingFeeder.
+        '''
+        pass
+
+    def feed_ring(self, ring, frame_step=None):
+        '''
+        Reads frames of video or webcam straight into slots of a frame_ring.FrameRing,
+        decoding each in place, until the end of input or until the ring is stopped.
+        Used by a capture process instead of the background thread.
+        frame_step: Optional shared multiprocessing.Value of the frame step, read before each frame.
+        '''
+        width, height=self.get_input_shape()
+        shape=(height, width, 3)
+        seq=0
+        while not ring.stopped.is_set():
+            if frame_step is not None:
+                self.frame_step=frame_step.value
+            skipped=self.frames_skipped
+            seq=self._skip_frames(seq)
+            ring.count_skipped(self.frames_skipped - skipped)
+            slot=ring.claim()
+            if slot is None:
+                # Dropped by the overflow policy of the ring, or the ring is stopped
+                if not self.cap.grab():
+                    break
+                seq+=1
+                continue
+            view=ring.view(slot, shape)
+            flag, frame=self.cap.read(view)
+            if not flag:
+                ring.abandon(slot)
+                break
+            if frame.shape!=shape:
+                ring.abandon(slot)
+                raise ValueError(f"Frame of shape {frame.shape} differs from input shape {shape}")
+            if not np.shares_memory(frame, view):
+                # Decoder did not write into the slot
+                view[:]=frame
+            ring.publish(slot, seq, time.perf_counter(), shape)
+            self.frames_read+=1
+            seq+=1
+
+    def set_frame_step(self, frame_step):
+        '''
+        Changes how many frames are read per frame fed, 1 feeds every frame.
+        Takes effect from the next frame read. Only 'nth' policy skips frames,
+        'all' feeds every frame and 'latest' drops them as inference needs.
+        '''
+        if self.frame_policy!='nth':
+            raise ValueError(f"Frame step can not be changed with '{self.frame_policy}' frame policy")
+        self.frame_step=frame_step
+
+    def get_fps(self):
+        '''
+        Returns frame rate of video or webcam, None if unknown.
+        '''
+        if self.input_type=='image':
+            return None
+        fps=self.cap.get(cv2.CAP_PROP_FPS)
+        return fps if fps>0 else None
+
     def get_input_shape(self):
         '''
         Returns shape of the input
@@ -61,5 +219,59 @@ class InputFeeder:
         Closes the VideoCapture.
         '''
         if not self.input_type=='image':
+            with self.condition:
+                self.stopped=True
+                self.condition.notify_all()
+            if self.thread is not None:
+                self.thread.join()
             self.cap.release()
 
+    def _start_capture(self):
+        if self.thread is None:
+            self.thread=threading.Thread(target=self._capture, daemon=True)
+            self.thread.start()
+
+    def _skip_frames(self, seq):
+        # Skipped frames are only grabbed, not decoded
+        for _ in range(self.frame_step - 1):
+            if not self.cap.grab():
+                break
+            self.frames_skipped+=1
+            seq+=1
+        return seq
+
+    def _capture(self):
+        seq=0
+        while not self.stopped:
+            seq=self._skip_frames(seq)
+            if self.frame_policy=='latest':
+                if not self.cap.grab():
+                    break
+                with self.condition:
+                    dropped=len(self.buffer)==self.buffer_size
+                    if dropped:
+                        self.frames_dropped+=1
+                if dropped:
+                    # Inference has not taken the frame read ahead yet, this one is not decoded
+                    seq+=1
+                    continue
+                flag, frame=self.cap.retrieve()
+            else:
+                flag, frame=self.cap.read()
+            if not flag:
+                break
+            capture_time=time.perf_counter()
+
+            with self.condition:
+                # Wait for room in buffer instead of dropping frames, 'latest' has room already
+                while len(self.buffer)==self.buffer_size and not self.stopped:
+                    self.condition.wait()
+                self.buffer.append((seq, capture_time, frame))
+                self.frames_read+=1
+                self.max_queue_depth=max(self.max_queue_depth, len(self.buffer))
+                self.condition.notify_all()
+            seq+=1
+
+        with self.condition:
+            self.ended=True
+            self.condition.notify_all()
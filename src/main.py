@@ -1,32 +1,38 @@
-from face_detection import Face_Detection
-from facial_landmarks_detection import Facial_Landmarks_Detection
-from head_pose_estimation import Head_Pose_Estimation
-from gaze_estimation import Gaze_Estimation
-
+from model_manager import ModelManager, ABTest, get_variant_name
 from input_feeder import InputFeeder
+from frame_ring import RingFeeder
 from mouse_controller import MouseController
+from pipeline import Pipeline
+from stages import GroupStages
+from model_registry import ModelRegistry
+from backends import create_backend, set_default_backend
+from face_tracker import FaceTracker
+from change_gate import ChangeGate
+from metrics import Metrics, MetricsReporter, LogSink, create_sink
+from result_store import ResultRecorder
+from overlay import draw_face
+from pointer_output import create_output
+from pointer import PointerEngine, Calibration, CalibrationSession, create_filter
+from tracing import Tracer, PointerLatency
+from governor import Governor, Knob
 
 import logging as log
 from argparse import ArgumentParser
 import mimetypes
+import os
+import time
 
 import cv2
 
-### Model IR paths
-path_face_detection = "models/intel/face-detection-adas-0001/FP16-INT8/face-detection-adas-0001.xml"
-path_facial_landmarks_detection = "models/intel/landmarks-regression-retail-0009/FP16-INT8/landmarks-regression-retail-0009.xml"
-path_head_pose_estimation = "models/intel/head-pose-estimation-adas-0001/FP16-INT8/head-pose-estimation-adas-0001.xml"
-path_gaze_estimation = "models/intel/gaze-estimation-adas-0002/FP16-INT8/gaze-estimation-adas-0002.xml"
+### Directory of model IRs, with a directory per model and precision
+model_dir = "models/intel"
 
-### Model global variables
-face_detection = None
-facial_landmarks_detection = None
-head_pose_estimation = None
-gaze_estimation = None
+### Manager of loaded model variants. Each frame runs on the variant active when
+### it was read, so variants can be swapped while frames are in flight
+manager = None
 
-### Offsets to crop eyes from face
-x_offset = 35
-y_offset = 20
+### Latencies of all stages of the app
+metrics = Metrics()
 
 def build_argparser():
     parser = ArgumentParser()
@@ -42,36 +48,172 @@ def build_argparser():
     parser.add_argument("-d", "--device", required=False, type=str, default="CPU", \
         help="Set the device to run inference on (default cpu)")
 
-    return parser
+    parser.add_argument("-pd", "--pipeline_depth", required=False, type=int, default=2, \
+        help="Max frames queued in front of each model stage (default 2). " \
+        "0 runs models one after another without pipelining")
 
-### Initiate & load all required models
-def init_models(device="CPU"):
-    # Using global variables, not defining new variables
-    global face_detection
-    global facial_landmarks_detection
-    global head_pose_estimation
-    global gaze_estimation
-
-    log.info("Loading Face Detection model...")
-    face_detection = Face_Detection(path_face_detection, device)
-    face_detection.load_model()
-    log.info("DONE\n")
+    parser.add_argument("-nr", "--num_requests", required=False, type=int, default=2, \
+        help="Number of infer requests of each model kept in flight (default 2)")
 
-    log.info("Loading Face Landmarks Detection model...")
-    facial_landmarks_detection = Facial_Landmarks_Detection(path_facial_landmarks_detection, device)
-    facial_landmarks_detection.load_model()
-    log.info("DONE\n")
+    parser.add_argument("-c", "--cache_dir", required=False, type=str, default="models/cache", \
+        help="Directory to cache loaded networks in for faster restarts (default models/cache)")
 
-    log.info("Loading Head Pose Estimation model...")
-    head_pose_estimation = Head_Pose_Estimation(path_head_pose_estimation, device)
-    head_pose_estimation.load_model()
-    log.info("DONE\n")
+    parser.add_argument("-mf", "--multi_face", required=False, action="store_true", \
+        help="Process all detected faces instead of only the first one")
+
+    parser.add_argument("-b", "--batch_size", required=False, type=int, default=1, \
+        help="Number of faces stacked in one inference of landmarks, head pose and gaze models (default 1)")
+
+    parser.add_argument("-k", "--detect_interval", required=False, type=int, default=1, \
+        help="Run face detection every k frames and track faces in between (default 1, no tracking)")
+
+    parser.add_argument("-tc", "--track_confidence", required=False, type=float, default=0.6, \
+        help="Run face detection early when tracking confidence drops below this value (default 0.6)")
+
+    parser.add_argument("-es", "--eye_scale", required=False, type=float, default=0.7, \
+        help="Width of eye crops relative to distance between the eyes (default 0.7)")
+
+    parser.add_argument("-cg", "--change_threshold", required=False, type=float, default=None, \
+        help="Reuse results of the last processed frame while the mean differences of its downsampled face " \
+        "region and eye boxes stay below this (0 to 255, e.g. 3). Every frame is processed if not given")
+
+    parser.add_argument("-cga", "--change_max_age", required=False, type=float, default=1.0, \
+        help="Max seconds results of a processed frame are reused with --change_threshold, in video time " \
+        "for video files (default 1)")
+
+    parser.add_argument("-fp", "--frame_policy", required=False, type=str, default=None, \
+        help="Frames fed from video or cam. Valid values are 'all', 'nth' (every n-th frame) and " \
+        "'latest' (drop frames arriving while inference is behind). Default 'latest' for cam, 'nth' otherwise")
+
+    parser.add_argument("-n", "--frame_step", required=False, type=int, default=10, \
+        help="Feed every n-th frame with 'nth' frame policy (default 10)")
+
+    parser.add_argument("-cp", "--capture_process", required=False, action="store_true", \
+        help="Read and decode video or cam frames in a separate process, passing them through shared memory")
+
+    parser.add_argument("-rs", "--ring_slots", required=False, type=int, default=16, \
+        help="Frames of the shared memory ring of --capture_process, more than frames in flight (default 16)")
+
+    parser.add_argument("-ms", "--metrics_sink", required=False, type=str, default=None, \
+        help="Periodically export stage latency percentiles to 'log', 'jsonl:<path>' or 'prometheus:<port>'")
+
+    parser.add_argument("-mi", "--metrics_interval", required=False, type=float, default=10.0, \
+        help="Seconds between exports of stage latency percentiles (default 10)")
+
+    parser.add_argument("-be", "--backend", required=False, type=str, default="openvino", \
+        help="Inference backend: 'openvino', 'onnxruntime' or 'synthetic[:<latency ms>]' (default openvino)")
+
+    parser.add_argument("-rec", "--record", required=False, type=str, default=None, \
+        help="Record results of each face to this file, as .npz or as raw binary for any other extension")
+
+    parser.add_argument("-po", "--pointer_output", required=False, type=str, default="pyautogui", \
+        help="Pointer output: 'pyautogui', 'xlib[:<display>]', 'uinput', 'null' or 'record:<csv path>' (default pyautogui)")
+
+    parser.add_argument("-tr", "--trace", required=False, type=str, default=None, \
+        help="Write a Chrome trace (JSON) of stages of each frame from capture to pointer move to this file, " \
+            "to open in chrome://tracing or ui.perfetto.dev")
+
+    parser.add_argument("-gf", "--target_fps", required=False, type=float, default=None, \
+        help="Frames per second the governor holds by changing detection interval, detector input size, " \
+            "frame skip, infer requests in flight and model precision")
+
+    parser.add_argument("-gl", "--target_latency", required=False, type=float, default=None, \
+        help="p95 latency (ms) from capture to gaze the governor holds, instead of a frame rate")
+
+    parser.add_argument("-gi", "--governor_interval", required=False, type=float, default=2.0, \
+        help="Seconds between decisions of the governor (default 2)")
+
+    parser.add_argument("-nms", "--nms_threshold", required=False, type=float, default=None, \
+        help="Suppress face boxes overlapping a more confident box by more than this IoU (default off)")
 
-    log.info("Loading Gaze Estimation model...")
-    gaze_estimation = Gaze_Estimation(path_gaze_estimation, device)
-    gaze_estimation.load_model()
+    parser.add_argument("-fo", "--face_order", required=False, type=str, default="confidence", \
+        choices=["confidence", "area"], help="Face followed, or order of faces with -mf: most confident " \
+            "or largest (default confidence)")
+
+    parser.add_argument("-p", "--precision", required=False, type=str, default="FP16-INT8", \
+        help="Precision of models: FP32, FP16 or FP16-INT8 (default FP16-INT8)")
+
+    parser.add_argument("-pp", "--preload", required=False, type=str, nargs="+", default=[], \
+        help="Precisions loaded in the background while running, to swap to without waiting")
+
+    parser.add_argument("-ab", "--ab_interval", required=False, type=float, default=None, \
+        help="A/B test: cycle through --precision and --preload precisions every this many seconds, " \
+            "logging latency and frame rate of each")
+
+    parser.add_argument("-pf", "--pointer_filter", required=False, type=str, default="one_euro", \
+        help="Filter of pointer targets: 'none', 'ema[:alpha]', 'one_euro[:min_cutoff[:beta]]' " \
+            "or 'kalman[:process_noise[:measurement_noise]]' (default one_euro)")
+
+    parser.add_argument("-pr", "--pointer_rate", required=False, type=float, default=60.0, \
+        help="Pointer updates per second, independent of the inference frame rate (default 60)")
+
+    parser.add_argument("-dz", "--deadzone", required=False, type=float, default=20.0, \
+        help="Pointer target changes smaller than this many pixels are ignored (default 20)")
+
+    parser.add_argument("-cal", "--calibration", required=False, type=str, default=None, \
+        help="Calibration file mapping gaze to screen. Loaded if it exists, else calibration targets " \
+            "are shown first and the result is saved to it")
+
+    return parser
+
+### Initiate & load all required models, in precision and in the background in preload precisions
+def init_models(device="CPU", num_requests=1, cache_dir=None, batch_size=1, precision="FP16-INT8", preload=(), \
+    detector_options=None):
+    # Using global variables, not defining new variables
+    global manager
+
+    log.info("Loading models...")
+    # All models share one core and are loaded in parallel
+    manager = ModelManager(model_dir, device, num_requests, batch_size, ModelRegistry(cache_dir), detector_options)
+    manager.swap(precision)
+    for other in preload:
+        manager.load_async(other)
     log.info("DONE\n")
 
+### Governor of quality against performance, with all knobs available for the input
+def build_governor(args, pipeline, feed, tracker):
+    knobs = []
+
+    if args.target_fps is None and args.num_requests > 1:
+        # Fewer requests in flight wait less behind each other, frame rate already gets all of them
+        def set_in_flight(value):
+            for stats in pipeline.stats:
+                pipeline.set_max_in_flight(stats.name, value)
+        knobs.append(Knob("max_in_flight", range(args.num_requests, 0, -1), set_in_flight, args.num_requests, free=True))
+
+    intervals = sorted({1, 2, 3, 5, 8, args.detect_interval})
+    knobs.append(Knob("detect_interval", intervals, lambda value: setattr(tracker, "redetect_interval", value), \
+        args.detect_interval, stages=["face_detection"]))
+
+    detector_scale = Knob("detector_scale", [1.0, 0.75, 0.5], None, 1.0, stages=["face_detection"])
+    knobs.append(detector_scale)
+
+    if args.input_type != "image" and feed.frame_policy == "nth":
+        # Frames are skipped only with 'nth' policy, 'latest' drops them by itself
+        source_fps = feed.get_fps()
+        allowed = None
+        if args.target_fps is not None and source_fps is not None:
+            # Skipping frames can not go below the target frame rate
+            allowed = lambda value: source_fps / value >= args.target_fps
+        steps = sorted({1, 2, 3, 4, feed.frame_step})
+        knobs.append(Knob("frame_step", steps, feed.set_frame_step, feed.frame_step, allowed=allowed))
+
+    # Precisions downloaded for all models, best quality first
+    precision = manager.active.precision
+    precisions = manager.get_available_precisions()
+    if precision not in precisions:
+        precisions = [precision]
+    precision = Knob("precision", precisions, None, precision)
+    knobs.append(precision)
+
+    # Variants load in the background while frames keep running on the active one,
+    # the governor measures again from the first frame on the new variant
+    detector_scale.apply = lambda value: manager.swap(precision.value, value, wait=False)
+    precision.apply = lambda value: manager.swap(value, detector_scale.value, wait=False)
+
+    target_latency = args.target_latency / 1000 if args.target_latency is not None else None
+    return Governor(knobs, pipeline, args.target_fps, target_latency, args.governor_interval)
+
 ### Validate input file provided
 def validate_input(input_type, input_path):
     valid_types = ["image", "video", "cam"]
@@ -102,16 +244,70 @@ def get_media_type(file_path):
     media_type = mime_type.split("/")[0]
     return media_type
 
-### Crop rectangle from given coordinates
-def crop_rect(image, coords):
-    xmin = coords[0]
-    ymin = coords[1]
-    xmax = coords[2]
-    ymax = coords[3]
-
-    crop = image[ymin:ymax, xmin:xmax]
-
-    return crop
+def build_pipeline(depth, num_requests=1, multi_face=False, tracker=None, eye_scale=0.7, tracer=None, \
+    gate=None, on_drop=None):
+    # Groups of one frame, frames without a face are dropped
+    stages = GroupStages(multi_face, eye_scale, tracker, gate, drop_empty=True, metrics=metrics)
+    return Pipeline(stages.get_stages(num_requests), depth, metrics, tracer, \
+        lambda group: group["records"][0]["index"], on_drop)
+
+### Yield groups of one frame from feed until an empty frame is found
+def read_frames(feed):
+    frames = feed.next_frames()
+    while True:
+        start = time.perf_counter()
+        item = next(frames, None)
+        metrics.record("capture", time.perf_counter() - start)
+        if (item is None):
+            log.info("Empty frame found. Ending stream now.")
+            break
+        # Sequence number and capture time tag the frame up to the pointer move
+        seq, capture_time, frame = item
+        # All stages of the frame run on the variant active now, even if swapped meanwhile
+        models = manager.active
+        yield {"records": [{"frame": frame, "index": seq, "time": capture_time, "models": models}], "models": models}
+
+### Yield the record of each group, freeing its frame once the caller is done with it. Frames
+### of groups dropped in the pipeline (e.g. without a face) are freed by its on_drop
+def release_frames(feed, groups):
+    for group in groups:
+        record = group["records"][0]
+        yield record
+        feed.release(record["index"])
+
+def record_results(recorder, record):
+    models = record["models"]
+    variant = get_variant_name(models.precision, models.detector_scale)
+    for i, face in enumerate(record["faces"]):
+        recorder.append(record["index"], i, face["face_box"], face["landmarks"], face["head_pose_angles"], \
+            face["gaze_vector"], record["time"], variant=variant)
+
+def show_record(record):
+    frame = record["frame"]
+    for face in record["faces"]:
+        show_face(frame, face)
+    cv2.imshow("Results", frame)
+
+def show_face(frame, face):
+    xmin, ymin, xmax, ymax = face["face_rect"]
+    left_eye_pos, right_eye_pos = face["eye_pos"]
+    head_pose_angles = face["head_pose_angles"]
+    gaze_vector = face["gaze_vector"]
+
+    draw_face(frame, face["face_rect"], face["eye_pos"], face["eye_coords"], gaze_vector)
+    pos_left_eye = (left_eye_pos[0] + xmin, left_eye_pos[1] + ymin)
+    pos_right_eye = (right_eye_pos[0] + xmin, right_eye_pos[1] + ymin)
+
+    log.info(f"Face box coords: ({xmin}, {ymin}), ({xmax}, {ymax})")
+    log.info(f"Left Eye coords: {pos_left_eye}, Right Eye coords: {pos_right_eye}")
+    log.info(f"Head pose angles: {head_pose_angles}")
+    log.info(f"Gaze Vector: {gaze_vector}\n")
+
+def log_pipeline_stats(pipeline):
+    log.info("Pipeline stage stats:")
+    for stats in pipeline.get_stats():
+        log.info(f"{stats['stage']}: {stats['count']} frames, latency {stats['latency_ms']} ms, " \
+            f"throughput {stats['throughput_fps']} frames/s, utilization {stats['utilization']}")
 
 def main():
     # Get command line arguments
@@ -125,92 +321,146 @@ def main():
     # Whether to show intermediate results from models
     show_results = args.results
 
-    init_models(args.device)
-
-    feed = InputFeeder(args.input_type, args.input)
+    # Models and registry use this backend
+    set_default_backend(create_backend(args.backend))
+    # Detector returns only the face followed, unless all faces are
+    detector_options = {"iou_threshold": args.nms_threshold, "order": args.face_order, \
+        "top_k": None if args.multi_face else 1}
+    init_models(args.device, args.num_requests, args.cache_dir, args.batch_size, args.precision, args.preload, \
+        detector_options)
+
+    if args.capture_process and args.input_type != "image":
+        # Frames are decoded into shared memory by another process, the GIL is not shared with it
+        feed = RingFeeder(args.input_type, args.input, args.frame_policy, args.frame_step, args.ring_slots)
+    else:
+        feed = InputFeeder(args.input_type, args.input, args.frame_policy, args.frame_step)
     feed.load_data()
-    width, height = feed.get_input_shape()
-
-    controller = MouseController("medium", "fast")
-    controller.move_to_center()
 
-    for frame in feed.next_batch():
-        ### Extract face from frame
-        if (frame is None):
-            log.info("Empty frame found. Ending stream now.")
-            break
+    tracer = Tracer(args.trace) if args.trace is not None else None
 
-        box_coords = face_detection.predict(frame)
-        # continue with next frame with no face is detected
-        if (len(box_coords) == 0):
-            continue
+    controller = MouseController("medium", "fast", create_output(args.pointer_output), PointerLatency(metrics, tracer))
+    controller.move_to_center()
 
-        face_coords = box_coords[0]
-        xmin = int(face_coords[0] * width)
-        ymin = int(face_coords[1] * height)
-        xmax = int(face_coords[2] * width)
-        ymax = int(face_coords[3] * height)
-        face = crop_rect(frame, (xmin, ymin, xmax, ymax))
-        face_height, face_width, _ = face.shape
-
-        ### Extract left and right eye from face
-        eye_landmarks = facial_landmarks_detection.predict(face)
-        landmarks_pos = [(int(l[0] * face_width), int(l[1] * face_height)) for l in eye_landmarks]
-        left_eye_pos = landmarks_pos[0]
-        right_eye_pos = landmarks_pos[1]
-        left_eye_coords = [left_eye_pos[0] - x_offset, left_eye_pos[1] - y_offset, left_eye_pos[0] + x_offset, left_eye_pos[1] + y_offset]
-        right_eye_coords = [right_eye_pos[0] - x_offset, right_eye_pos[1] - y_offset, right_eye_pos[0] + x_offset, right_eye_pos[1] + y_offset]
-        
-        # Zero out any negative values
-        for i in range(4):
-            left_eye_coords[i] = max(left_eye_coords[i], 0)
-            right_eye_coords[i] = max(right_eye_coords[i], 0)
-        left_eye = crop_rect(face, left_eye_coords)
-        right_eye = crop_rect(face, right_eye_coords)
-
-
-        ### Extract yaw, pitch and roll angles from face
-        head_pose_angles = head_pose_estimation.predict(face)
-
-        ### Extract gaze vector given both eyes and angles
-        gaze_vector = gaze_estimation.predict(left_eye, right_eye, head_pose_angles)
+    calibration = None
+    session = None
+    if args.calibration is not None:
+        if os.path.exists(args.calibration):
+            calibration = Calibration.load(args.calibration)
+        else:
+            session = CalibrationSession(controller.get_screen_size())
+            cv2.namedWindow("Calibration", cv2.WND_PROP_FULLSCREEN)
+            cv2.setWindowProperty("Calibration", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+    engine = PointerEngine(controller, calibration, create_filter(args.pointer_filter), \
+        args.deadzone, args.pointer_rate).start()
+
+    use_governor = args.target_fps is not None or args.target_latency is not None
+    tracker = None
+    if args.detect_interval > 1 or use_governor:
+        # Governor changes the detection interval of the tracker
+        tracker = FaceTracker(args.detect_interval, args.track_confidence)
+
+    reporter = None
+    if args.metrics_sink is not None:
+        reporter = MetricsReporter(metrics, create_sink(args.metrics_sink), args.metrics_interval).start()
+
+    recorder = None
+    if args.record is not None:
+        recorder = ResultRecorder(args.record, metadata={"input": args.input, "input_type": args.input_type, \
+            "frame_size": feed.get_input_shape(), "eye_scale": args.eye_scale})
+
+    gate = None
+    if args.change_threshold is not None:
+        # Video files are not read in real time, ages of their frames are measured in video time
+        gate = ChangeGate(args.change_threshold, args.change_max_age, \
+            fps=feed.get_fps() if args.input_type == "video" else None)
+
+    pipeline = build_pipeline(args.pipeline_depth, args.num_requests, args.multi_face, tracker, args.eye_scale, tracer, \
+        gate, lambda group: feed.release(group["records"][0]["index"]))
+    governor = build_governor(args, pipeline, feed, tracker) if use_governor else None
+
+    ab_test = None
+    if args.ab_interval is not None:
+        # Governor would fight the swaps, it keeps its own precision
+        if governor is not None:
+            log.warning("A/B test of model variants is not run together with the governor")
+        else:
+            ab_test = ABTest(manager, [(precision, 1.0) for precision in [args.precision] + args.preload], \
+                args.ab_interval)
+
+    for record in release_frames(feed, pipeline.run(read_frames(feed))):
+        if "reused_from" in record:
+            # Frame results are reused from left the pipeline before this one
+            record["faces"] = record["reused_from"]["faces"]
+        # Pointer follows gaze of the first face
+        gaze_vector = record["faces"][0]["gaze_vector"]
+        gaze_time = time.perf_counter()
+        metrics.record("capture_to_gaze", gaze_time - record["time"])
+        if tracer is not None:
+            tracer.span("capture_to_gaze", record["index"], record["time"], gaze_time)
+        if governor is not None:
+            governor.frame_done(record["time"])
+        if ab_test is not None:
+            models = record["models"]
+            metrics.record(f"capture_to_gaze[{get_variant_name(models.precision, models.detector_scale)}]", \
+                gaze_time - record["time"])
+            ab_test.frame_done(models)
+
+        if recorder is not None:
+            record_results(recorder, record)
 
         if show_results:
-            # Draw face box
-            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 255, 255))
-
-            # Draw eyes box
-            coord_min_left_eye = (left_eye_coords[0] + xmin, left_eye_coords[1] + ymin)
-            coord_max_left_eye = (left_eye_coords[2] + xmin, left_eye_coords[3] + ymin)
-            coord_min_right_eye = (right_eye_coords[0] + xmin, right_eye_coords[1] + ymin)
-            coord_max_right_eye = (right_eye_coords[2] + xmin, right_eye_coords[3] + ymin)
-            cv2.rectangle(frame, coord_min_left_eye, coord_max_left_eye, (255, 0, 0))
-            cv2.rectangle(frame, coord_min_right_eye, coord_max_right_eye, (255, 0, 0))
-
-            # Draw gaze vector from each eye
-            magnitude = 120
-            pos_left_eye = (left_eye_pos[0] + xmin, left_eye_pos[1] + ymin)
-            pos_right_eye = (right_eye_pos[0] + xmin, right_eye_pos[1] + ymin)
-            coord_gaze_left_eye = (pos_left_eye[0] + int(gaze_vector[0] * magnitude), pos_left_eye[1] + int(gaze_vector[1] * magnitude) * -1)
-            coord_gaze_right_eye = (pos_right_eye[0] + int(gaze_vector[0] * magnitude), pos_right_eye[1] + int(gaze_vector[1] * magnitude) * -1)
-            cv2.arrowedLine(frame, pos_left_eye, coord_gaze_left_eye, (0, 0, 255), 2)
-            cv2.arrowedLine(frame, pos_right_eye, coord_gaze_right_eye, (0, 0, 255), 2)
-
-            log.info(f"Face box coords: ({xmin}, {ymin}), ({xmax}, {ymax})")
-            log.info(f"Left Eye coords: {pos_left_eye}, Right Eye coords: {pos_right_eye}")
-            log.info(f"Head pose angles: {head_pose_angles}")
-            log.info(f"Gaze Vector: {gaze_vector}\n")
-
-            cv2.imshow("Results", frame)
+            show_record(record)
             # Stop if Esc key is pressed
             if cv2.waitKey(1) == 27:
                 log.warning("Esc key pressed, inference interrupted!")
                 break
 
-        controller.move(gaze_vector[0], gaze_vector[1])
+        if session is not None:
+            # Pointer stays still until the user has looked at all calibration targets
+            if session.add_sample(gaze_vector):
+                calibration = session.fit()
+                calibration.save(args.calibration)
+                engine.set_calibration(calibration)
+                cv2.destroyWindow("Calibration")
+                session = None
+                log.info(f"Calibration saved to {args.calibration}")
+            else:
+                cv2.imshow("Calibration", session.draw())
+                cv2.waitKey(1)
+            continue
+
+        with metrics.timer("mouse_move"):
+            engine.update(gaze_vector, record["time"], (record["index"], record["time"]))
+
+    engine.stop()
+    controller.close()
+    log_pipeline_stats(pipeline)
+    log.info(f"Pointer stats: {engine.get_stats()}, output {controller.get_stats()}")
+    if tracer is not None:
+        tracer.close()
+        log.info(f"Trace written to {args.trace}")
+    if recorder is not None:
+        recorder.close()
+        log.info(f"{recorder.count} face results recorded to {args.record}")
+    if reporter is not None:
+        reporter.stop()
+    else:
+        log.info("Stage latency percentiles:")
+        LogSink().emit(metrics.snapshot())
+    log.info(f"Input feeder stats: {feed.get_stats()}")
+    if tracker is not None:
+        log.info(f"Face tracker stats: {tracker.get_stats()}")
+    if gate is not None:
+        log.info(f"Change gate stats: {gate.get_stats()}")
+    if governor is not None:
+        log.info(f"Governor stats: {governor.get_stats()}")
+    log.info(f"Model variant stats: {manager.get_stats()}")
+    if ab_test is not None:
+        log.info(f"A/B test stats: {ab_test.get_stats()}")
+    manager.close()
 
     feed.close()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,175 @@
+'''
+Per-stage latency instrumentation of the app.
+Timings of each stage are recorded into sliding windows with little overhead
+(one append per timing), and percentiles are only computed when a snapshot is
+taken. Snapshots are exported periodically through a pluggable sink: log line,
+JSON-lines file or a Prometheus text endpoint.
+'''
+import json
+import logging as log
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+class Metrics:
+    '''
+    Collects latencies (seconds) of named stages over a sliding window.
+    '''
+    def __init__(self, window=500):
+        self.window = window
+        self.latencies = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            latencies = self.latencies.get(stage)
+            if latencies is None:
+                latencies = self.latencies[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            latencies.append(seconds)
+            self.counts[stage] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        Context manager recording time spent in its block for stage.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        '''
+        Returns dict of stage to count and mean, p50, p95 & p99 latency (ms) over the window.
+        '''
+        with self.lock:
+            windows = {stage: list(latencies) for stage, latencies in self.latencies.items()}
+            counts = dict(self.counts)
+
+        snapshot = {}
+        for stage, latencies in windows.items():
+            if len(latencies) == 0:
+                continue
+            values = np.array(latencies) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            snapshot[stage] = {
+                "count": counts[stage],
+                "mean_ms": round(float(values.mean()), 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+            }
+        return snapshot
+
+class LogSink:
+    '''
+    Writes a log line per stage.
+    '''
+    def emit(self, snapshot):
+        for stage, stats in snapshot.items():
+            log.info(f"{stage}: count {stats['count']}, mean {stats['mean_ms']} ms, p50 {stats['p50_ms']} ms, " \
+                f"p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms")
+
+    def close(self):
+        pass
+
+class JsonLinesSink:
+    '''
+    Appends each snapshot as a JSON line with a timestamp to a file.
+    '''
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def emit(self, snapshot):
+        self.file.write(json.dumps({"time": time.time(), "stages": snapshot}) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class PrometheusSink:
+    '''
+    Serves the latest snapshot in Prometheus text format on http://host:port/metrics.
+    '''
+    def __init__(self, port=9100, host="127.0.0.1"):
+        self.text = ""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def emit(self, snapshot):
+        lines = [
+            "# HELP stage_latency_ms Latency of pipeline stage in milliseconds",
+            "# TYPE stage_latency_ms summary",
+        ]
+        for stage, stats in snapshot.items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'stage_latency_ms{{stage="{stage}",quantile="{quantile}"}} {stats[key]}')
+            lines.append(f'stage_latency_ms_count{{stage="{stage}"}} {stats["count"]}')
+        self.text = "\n".join(lines) + "\n"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def create_sink(spec):
+    '''
+    Creates sink from spec: 'log', 'jsonl:<path>' or 'prometheus:<port>'.
+    '''
+    kind, _, arg = spec.partition(":")
+    if kind == "log":
+        return LogSink()
+    if kind == "jsonl" and arg:
+        return JsonLinesSink(arg)
+    if kind == "prometheus":
+        return PrometheusSink(int(arg) if arg else 9100)
+    raise ValueError(f"Invalid metrics sink '{spec}'. Valid values are 'log', 'jsonl:<path>', 'prometheus:<port>'")
+
+class MetricsReporter:
+    '''
+    Emits snapshots of metrics to sink every interval seconds from a background thread.
+    '''
+    def __init__(self, metrics, sink, interval=10.0):
+        self.metrics = metrics
+        self.sink = sink
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        # Final snapshot covers the end of the run
+        self.sink.emit(self.metrics.snapshot())
+        self.sink.close()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sink.emit(self.metrics.snapshot())
@@ -0,0 +1,249 @@
+'''
+Manager of loaded variants of the four models, so precision can be changed
+while the app runs, e.g. to compare accuracy against throughput on live input.
+A variant is a set of the four models of one precision, with face detection
+at one input scale. Variants are preloaded or loaded in the background, and
+swapping the active variant is a single assignment: each frame takes the
+active variant once when it enters the pipeline and runs all its models on
+it, so frames in flight finish on the variant they started with and none is
+dropped or mixed.
+
+    manager = ModelManager("models/intel", "CPU", num_requests=2)
+    manager.load("FP16-INT8")
+    manager.swap("FP16-INT8")
+    manager.load_async("FP32")                  # keeps running on FP16-INT8
+    manager.swap("FP32", wait=False)            # swaps once FP32 is loaded
+'''
+import logging as log
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from face_detection import Face_Detection
+from facial_landmarks_detection import Facial_Landmarks_Detection
+from head_pose_estimation import Head_Pose_Estimation
+from gaze_estimation import Gaze_Estimation
+from model_registry import get_default_registry
+from infer_request_pool import chain
+
+### IR names of the models
+model_names = {
+    "face_detection": "face-detection-adas-0001",
+    "facial_landmarks_detection": "landmarks-regression-retail-0009",
+    "head_pose_estimation": "head-pose-estimation-adas-0001",
+    "gaze_estimation": "gaze-estimation-adas-0002",
+}
+
+### Precisions of models in the model zoo, best accuracy first
+precisions = ["FP32", "FP16", "FP16-INT8"]
+
+ModelSet = namedtuple("ModelSet", ["face_detection", "facial_landmarks_detection", "head_pose_estimation", \
+    "gaze_estimation", "precision", "detector_scale"])
+
+def get_variant_name(precision, detector_scale=1.0):
+    return precision if detector_scale == 1.0 else f"{precision}/{detector_scale:g}"
+
+class ModelManager:
+    '''
+    model_dir: Directory with a directory per model, holding a directory per precision.
+    device: Device all models are loaded on.
+    num_requests: Infer requests of each model.
+    batch_size: Faces per inference of landmarks, head pose and gaze models.
+    registry: ModelRegistry models are loaded with. Defaults to the default registry.
+    detector_options: Dict of keyword arguments of Face_Detection, e.g. top_k.
+    '''
+    def __init__(self, model_dir="models/intel", device="CPU", num_requests=1, batch_size=1, registry=None, \
+        detector_options=None):
+        self.model_dir = model_dir
+        self.device = device
+        self.num_requests = num_requests
+        self.batch_size = batch_size
+        self.registry = registry if registry is not None else get_default_registry()
+        self.detector_options = dict(detector_options) if detector_options is not None else {}
+
+        self.variants = {}
+        self.loading = {}
+        self.active = None
+        self.active_since = None
+        # Seconds each variant was active, and number of swaps
+        self.active_time = {}
+        self.swap_count = 0
+        self.lock = threading.RLock()
+        # Background loads run one at a time, next to inference
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def get_model_path(self, model, precision):
+        name = model_names[model]
+        return os.path.join(self.model_dir, name, precision, name + ".xml")
+
+    def get_available_precisions(self):
+        '''
+        Returns precisions downloaded for all models, best accuracy first.
+        '''
+        return [precision for precision in precisions \
+            if all(os.path.exists(self.get_model_path(model, precision)) for model in model_names)]
+
+    def load(self, precision, detector_scale=1.0):
+        '''
+        Loads variant if not loaded yet, waiting for it. Returns its ModelSet.
+        Models of a precision are shared by variants with different detector scales.
+        '''
+        key = (precision, detector_scale)
+        with self.lock:
+            variant = self.variants.get(key)
+        if variant is not None:
+            return variant
+
+        with self.lock:
+            same_precision = next((variant for (p, _), variant in self.variants.items() if p == precision), None)
+        face_detection = Face_Detection(self.get_model_path("face_detection", precision), self.device, \
+            input_scale=detector_scale, **self.detector_options)
+        if same_precision is not None:
+            models = [face_detection]
+            others = list(same_precision[1:4])
+        else:
+            others = [
+                Facial_Landmarks_Detection(self.get_model_path("facial_landmarks_detection", precision), \
+                    self.device, self.batch_size),
+                Head_Pose_Estimation(self.get_model_path("head_pose_estimation", precision), \
+                    self.device, self.batch_size),
+                Gaze_Estimation(self.get_model_path("gaze_estimation", precision), self.device, self.batch_size),
+            ]
+            models = [face_detection] + others
+
+        start = time.perf_counter()
+        self.registry.load_models(models, self.num_requests)
+        log.info(f"Model variant {get_variant_name(precision, detector_scale)} loaded in " \
+            f"{int(round((time.perf_counter() - start) * 1000))} ms")
+
+        variant = ModelSet(face_detection, *others, precision, detector_scale)
+        with self.lock:
+            # A concurrent load of the same variant may have finished first
+            return self.variants.setdefault(key, variant)
+
+    def load_async(self, precision, detector_scale=1.0):
+        '''
+        Loads variant in a background thread. Returns future of its ModelSet.
+        '''
+        key = (precision, detector_scale)
+        with self.lock:
+            future = self.loading.get(key)
+            if future is None:
+                future = self.loading[key] = self.executor.submit(self.load, precision, detector_scale)
+                future.add_done_callback(lambda future: self._loaded(key, future))
+        return future
+
+    def swap(self, precision, detector_scale=1.0, wait=True):
+        '''
+        Makes variant active for frames entering the pipeline from now on.
+        Variant is loaded first if needed: waiting for it if wait, else in the
+        background, and swapped in once loaded. Returns the ModelSet if wait,
+        else future of it, resolved once it is active.
+        '''
+        if wait:
+            variant = self.load(precision, detector_scale)
+            self._activate(variant)
+            return variant
+        future = chain(self.load_async(precision, detector_scale), self._activate_loaded)
+        future.add_done_callback(self._swap_done)
+        return future
+
+    def get_variant_names(self):
+        with self.lock:
+            return [get_variant_name(*key) for key in self.variants]
+
+    def get_stats(self):
+        '''
+        Returns active variant, number of swaps and seconds each variant was active.
+        '''
+        with self.lock:
+            active_time = dict(self.active_time)
+            if self.active is not None:
+                name = get_variant_name(self.active.precision, self.active.detector_scale)
+                active_time[name] = active_time.get(name, 0.0) + time.perf_counter() - self.active_since
+            return {
+                "active": get_variant_name(self.active.precision, self.active.detector_scale) \
+                    if self.active is not None else None,
+                "swaps": self.swap_count,
+                "active_seconds": {name: round(seconds, 2) for name, seconds in active_time.items()},
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _loaded(self, key, future):
+        # Failed loads may be retried
+        if future.exception() is not None:
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def _activate_loaded(self, variant):
+        self._activate(variant)
+        return variant
+
+    def _swap_done(self, future):
+        if future.exception() is not None:
+            log.error(f"Model variant failed to load, not swapped: {future.exception()}")
+
+    def _activate(self, variant):
+        with self.lock:
+            if variant is self.active:
+                return
+            now = time.perf_counter()
+            if self.active is not None:
+                name = get_variant_name(self.active.precision, self.active.detector_scale)
+                self.active_time[name] = self.active_time.get(name, 0.0) + now - self.active_since
+                self.swap_count += 1
+                log.info(f"Model variant swapped from {name} to {get_variant_name(variant.precision, variant.detector_scale)}")
+            self.active = variant
+            self.active_since = now
+
+class ABTest:
+    '''
+    Cycles the active variant of a ModelManager through variants every interval
+    seconds, so they run on the same live input, and counts frames finished on
+    each for its frame rate. Variants not loaded yet are loaded in the background
+    and skipped until they are.
+
+    manager: ModelManager whose active variant is cycled.
+    variants: List of (precision, detector_scale) to cycle through.
+    interval: Seconds each variant stays active.
+    '''
+    def __init__(self, manager, variants, interval=10.0):
+        self.manager = manager
+        self.variants = list(variants)
+        self.interval = interval
+        self.index = 0
+        self.last_swap = time.perf_counter()
+        self.frames = {}
+        for precision, detector_scale in self.variants:
+            manager.load_async(precision, detector_scale)
+
+    def frame_done(self, variant):
+        '''
+        Counts frame finished on variant (ModelSet the frame ran on) and swaps
+        variant once the interval is over. Called between frames.
+        '''
+        name = get_variant_name(variant.precision, variant.detector_scale)
+        self.frames[name] = self.frames.get(name, 0) + 1
+
+        now = time.perf_counter()
+        if now - self.last_swap < self.interval:
+            return
+        self.last_swap = now
+        for _ in range(len(self.variants)):
+            self.index = (self.index + 1) % len(self.variants)
+            precision, detector_scale = self.variants[self.index]
+            future = self.manager.load_async(precision, detector_scale)
+            if future.done() and future.exception() is None:
+                self.manager.swap(precision, detector_scale)
+                return
+
+    def get_stats(self):
+        '''
+        Returns frames and frames per second of each variant while it was active.
+        '''
+        active_seconds = self.manager.get_stats()["active_seconds"]
+        return {name: {"frames": frames, "fps": round(frames / active_seconds[name], 1) \
+            if active_seconds.get(name, 0) > 0 else None} for name, frames in self.frames.items()}
@@ -0,0 +1,178 @@
+'''
+Registry for loading models with a single shared inference backend.
+Networks loaded with OpenVINO are cached on disk so that warm restarts skip compilation.
+Devices which support exporting compiled networks (e.g. MYRIAD) get the
+exported blob cached, others use the model cache of the plugin (CACHE_DIR).
+Cache entries are keyed by model path, precision, device, batch size and input shape,
+and by size and modification time of the IR files, so changed IR files invalidate them.
+'''
+import glob
+import hashlib
+import logging as log
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backends import get_default_backend
+
+class ModelRegistry:
+    '''
+    Shares one backend among all models and caches their loaded networks.
+
+    cache_dir: Directory for cached networks. If None, or if the backend can not
+               cache networks, networks are compiled on every load.
+    config: Optional dict of device name to plugin config (e.g. CPU_THREADS_NUM)
+            set before first network is loaded on that device.
+    backend: Backend from backends.py which loads the networks. Models loaded
+             with the registry must be created with the same kind of backend.
+             Defaults to the default backend.
+    '''
+    def __init__(self, cache_dir=None, config=None, backend=None):
+        self.backend = backend if backend is not None else get_default_backend()
+        self.cache_dir = cache_dir
+        self.config = config if config is not None else {}
+        self.supported_layers = {}
+        self.load_times = {}
+        self.lock = threading.Lock()
+        self.configured_devices = set()
+        # Whether the plugin of each device accepted CACHE_DIR
+        self.plugin_cache = {}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def query_network(self, network, model_xml, device):
+        '''
+        Returns layers of network supported by the device, queried once per model.
+        '''
+        key = (model_xml, device)
+        with self.lock:
+            if key not in self.supported_layers:
+                self.supported_layers[key] = self.backend.query_network(network, device)
+            return self.supported_layers[key]
+
+    def load_network(self, network, model_xml, device, num_requests=1):
+        '''
+        Returns executable network loaded from cache if present, else compiles
+        the network and stores it in cache.
+        '''
+        self._configure(device)
+        start = time.perf_counter()
+        if self.cache_dir is None or not self.backend.supports_cache:
+            exec_network = self.backend.load_network(network, device, num_requests)
+            warm = False
+        elif self.supports_export(device):
+            exec_network, warm = self._load_exported(network, model_xml, device, num_requests)
+        elif self.plugin_cache.get(device, False):
+            exec_network, warm = self._load_plugin_cached(network, model_xml, device, num_requests)
+        else:
+            # Plugin has no model cache, every load compiles
+            exec_network = self.backend.load_network(network, device, num_requests)
+            warm = False
+
+        with self.lock:
+            self.load_times[model_xml] = (time.perf_counter() - start, warm)
+        return exec_network
+
+    def load_models(self, models, num_requests=1):
+        '''
+        Loads given model objects in parallel.
+        Returns list of (load time in seconds, warm) tuples in order of models.
+        '''
+        with ThreadPoolExecutor(max_workers=len(models)) as executor:
+            futures = [executor.submit(model.load_model, num_requests, self) for model in models]
+            for future in futures:
+                future.result()
+        return [self.load_times[model.model_xml] for model in models]
+
+    def supports_export(self, device):
+        return self.backend.supports_export(device)
+
+    def get_cache_path(self, model_xml, device, batch_size=1, input_shape=None):
+        '''
+        Returns path of cache entry (without extension) for model on device.
+        input_shape: Shape of the first input, for networks reshaped from the IR.
+        '''
+        model_bin = os.path.splitext(model_xml)[0] + ".bin"
+        model_name = os.path.splitext(os.path.basename(model_xml))[0]
+        precision = os.path.basename(os.path.dirname(os.path.abspath(model_xml)))
+
+        key = [os.path.abspath(model_xml), precision, device, str(batch_size)]
+        for path in (model_xml, model_bin):
+            stat = os.stat(path)
+            key += [str(stat.st_size), str(stat.st_mtime_ns)]
+        digest = hashlib.sha1("|".join(key).encode()).hexdigest()[:16]
+
+        name = f"{model_name}-{precision}-{device}-b{batch_size}"
+        if input_shape is not None:
+            name += "-" + "x".join(str(dim) for dim in input_shape[1:])
+        return os.path.join(self.cache_dir, f"{name}-{digest}")
+
+    def clear_cache(self):
+        if self.cache_dir is None:
+            return
+        for path in glob.glob(os.path.join(self.cache_dir, "*")):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def _load_exported(self, network, model_xml, device, num_requests):
+        blob_path = self.get_cache_path(model_xml, device, network.batch_size, self._input_shape(network)) + ".blob"
+        if os.path.exists(blob_path):
+            try:
+                return self.backend.import_network(blob_path, device, num_requests), True
+            except Exception:
+                # Corrupt or incompatible blob, compile again
+                os.remove(blob_path)
+
+        exec_network = self.backend.load_network(network, device, num_requests)
+        self._remove_stale(blob_path)
+        self.backend.export_network(exec_network, blob_path)
+        return exec_network, False
+
+    def _load_plugin_cached(self, network, model_xml, device, num_requests):
+        # Plugin keeps its own cache of compiled networks in CACHE_DIR, a stamp
+        # file only records whether this version of the IR was loaded before
+        stamp_path = self.get_cache_path(model_xml, device, network.batch_size, self._input_shape(network)) + ".stamp"
+        warm = os.path.exists(stamp_path)
+        exec_network = self.backend.load_network(network, device, num_requests)
+        if not warm:
+            self._remove_stale(stamp_path)
+            open(stamp_path, "w").close()
+        return exec_network, warm
+
+    def _input_shape(self, network):
+        return network.inputs[next(iter(network.inputs))].shape
+
+    def _configure(self, device):
+        with self.lock:
+            if device in self.configured_devices:
+                return
+            self.configured_devices.add(device)
+            if device in self.config:
+                self.backend.set_config(self.config[device], device)
+            if self.cache_dir is not None and self.backend.supports_cache and not self.supports_export(device):
+                try:
+                    self.backend.set_config({"CACHE_DIR": os.path.abspath(self.cache_dir)}, device)
+                    self.plugin_cache[device] = True
+                except Exception as e:
+                    # Older plugins have no model cache
+                    self.plugin_cache[device] = False
+                    log.warning(f"Plugin of {device} has no model cache ({e}), networks are compiled on every load")
+
+    def _remove_stale(self, cache_path):
+        # Remove entries of older versions of the same model, precision, device, batch size and input shape
+        prefix = os.path.basename(cache_path).rsplit("-", 1)[0]
+        for path in glob.glob(os.path.join(self.cache_dir, prefix + "-*")):
+            if path != cache_path:
+                os.remove(path)
+
+### Registry shared by models loaded without an explicit registry
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+def get_default_registry():
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry()
+        return _default_registry
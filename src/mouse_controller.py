@@ -1,28 +1,56 @@
 '''
 This is a sample class that you can use to control the mouse pointer.
-It uses the pyautogui library. You can set the precision for mouse movement
-(how much the mouse moves) and the speed (how fast it moves) by changing 
-precision_dict and speed_dict.
+It moves the pointer through an output of pointer_output.py, pyautogui by
+default. You can set the precision for mouse movement (how much the mouse
+moves) by changing precision_dict.
 Calling the move function with the x and y output of the gaze estimation model
 will move the pointer.
+The move_to function moves the pointer to absolute screen coordinates, for
+callers driving the pointer in small steps such as pointer.PointerEngine.
+Moves are applied by a background thread and never block the caller, moves
+not yet applied when a new one arrives are dropped.
 '''
-import pyautogui
+from pointer_output import AsyncPointerOutput, PyAutoGUIOutput
 
 class MouseController:
-    def __init__(self, precision, speed):
+    '''
+    speed: Kept for compatibility, moves are no longer tweened. Smooth movement
+           is done by pointer.PointerEngine.
+    output: Pointer output, e.g. from pointer_output.create_output. Defaults to pyautogui.
+    on_move: Function called with (tag, start, end) of each move once applied,
+             e.g. tracing.PointerLatency.
+    '''
+    def __init__(self, precision, speed, output=None, on_move=None):
         precision_dict={'high':100, 'low':1000, 'medium':500}
         speed_dict={'fast':1, 'slow':10, 'medium':5}
-        pyautogui.FAILSAFE=False
 
         self.precision=precision_dict[precision]
         self.speed=speed_dict[speed]
+        self.output=AsyncPointerOutput(output if output is not None else PyAutoGUIOutput(), on_move)
+        self.screen_size=self.output.get_screen_size()
+        self.position=(self.screen_size[0]//2, self.screen_size[1]//2)
 
     def get_screen_size(self):
-        return pyautogui.size()
+        return self.screen_size
 
     def move_to_center(self):
-        size=self.get_screen_size()
-        pyautogui.moveTo(int(size[0]/2), int(size[1]/2))
+        self.move_to(self.screen_size[0]//2, self.screen_size[1]//2)
 
-    def move(self, x, y):
-        pyautogui.moveRel(x*self.precision, -1*y*self.precision, duration=self.speed)
+    def move_to(self, x, y, tag=None):
+        '''
+        tag: (seq, capture_time) of the frame the move comes from, for latency measurement.
+        '''
+        x=min(max(int(x), 0), self.screen_size[0]-1)
+        y=min(max(int(y), 0), self.screen_size[1]-1)
+        self.position=(x, y)
+        self.output.move_to(x, y, tag)
+
+    def move(self, x, y, tag=None):
+        self.move_to(self.position[0]+x*self.precision, self.position[1]-y*self.precision, tag)
+
+    def get_stats(self):
+        return self.output.get_stats()
+
+    def close(self):
+        ### Apply the last move and release output
+        self.output.close()
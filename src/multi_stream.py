@@ -0,0 +1,167 @@
+'''
+Serving of many camera or video streams by one process, with one loaded copy
+of each model shared by all of them (see stream_scheduler.py).
+Per-face results of all streams are saved with ResultRecorder, the `video`
+field holding the index of the stream in `streams` of the metadata. Frames
+per second and queue lag of each stream are logged while running.
+'''
+import logging as log
+import mimetypes
+import os
+import time
+from argparse import ArgumentParser
+
+from input_feeder import InputFeeder
+from model_manager import ModelManager
+from model_registry import ModelRegistry
+from backends import create_backend, set_default_backend
+from metrics import Metrics, MetricsReporter, create_sink
+from result_store import ResultRecorder
+from stream_scheduler import StreamScheduler
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument("-i", "--input", required=True, type=str, nargs="+", \
+        help="Streams: paths of video or image files, or 'cam[:<index>]' for webcams")
+
+    parser.add_argument("-o", "--output", required=False, type=str, default=None, \
+        help="Path of file results are saved to, as .npz or as raw binary for any other extension")
+
+    parser.add_argument("-d", "--device", required=False, type=str, default="CPU", \
+        help="Device to run inference on (default CPU)")
+
+    parser.add_argument("-p", "--precision", required=False, type=str, default="FP16-INT8", \
+        help="Precision of models (default FP16-INT8)")
+
+    parser.add_argument("-be", "--backend", required=False, type=str, default="openvino", \
+        help="Inference backend: 'openvino', 'onnxruntime' or 'synthetic[:<latency ms>]' (default openvino)")
+
+    parser.add_argument("-b", "--batch_size", required=False, type=int, default=None, \
+        help="Number of faces per inference of landmarks, head pose and gaze models (default number of streams)")
+
+    parser.add_argument("-nr", "--num_requests", required=False, type=int, default=2, \
+        help="Number of infer requests of each model kept in flight (default 2)")
+
+    parser.add_argument("-dp", "--pipeline_depth", required=False, type=int, default=2, \
+        help="Max groups of frames queued in front of each model stage (default 2)")
+
+    parser.add_argument("-g", "--max_group", required=False, type=int, default=None, \
+        help="Max frames run together, one of each stream (default number of streams)")
+
+    parser.add_argument("-fp", "--frame_policy", required=False, type=str, default=None, \
+        help="Frame policy of every stream: 'all', 'nth' or 'latest' (default 'latest' for cam, 'nth' otherwise)")
+
+    parser.add_argument("-n", "--frame_step", required=False, type=int, default=1, \
+        help="Feed every n-th frame of each stream with 'nth' frame policy (default 1)")
+
+    parser.add_argument("-mf", "--multi_face", required=False, action="store_true", \
+        help="Process all detected faces instead of only the first one")
+
+    parser.add_argument("-es", "--eye_scale", required=False, type=float, default=0.7, \
+        help="Width of eye crops relative to the distance between the eyes (default 0.7)")
+
+    parser.add_argument("-c", "--cache_dir", required=False, type=str, default="models/cache", \
+        help="Directory to cache loaded networks in (default models/cache)")
+
+    parser.add_argument("-ms", "--metrics_sink", required=False, type=str, default=None, \
+        help="Export stage and per-stream latency percentiles to 'log', 'jsonl:<path>' or 'prometheus:<port>'")
+
+    parser.add_argument("-mi", "--metrics_interval", required=False, type=float, default=10.0, \
+        help="Seconds between exports of latency percentiles (default 10)")
+
+    parser.add_argument("-si", "--stats_interval", required=False, type=float, default=10.0, \
+        help="Seconds between logs of frames per second and queue lag of each stream (default 10)")
+
+    return parser
+
+### Feeder of a stream: a webcam for 'cam[:<index>]', else an image or video file
+def create_feeder(source, frame_policy=None, frame_step=1):
+    kind, _, index = source.partition(":")
+    if kind == "cam":
+        feeder = InputFeeder("cam", frame_policy=frame_policy, camera=int(index or 0))
+    else:
+        if not os.path.isfile(source):
+            raise FileNotFoundError(f"Input file {source} not found")
+        mime_type = mimetypes.guess_type(source)[0]
+        input_type = "image" if mime_type is not None and mime_type.startswith("image") else "video"
+        feeder = InputFeeder(input_type, source, frame_policy, frame_step)
+    feeder.load_data()
+    return feeder
+
+### Unique names of streams for logs and metrics
+def get_stream_names(sources):
+    names = [os.path.basename(source) for source in sources]
+    return [name if names.count(name) == 1 else f"{name}#{i}" for i, name in enumerate(names)]
+
+def log_stream_stats(scheduler):
+    for stats in scheduler.get_stats():
+        log.info(f"Stream {stats['stream']}: {stats['frames']} frames, {stats['fps']} frames/s, " \
+            f"lag p50 {stats['lag_p50_ms']} ms, p95 {stats['lag_p95_ms']} ms, {stats['no_face']} without face, " \
+            f"{stats['feeder']['dropped']} dropped")
+
+def main():
+    args = build_argparser().parse_args()
+    log.basicConfig(level = log.INFO, format = '%(levelname)s: %(message)s')
+
+    sources = args.input
+    names = get_stream_names(sources)
+    batch_size = args.batch_size if args.batch_size is not None else len(sources)
+
+    # One copy of each model serves all streams
+    set_default_backend(create_backend(args.backend))
+    log.info("Loading models...")
+    manager = ModelManager("models/intel", args.device, args.num_requests, batch_size, \
+        ModelRegistry(args.cache_dir), {"top_k": None if args.multi_face else 1})
+    manager.swap(args.precision)
+
+    metrics = Metrics()
+    scheduler = StreamScheduler(manager, args.num_requests, args.pipeline_depth, args.max_group, \
+        args.multi_face, args.eye_scale, metrics)
+    feeders = []
+    for name, source in zip(names, sources):
+        feeder = create_feeder(source, args.frame_policy, args.frame_step)
+        scheduler.add_stream(name, feeder)
+        feeders.append(feeder)
+    log.info(f"Serving {len(sources)} streams, batch size {batch_size}")
+
+    reporter = None
+    if args.metrics_sink is not None:
+        reporter = MetricsReporter(metrics, create_sink(args.metrics_sink), args.metrics_interval).start()
+
+    recorder = None
+    if args.output is not None:
+        recorder = ResultRecorder(args.output, metadata={"streams": sources, "eye_scale": args.eye_scale, \
+            "precision": args.precision})
+    stream_index = {name: i for i, name in enumerate(names)}
+
+    start = time.perf_counter()
+    last_log = start
+    for name, record in scheduler.run():
+        if recorder is not None:
+            for i, face in enumerate(record["faces"]):
+                recorder.append(record["index"], i, face["face_box"], face["landmarks"], face["head_pose_angles"], \
+                    face["gaze_vector"], record["time"], stream_index[name], args.precision)
+        if time.perf_counter() - last_log >= args.stats_interval:
+            last_log = time.perf_counter()
+            log_stream_stats(scheduler)
+
+    elapsed = time.perf_counter() - start
+    log_stream_stats(scheduler)
+    log.info("Pipeline stage stats:")
+    for stats in scheduler.get_pipeline_stats():
+        log.info(f"{stats['stage']}: {stats['count']} groups, latency {stats['latency_ms']} ms, " \
+            f"throughput {stats['throughput_fps']} groups/s, utilization {stats['utilization']}")
+    total = sum(stats["frames"] for stats in scheduler.get_stats())
+    log.info(f"Processed {total} frames of {len(sources)} streams in {round(elapsed, 1)} s " \
+        f"({round(total / elapsed, 1)} frames/s)")
+    if recorder is not None:
+        recorder.close()
+        log.info(f"{recorder.count} face results recorded to {args.output}")
+    if reporter is not None:
+        reporter.stop()
+    for feeder in feeders:
+        feeder.close()
+    manager.close()
+
+if __name__ == "__main__":
+    main()
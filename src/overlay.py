@@ -0,0 +1,76 @@
+'''
+Drawing of model results over frames, used by main.py to show live results
+and by OverlayRenderer to show results replayed from a ResultReader.
+'''
+import cv2
+import numpy as np
+from eye_roi import get_eye_boxes
+
+def draw_face(frame, face_box, eye_pos, eye_coords, gaze_vector):
+    '''
+    Draws face box, eye boxes and gaze vector from each eye.
+
+    face_box: (xmin, ymin, xmax, ymax) of face in pixels of frame.
+    eye_pos: Left and right eye centre in pixels of face.
+    eye_coords: Left and right eye box in pixels of face.
+    '''
+    xmin, ymin, xmax, ymax = face_box
+
+    # Draw face box
+    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (255, 255, 255))
+
+    # Draw eyes box
+    for eye_box in eye_coords:
+        cv2.rectangle(frame, (eye_box[0] + xmin, eye_box[1] + ymin), (eye_box[2] + xmin, eye_box[3] + ymin), (255, 0, 0))
+
+    # Draw gaze vector from each eye
+    magnitude = 120
+    for eye in eye_pos:
+        pos_eye = (eye[0] + xmin, eye[1] + ymin)
+        coord_gaze_eye = (pos_eye[0] + int(gaze_vector[0] * magnitude), pos_eye[1] + int(gaze_vector[1] * magnitude) * -1)
+        cv2.arrowedLine(frame, pos_eye, coord_gaze_eye, (0, 0, 255), 2)
+
+class OverlayRenderer:
+    '''
+    Renderer for ResultReader.replay, drawing stored results over frames of
+    the recorded video in a window.
+
+    video_path: Video the results were recorded from.
+    eye_scale: Eye crop scale used for the recording, to draw the same eye boxes.
+    '''
+    def __init__(self, video_path, eye_scale=0.7, window="Replay"):
+        self.cap = cv2.VideoCapture(video_path)
+        self.eye_scale = eye_scale
+        self.window = window
+        self.next_frame = 0
+
+    def __call__(self, video, frame_index, rows):
+        frame = self._read(frame_index)
+        if frame is None:
+            return False
+        height, width, _ = frame.shape
+        for face_box, landmarks, gaze_vector in zip(rows["face_box"], rows["landmarks"], rows["gaze_vector"]):
+            box = (np.asarray(face_box) * (width, height, width, height)).astype(int)
+            face_shape = (box[3] - box[1], box[2] - box[0])
+            eye_boxes, eye_centers = get_eye_boxes(face_shape, landmarks, iod_scale=self.eye_scale)
+            draw_face(frame, tuple(box.tolist()), eye_centers.tolist(), eye_boxes.tolist(), gaze_vector)
+        cv2.imshow(self.window, frame)
+        # Stop if Esc key is pressed
+        return cv2.waitKey(1) != 27
+
+    def close(self):
+        self.cap.release()
+        cv2.destroyWindow(self.window)
+
+    def _read(self, frame_index):
+        # Frames without faces are skipped by grabbing them, seek only when going back or far ahead
+        if frame_index < self.next_frame or frame_index - self.next_frame > 100:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            self.next_frame = frame_index
+        while self.next_frame < frame_index:
+            if not self.cap.grab():
+                return None
+            self.next_frame += 1
+        flag, frame = self.cap.read()
+        self.next_frame += 1
+        return frame if flag else None
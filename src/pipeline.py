@@ -0,0 +1,269 @@
+'''
+Pipelined executor for running the chain of models as concurrent stages.
+Each stage runs in its own thread and frames move from one stage to the next
+through bounded queues, so frame N+1 can be in face detection while frame N is
+still in gaze estimation. Throughput is then limited by the slowest stage
+instead of the sum of all stages. Order of frames is preserved.
+'''
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
+
+# Marks the end of the stream in the stage queues
+_END = object()
+
+class StageStats:
+    '''
+    Latency and throughput statistics of a single pipeline stage.
+    Latencies are also recorded to metrics (see metrics.py) if given.
+    '''
+    def __init__(self, name, window=100, metrics=None):
+        self.name = name
+        self.metrics = metrics
+        self.count = 0
+        self.busy_time = 0.0
+        self.first_start = None
+        self.last_end = None
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, start, end):
+        with self.lock:
+            if self.first_start is None:
+                self.first_start = start
+            self.last_end = end
+            self.count += 1
+            self.busy_time += end - start
+            self.latencies.append(end - start)
+        if self.metrics is not None:
+            self.metrics.record(self.name, end - start)
+
+    def get_latency(self):
+        '''
+        Returns mean latency (ms) of the stage over the recent window.
+        '''
+        with self.lock:
+            if len(self.latencies) == 0:
+                return 0.0
+            return sum(self.latencies) / len(self.latencies) * 1000
+
+    def get_throughput(self):
+        '''
+        Returns number of items processed per second of wall time by the stage.
+        '''
+        with self.lock:
+            if self.count == 0 or self.last_end == self.first_start:
+                return 0.0
+            return self.count / (self.last_end - self.first_start)
+
+    def get_utilization(self):
+        '''
+        Returns fraction of wall time the stage spent processing items.
+        A stage with utilization close to 1 is the bottleneck of the pipeline.
+        Can exceed 1 when stage keeps several items in flight.
+        '''
+        with self.lock:
+            if self.count == 0 or self.last_end == self.first_start:
+                return 0.0
+            return self.busy_time / (self.last_end - self.first_start)
+
+    def summary(self):
+        return {
+            "stage": self.name,
+            "count": self.count,
+            "latency_ms": round(self.get_latency(), 2),
+            "throughput_fps": round(self.get_throughput(), 2),
+            "utilization": round(self.get_utilization(), 2),
+        }
+
+class Pipeline:
+    '''
+    Runs items through a list of stages concurrently, in order.
+
+    stages: list of (name, function) or (name, function, max_in_flight) tuples.
+            Each function takes the item produced by previous stage and returns
+            item for the next stage, or None to drop the item (e.g. when no face
+            is found in frame). Function can also return a Future of the item,
+            then up to max_in_flight (default 1) items are kept in flight by
+            the stage and their results are passed on in order.
+    depth: Max number of items waiting in queue in front of each stage.
+           Depth of 0 runs all stages one after another in the calling thread.
+    metrics: Optional Metrics to record latency of each stage to.
+    tracer: Optional tracing.Tracer to add a span of each stage of each item to.
+    trace_id: Function returning id of an item in the trace, e.g. its sequence
+              number. Spans of all stages of an item share a track.
+    on_drop: Optional function called with each item a stage dropped or failed
+             on (the item the stage was given), e.g. to free a frame buffer
+             held by it, as such items never reach the consumer.
+    '''
+    def __init__(self, stages, depth=2, metrics=None, tracer=None, trace_id=id, on_drop=None):
+        self.stages = stages
+        self.on_drop = on_drop
+        self.depth = depth
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.stats = [StageStats(stage[0], metrics=metrics) for stage in stages]
+        self.max_in_flight = {stage[0]: stage[2] if len(stage) > 2 else 1 for stage in stages}
+        self._stop = threading.Event()
+        self._error = None
+
+    def get_stats(self):
+        return [stats.summary() for stats in self.stats]
+
+    def set_max_in_flight(self, name, max_in_flight):
+        '''
+        Changes max items kept in flight by stage of name while running,
+        e.g. up to the number of infer requests of its model.
+        '''
+        self.max_in_flight[name] = max_in_flight
+
+    def run(self, items):
+        '''
+        Generator yielding results of last stage for each item in order.
+        Stops at the end of items or when the consumer stops iterating.
+        '''
+        if self.depth == 0:
+            yield from self._run_sequential(items)
+        else:
+            yield from self._run_pipelined(items)
+
+    def _run_sequential(self, items):
+        for item in items:
+            for stage, stats in zip(self.stages, self.stats):
+                start = time.perf_counter()
+                try:
+                    result = stage[1](item)
+                    if isinstance(result, Future):
+                        result = result.result()
+                except Exception:
+                    self._drop(item)
+                    raise
+                self._record(stats, item, start, time.perf_counter())
+                if result is None:
+                    self._drop(item)
+                    break
+                item = result
+            else:
+                yield item
+
+    def _run_pipelined(self, items):
+        self._stop.clear()
+        self._error = None
+        queues = [Queue(maxsize=self.depth) for _ in range(len(self.stages) + 1)]
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True, name="pipeline feed")]
+        for i, stage in enumerate(self.stages):
+            thread = threading.Thread(target=self._work, daemon=True, name=f"stage {stage[0]}", \
+                args=(stage[1], self.stats[i], queues[i], queues[i + 1]))
+            threads.append(thread)
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    break
+                yield item
+        finally:
+            # Consumer might have stopped early, let all stage threads exit
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _feed(self, items, out_queue):
+        try:
+            for item in items:
+                if not self._put(out_queue, item):
+                    return
+        except Exception as e:
+            self._error = e
+        self._put(out_queue, _END)
+
+    def _work(self, function, stats, in_queue, out_queue):
+        # Futures returned by function, oldest first, with their item and start time
+        in_flight = deque()
+        while True:
+            # Pass on oldest result when window is full or no new item is waiting
+            if len(in_flight) > 0 and (len(in_flight) >= self.max_in_flight[stats.name] or in_queue.empty()):
+                item, start, future = in_flight.popleft()
+                if not self._pass_on(future.result, item, start, stats, out_queue):
+                    return
+                continue
+
+            item = self._get(in_queue)
+            if item is _END:
+                break
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as e:
+                self._drop(item)
+                self._fail(e)
+                return
+            if not isinstance(result, Future) and len(in_flight) > 0:
+                # Results still in flight are passed on first, to keep items in order
+                done = Future()
+                done.set_result(result)
+                result = done
+            if isinstance(result, Future):
+                in_flight.append((item, start, result))
+            elif not self._pass_on(lambda: result, item, start, stats, out_queue):
+                return
+
+        while len(in_flight) > 0:
+            item, start, future = in_flight.popleft()
+            if not self._pass_on(future.result, item, start, stats, out_queue):
+                return
+        self._put(out_queue, _END)
+
+    def _pass_on(self, get_result, item, start, stats, out_queue):
+        try:
+            result = get_result()
+        except Exception as e:
+            self._drop(item)
+            self._fail(e)
+            return False
+        self._record(stats, item, start, time.perf_counter())
+        if result is None:
+            self._drop(item)
+            return True
+        return self._put(out_queue, result)
+
+    def _drop(self, item):
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def _record(self, stats, item, start, end):
+        stats.record(start, end)
+        if self.tracer is not None:
+            self.tracer.span(stats.name, self.trace_id(item), start, end)
+
+    def _fail(self, error):
+        self._error = error
+        self._stop.set()
+
+    def _put(self, queue, item):
+        # Blocking put which gives up once pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _get(self, queue):
+        # Blocking get which returns end of stream once pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                pass
+        return _END
@@ -0,0 +1,344 @@
+'''
+Pointer control engine.
+Gaze vectors are mapped to absolute screen coordinates through a calibration,
+smoothed by a filter and held still inside a deadzone. The resulting target
+is handed to a thread which moves the pointer at a fixed rate, interpolating
+towards the latest target in small non-blocking steps, so the pointer moves
+smoothly whatever the frame rate of inference, and inference never waits for
+the pointer.
+'''
+import json
+import math
+import threading
+import time
+import cv2
+import numpy as np
+
+class Calibration:
+    '''
+    Affine mapping of gaze vector (x, y) to screen coordinates in pixels.
+
+    matrix: 2x3 matrix, screen point = matrix @ (gaze x, gaze y, 1).
+    '''
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=np.float64).reshape(2, 3)
+
+    @classmethod
+    def default(cls, screen_size):
+        # Gaze x of +-0.5 reaches the screen edges, gaze y points up while screen y points down
+        width, height = screen_size
+        return cls([[width, 0, width / 2], [0, -height, height / 2]])
+
+    @classmethod
+    def fit(cls, gaze_vectors, screen_points):
+        '''
+        Returns calibration fitted by least squares to gaze vectors recorded
+        while looking at screen points (at least 3 points not on one line).
+        '''
+        gaze = np.asarray(gaze_vectors, dtype=np.float64)[:, 0:2]
+        design = np.hstack([gaze, np.ones((len(gaze), 1))])
+        solution, _, _, _ = np.linalg.lstsq(design, np.asarray(screen_points, dtype=np.float64), rcond=None)
+        return cls(solution.T)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            return cls(json.load(file)["matrix"])
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"matrix": self.matrix.tolist()}, file)
+
+    def map(self, gaze_vector):
+        return self.matrix[:, 0:2] @ np.asarray(gaze_vector[0:2], dtype=np.float64) + self.matrix[:, 2]
+
+class CalibrationSession:
+    '''
+    Collects gaze vectors while the user looks at targets shown one after
+    another on a grid over the screen, then fits a Calibration to them.
+
+    samples_per_target: Gaze vectors collected for each target. The first
+                        third of them is dropped while the eyes settle.
+    '''
+    def __init__(self, screen_size, grid=3, margin=0.1, samples_per_target=15):
+        width, height = screen_size
+        self.screen_size = screen_size
+        steps = np.linspace(margin, 1 - margin, grid)
+        self.targets = [(x * width, y * height) for y in steps for x in steps]
+        self.samples_per_target = samples_per_target
+        self.samples = [[] for _ in self.targets]
+        self.index = 0
+
+    def is_done(self):
+        return self.index >= len(self.targets)
+
+    def add_sample(self, gaze_vector):
+        '''
+        Adds gaze vector for the current target. Returns True once all targets are done.
+        '''
+        if self.is_done():
+            return True
+        self.samples[self.index].append(gaze_vector[0:2])
+        if len(self.samples[self.index]) == self.samples_per_target:
+            self.index += 1
+        return self.is_done()
+
+    def draw(self):
+        '''
+        Returns image of the screen with the current target.
+        '''
+        width, height = self.screen_size
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        if not self.is_done():
+            x, y = self.targets[self.index]
+            cv2.circle(image, (int(x), int(y)), 20, (0, 0, 255), -1)
+            cv2.circle(image, (int(x), int(y)), 4, (255, 255, 255), -1)
+        return image
+
+    def fit(self):
+        gaze_vectors = []
+        screen_points = []
+        for target, samples in zip(self.targets, self.samples):
+            settled = samples[len(samples) // 3:]
+            if len(settled) > 0:
+                gaze_vectors.append(np.median(settled, axis=0))
+                screen_points.append(target)
+        return Calibration.fit(gaze_vectors, screen_points)
+
+class EMAFilter:
+    '''
+    Exponential moving average, alpha is the weight of the newest point (0 to 1).
+    '''
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+
+    def reset(self):
+        self.value = None
+
+    def filter(self, point, timestamp):
+        point = np.asarray(point, dtype=np.float64)
+        if self.value is None:
+            self.value = point
+        else:
+            self.value = self.alpha * point + (1 - self.alpha) * self.value
+        return self.value
+
+class OneEuroFilter:
+    '''
+    One Euro filter: low-pass filter whose cutoff frequency rises with speed,
+    so slow movements are smoothed strongly and fast ones follow with little lag.
+
+    min_cutoff: Cutoff frequency (Hz) when still, lower smooths more.
+    beta: Increase of cutoff with speed, higher reduces lag of fast movements.
+    d_cutoff: Cutoff frequency (Hz) of the speed estimate.
+    '''
+    def __init__(self, min_cutoff=1.0, beta=0.01, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.speed = None
+        self.timestamp = None
+
+    def filter(self, point, timestamp):
+        point = np.asarray(point, dtype=np.float64)
+        if self.value is None:
+            self.value = point
+            self.speed = np.zeros_like(point)
+            self.timestamp = timestamp
+            return self.value
+
+        dt = max(timestamp - self.timestamp, 1e-6)
+        self.timestamp = timestamp
+        speed = (point - self.value) / dt
+        self.speed = self.speed + self._alpha(self.d_cutoff, dt) * (speed - self.speed)
+        cutoff = self.min_cutoff + self.beta * np.linalg.norm(self.speed)
+        self.value = self.value + self._alpha(cutoff, dt) * (point - self.value)
+        return self.value
+
+    def _alpha(self, cutoff, dt):
+        tau = 1 / (2 * math.pi * cutoff)
+        return 1 / (1 + tau / dt)
+
+class KalmanFilter:
+    '''
+    Kalman filter with a constant velocity model of the point.
+
+    process_noise: Variance of acceleration (px/s^2)^2, higher follows changes faster.
+    measurement_noise: Variance of measured points (px^2), higher smooths more.
+    '''
+    def __init__(self, process_noise=5e5, measurement_noise=400.0):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.reset()
+
+    def reset(self):
+        # State is (x, y, vx, vy)
+        self.state = None
+        self.covariance = None
+        self.timestamp = None
+
+    def filter(self, point, timestamp):
+        point = np.asarray(point, dtype=np.float64)
+        if self.state is None:
+            self.state = np.array([point[0], point[1], 0.0, 0.0])
+            self.covariance = np.diag([self.measurement_noise] * 2 + [1e6] * 2)
+            self.timestamp = timestamp
+            return point
+
+        dt = max(timestamp - self.timestamp, 1e-6)
+        self.timestamp = timestamp
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        # Noise of a random acceleration over dt
+        g = np.array([[dt ** 2 / 2, 0], [0, dt ** 2 / 2], [dt, 0], [0, dt]])
+        noise = g @ g.T * self.process_noise
+
+        state = transition @ self.state
+        covariance = transition @ self.covariance @ transition.T + noise
+
+        innovation = point - state[0:2]
+        innovation_covariance = covariance[0:2, 0:2] + np.eye(2) * self.measurement_noise
+        gain = covariance[:, 0:2] @ np.linalg.inv(innovation_covariance)
+        self.state = state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ np.eye(2, 4)) @ covariance
+        return self.state[0:2]
+
+class NoFilter:
+    def reset(self):
+        pass
+
+    def filter(self, point, timestamp):
+        return np.asarray(point, dtype=np.float64)
+
+def create_filter(spec):
+    '''
+    Creates filter from spec: 'none', 'ema[:alpha]', 'one_euro[:min_cutoff[:beta]]'
+    or 'kalman[:process_noise[:measurement_noise]]'.
+    '''
+    kind, *args = spec.split(":")
+    args = [float(arg) for arg in args]
+    if kind == "none":
+        return NoFilter()
+    if kind == "ema":
+        return EMAFilter(*args)
+    if kind == "one_euro":
+        return OneEuroFilter(*args)
+    if kind == "kalman":
+        return KalmanFilter(*args)
+    raise ValueError(f"Invalid pointer filter '{spec}'. Valid values are 'none', 'ema', 'one_euro', 'kalman'")
+
+class PointerEngine:
+    '''
+    Moves the pointer towards the latest gaze target from its own thread.
+
+    controller: MouseController moving the pointer with `move_to`.
+    calibration: Calibration of gaze to screen. Defaults to Calibration.default.
+    filter: Filter of screen points, e.g. from create_filter.
+    deadzone: Target changes smaller than this (pixels) are ignored, so the
+              pointer stays still while the user fixates.
+    rate: Pointer updates per second.
+    '''
+    def __init__(self, controller, calibration=None, filter=None, deadzone=0.0, rate=60.0):
+        self.controller = controller
+        self.screen_size = controller.get_screen_size()
+        self.calibration = calibration if calibration is not None else Calibration.default(self.screen_size)
+        self.filter = filter if filter is not None else NoFilter()
+        self.deadzone = deadzone
+        self.rate = rate
+
+        center = np.array(self.screen_size, dtype=np.float64) / 2
+        self.position = center
+        self.target = center
+        self.segment_start = center
+        self.segment_time = time.perf_counter()
+        self.target_tag = None
+        # Time between gaze updates, the pointer reaches each target when the next one is expected
+        self.update_interval = 1 / rate
+        self.last_update = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.update_count = 0
+        self.deadzone_count = 0
+        self.move_count = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def set_calibration(self, calibration):
+        with self.lock:
+            self.calibration = calibration
+            self.filter.reset()
+
+    def update(self, gaze_vector, timestamp=None, tag=None):
+        '''
+        Sets new target from gaze vector, without waiting for the pointer.
+        timestamp: Capture time (seconds) of the frame of gaze vector, for the filter.
+        tag: Passed on to the controller with moves towards this target, e.g.
+             (seq, capture_time) of the frame for latency measurement.
+        '''
+        now = time.perf_counter()
+        if timestamp is None:
+            timestamp = now
+        with self.lock:
+            point = self.filter.filter(self.calibration.map(gaze_vector), timestamp)
+            point = np.clip(point, 0, np.array(self.screen_size) - 1)
+            self.update_count += 1
+            if self.last_update is not None:
+                self.update_interval = 0.8 * self.update_interval + 0.2 * (now - self.last_update)
+            self.last_update = now
+
+            if np.linalg.norm(point - self.target) < self.deadzone:
+                self.deadzone_count += 1
+                return
+            self.target = point
+            self.target_tag = tag
+            self.segment_start = self.position
+            self.segment_time = now
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "updates": self.update_count,
+                "deadzone_skips": self.deadzone_count,
+                "pointer_moves": self.move_count,
+                "update_interval_ms": round(self.update_interval * 1000, 1),
+            }
+
+    def _run(self):
+        interval = 1 / self.rate
+        next_tick = time.perf_counter()
+        last_pixel = None
+        while not self.stop_event.is_set():
+            now = time.perf_counter()
+            with self.lock:
+                # Linear interpolation from where the pointer was when the target was set
+                progress = min((now - self.segment_time) / max(self.update_interval, interval), 1.0)
+                self.position = self.segment_start + (self.target - self.segment_start) * progress
+                pixel = (int(round(self.position[0])), int(round(self.position[1])))
+                tag = self.target_tag
+            if pixel != last_pixel:
+                self.controller.move_to(pixel[0], pixel[1], tag)
+                last_pixel = pixel
+                self.move_count += 1
+
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                # Fell behind, skip missed ticks instead of running them late
+                next_tick = time.perf_counter()
@@ -0,0 +1,223 @@
+'''
+Outputs moving the pointer to absolute screen coordinates:
+
+- pyautogui: pyautogui, on the desktop of the current user.
+- xlib: XTest fake motion events through python-xlib, on any X display,
+  including a virtual one such as Xvfb.
+- uinput: Virtual absolute pointer device through python-evdev, for Wayland
+  and the console (needs write access to /dev/uinput).
+- null: Moves nothing, only keeps the pointer position.
+- record: Like null, and logs the trajectory with timestamps to a CSV file,
+  so pointer latency can be measured on a headless machine.
+
+Moves may carry a tag of the frame they come from, (seq, capture_time) as
+given by InputFeeder.next_frames, which is kept by the record output.
+
+AsyncPointerOutput runs any of them from its own thread. Moves are queued
+without blocking and moves still pending when a new one arrives are dropped,
+so only the latest target is applied however slow the output is.
+'''
+import threading
+import time
+
+try:
+    from Xlib import X, display as xdisplay
+    from Xlib.ext import xtest
+except ImportError:
+    X = xdisplay = xtest = None
+
+try:
+    import evdev
+except ImportError:
+    evdev = None
+
+class PyAutoGUIOutput:
+    def __init__(self):
+        # Importing pyautogui fails without a display, so only import it when used
+        import pyautogui
+        pyautogui.FAILSAFE = False
+        pyautogui.PAUSE = 0
+        self.pyautogui = pyautogui
+
+    def get_screen_size(self):
+        return tuple(self.pyautogui.size())
+
+    def move_to(self, x, y, tag=None):
+        self.pyautogui.moveTo(x, y, _pause=False)
+
+    def close(self):
+        pass
+
+class XlibOutput:
+    '''
+    display: X display name, e.g. ':99' of an Xvfb. Defaults to $DISPLAY.
+    '''
+    def __init__(self, display=None):
+        if xdisplay is None:
+            raise ImportError("Xlib pointer output requires the python-xlib package")
+        self.display = xdisplay.Display(display)
+        if not self.display.has_extension("XTEST"):
+            raise RuntimeError("X display has no XTEST extension")
+
+    def get_screen_size(self):
+        screen = self.display.screen()
+        return (screen.width_in_pixels, screen.height_in_pixels)
+
+    def move_to(self, x, y, tag=None):
+        xtest.fake_input(self.display, X.MotionNotify, x=int(x), y=int(y))
+        self.display.sync()
+
+    def close(self):
+        self.display.close()
+
+class UInputOutput:
+    '''
+    screen_size: (width, height) the absolute axes of the device span.
+    '''
+    def __init__(self, screen_size=(1920, 1080)):
+        if evdev is None:
+            raise ImportError("uinput pointer output requires the evdev package")
+        ecodes = evdev.ecodes
+        width, height = screen_size
+        self.screen_size = tuple(screen_size)
+        self.ecodes = ecodes
+        capabilities = {
+            ecodes.EV_KEY: [ecodes.BTN_LEFT],
+            ecodes.EV_ABS: [
+                (ecodes.ABS_X, evdev.AbsInfo(0, 0, width - 1, 0, 0, 0)),
+                (ecodes.ABS_Y, evdev.AbsInfo(0, 0, height - 1, 0, 0, 0)),
+            ],
+        }
+        self.device = evdev.UInput(capabilities, name="computer-pointer-controller")
+
+    def get_screen_size(self):
+        return self.screen_size
+
+    def move_to(self, x, y, tag=None):
+        self.device.write(self.ecodes.EV_ABS, self.ecodes.ABS_X, int(x))
+        self.device.write(self.ecodes.EV_ABS, self.ecodes.ABS_Y, int(y))
+        self.device.syn()
+
+    def close(self):
+        self.device.close()
+
+class NullOutput:
+    '''
+    screen_size: (width, height) reported as size of the screen.
+    '''
+    def __init__(self, screen_size=(1920, 1080)):
+        self.screen_size = tuple(screen_size)
+        self.position = (screen_size[0] // 2, screen_size[1] // 2)
+
+    def get_screen_size(self):
+        return self.screen_size
+
+    def move_to(self, x, y, tag=None):
+        self.position = (int(x), int(y))
+
+    def close(self):
+        pass
+
+class RecordingOutput(NullOutput):
+    '''
+    Keeps every move as (time, x, y, seq, capture_time), time being
+    time.perf_counter() when the move was applied and seq & capture_time those
+    of the frame of the move (empty if untagged), and writes them to path as
+    CSV on close.
+    '''
+    def __init__(self, path=None, screen_size=(1920, 1080)):
+        super().__init__(screen_size)
+        self.path = path
+        self.trajectory = []
+
+    def move_to(self, x, y, tag=None):
+        super().move_to(x, y)
+        seq, capture_time = tag if tag is not None else (None, None)
+        self.trajectory.append((time.perf_counter(), self.position[0], self.position[1], seq, capture_time))
+
+    def close(self):
+        if self.path is not None:
+            with open(self.path, "w") as file:
+                file.write("time,x,y,seq,capture_time\n")
+                for move_time, x, y, seq, capture_time in self.trajectory:
+                    tag = f"{seq},{capture_time:.6f}" if seq is not None else ","
+                    file.write(f"{move_time:.6f},{x},{y},{tag}\n")
+
+class AsyncPointerOutput:
+    '''
+    Applies moves to output from a background thread, coalescing moves which
+    are still pending when a new one arrives.
+
+    on_applied: Function called with (tag, start, end) of each applied move,
+                start and end being time.perf_counter() around the move.
+    '''
+    def __init__(self, output, on_applied=None):
+        self.output = output
+        self.on_applied = on_applied
+        self.condition = threading.Condition()
+        self.pending = None
+        self.closed = False
+        self.submitted = 0
+        self.applied = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def get_screen_size(self):
+        return self.output.get_screen_size()
+
+    def move_to(self, x, y, tag=None):
+        with self.condition:
+            self.pending = (x, y, tag)
+            self.submitted += 1
+            self.condition.notify()
+
+    def close(self):
+        ### Apply the last pending move before closing output
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.output.close()
+
+    def get_stats(self):
+        with self.condition:
+            pending = 1 if self.pending is not None else 0
+            return {"submitted": self.submitted, "applied": self.applied, \
+                "coalesced": self.submitted - self.applied - pending}
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                x, y, tag = self.pending
+                self.pending = None
+            start = time.perf_counter()
+            self.output.move_to(x, y, tag)
+            if self.on_applied is not None:
+                self.on_applied(tag, start, time.perf_counter())
+            with self.condition:
+                self.applied += 1
+
+def create_output(spec, screen_size=(1920, 1080)):
+    '''
+    Creates pointer output from spec: 'pyautogui', 'xlib[:<display>]', 'uinput',
+    'null' or 'record:<csv path>'. screen_size is used by outputs which can not
+    query the screen (uinput, null and record).
+    '''
+    kind, _, arg = spec.partition(":")
+    if kind == "pyautogui":
+        return PyAutoGUIOutput()
+    if kind == "xlib":
+        # Display names contain a colon themselves, e.g. 'xlib::99'
+        return XlibOutput(arg or None)
+    if kind == "uinput":
+        return UInputOutput(screen_size)
+    if kind == "null":
+        return NullOutput(screen_size)
+    if kind == "record" and arg:
+        return RecordingOutput(arg, screen_size)
+    raise ValueError(f"Invalid pointer output '{spec}'. Valid values are 'pyautogui', 'xlib[:<display>]', " \
+        "'uinput', 'null', 'record:<path>'")
@@ -0,0 +1,91 @@
+'''
+Vectorized post-processing of model outputs.
+All candidates of a frame are handled as numpy arrays: confidence is filtered
+with a boolean mask, overlapping boxes are suppressed with an IoU matrix and
+faces are selected with one argsort, so the cost per frame stays flat however
+many candidates the detector emits. Boxes are (xmin, ymin, xmax, ymax) rows,
+normalized to the frame unless scaled to pixels with scale_boxes.
+'''
+import numpy as np
+
+def filter_detections(detections, conf_threshold=0.5):
+    '''
+    Returns (boxes, scores) of detections with confidence of at least conf_threshold.
+
+    detections: SSD output of shape (1, 1, N, 7) or (N, 7), rows of
+                [image_id, label, confidence, xmin, ymin, xmax, ymax].
+    boxes: float32 array of shape (K, 4), in order of detections.
+    scores: float32 array of shape (K,).
+    '''
+    detections = np.asarray(detections).reshape(-1, 7)
+    # Rows with image_id -1 pad the output after the last detection
+    mask = (detections[:, 2] >= conf_threshold) & (detections[:, 0] >= 0)
+    return detections[mask, 3:7].astype(np.float32), detections[mask, 2].astype(np.float32)
+
+def box_areas(boxes):
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+def iou_matrix(boxes_a, boxes_b):
+    '''
+    Returns array of shape (len(boxes_a), len(boxes_b)) of intersection over union of each pair.
+    '''
+    top_left = np.maximum(boxes_a[:, None, 0:2], boxes_b[None, :, 0:2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:4], boxes_b[None, :, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    union = box_areas(boxes_a)[:, None] + box_areas(boxes_b)[None, :] - intersection
+    return intersection / np.maximum(union, 1e-12)
+
+def nms(boxes, scores, iou_threshold=0.5):
+    '''
+    Non-maximum suppression. Returns indices of kept boxes, highest score first.
+    Boxes overlapping a kept box of higher score by more than iou_threshold are dropped.
+    '''
+    order = np.argsort(-scores, kind="stable")
+    overlaps = iou_matrix(boxes[order], boxes[order]) > iou_threshold
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ~overlaps[i, i + 1:]
+    return order[keep]
+
+def select_top_k(boxes, scores, k=None, order="confidence"):
+    '''
+    Returns indices of at most k boxes (all if k is None), largest first by
+    order: 'confidence' or 'area'.
+    '''
+    if order == "confidence":
+        keys = scores
+    elif order == "area":
+        keys = box_areas(boxes)
+    else:
+        raise ValueError(f"Invalid face order '{order}'. Valid values are 'confidence', 'area'")
+    return np.argsort(-keys, kind="stable")[:k]
+
+def postprocess_detections(detections, conf_threshold=0.5, iou_threshold=None, top_k=None, order="confidence"):
+    '''
+    Returns (boxes, scores) of faces in SSD output: filtered by confidence,
+    suppressed with nms if iou_threshold is given and selected with
+    select_top_k if top_k is given or order is not 'confidence'.
+    '''
+    boxes, scores = filter_detections(detections, conf_threshold)
+    if iou_threshold is not None and len(boxes) > 1:
+        keep = nms(boxes, scores, iou_threshold)
+        boxes, scores = boxes[keep], scores[keep]
+    if top_k is not None or order != "confidence":
+        keep = select_top_k(boxes, scores, top_k, order)
+        boxes, scores = boxes[keep], scores[keep]
+    return boxes, scores
+
+def scale_boxes(boxes, width, height):
+    '''
+    Returns int32 array of shape (K, 4) of normalized boxes in pixels, clipped to the frame.
+    '''
+    boxes = np.clip(np.asarray(boxes, dtype=np.float32).reshape(-1, 4), 0.0, 1.0)
+    return (boxes * np.array([width, height, width, height], dtype=np.float32)).astype(np.int32)
+
+def reshape_landmarks(output, batch_size, count=None):
+    '''
+    Returns float32 array of shape (count, L, 2) of (x, y) of each landmark of
+    the first count images of a batch of landmarks output.
+    '''
+    return np.asarray(output, dtype=np.float32).reshape(batch_size, -1, 2)[:count]
@@ -0,0 +1,77 @@
+'''
+Preallocated input blobs for models, so that preprocessing does not allocate
+new arrays for every frame. Images are resized straight into a reusable buffer
+and split into channel planes of the NCHW blob, which converts the layout
+without any temporary array.
+Inputs are copied into the infer request when inference is started, so the
+blob can be reused by the next call right after submitting.
+'''
+import threading
+import cv2
+import numpy as np
+
+class InputBuffer:
+    '''
+    Reusable NCHW input blob of a model.
+    '''
+    def __init__(self, shape, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.blob = np.zeros(self.shape, dtype=dtype)
+        self.filled = 0
+
+        if len(self.shape) == 4:
+            _, channels, height, width = self.shape
+            self.size = (width, height)
+            self.resized = np.empty((height, width, channels), dtype=dtype)
+            # Channel planes of each slot, written in place by cv2.split
+            self.planes = [[self.blob[i, c] for c in range(channels)] for i in range(self.shape[0])]
+
+    def fill_images(self, images):
+        '''
+        Resizes images into slots of the blob, unused slots are left blank.
+        Returns the blob.
+        '''
+        for i, image in enumerate(images):
+            if image.shape == self.resized.shape:
+                resized = image
+            else:
+                resized = cv2.resize(image, self.size, dst=self.resized)
+            if resized.dtype == self.blob.dtype:
+                cv2.split(resized, self.planes[i])
+            else:
+                np.copyto(self.blob[i], resized.transpose((2, 0, 1)), casting="unsafe")
+        self._clear_unused(len(images))
+        return self.blob
+
+    def fill_values(self, values):
+        '''
+        Copies rows of values (e.g. head pose angles) into slots of the blob.
+        Returns the blob.
+        '''
+        count = len(values)
+        if count > 0:
+            self.blob[:count] = np.asarray(values, dtype=self.blob.dtype).reshape(count, *self.shape[1:])
+        self._clear_unused(count)
+        return self.blob
+
+    def _clear_unused(self, count):
+        # Only slots filled by the previous call need to be blanked
+        if self.filled > count:
+            self.blob[count:self.filled] = 0
+        self.filled = count
+
+class InputBuffers:
+    '''
+    Input buffers of a model, one set per thread calling it.
+    '''
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.blob.dtype != dtype:
+            buffer = buffers[name] = InputBuffer(shape, dtype)
+        return buffer
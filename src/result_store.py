@@ -0,0 +1,181 @@
+'''
+Storage of per-face results of the models, for analysis and replay without
+running inference again.
+Results are appended one face at a time into a preallocated chunk (numpy
+structured array), and full chunks are appended to a raw binary file, so
+writing costs only a few field assignments per face in the inference loop.
+Raw files can be memory mapped for analysis without reading them whole, a
+JSON sidecar file (<path>.json) holds their dtype and metadata. Paths ending
+with .npz are converted to a compressed .npz with one array per field on close.
+'''
+import json
+import os
+import time
+import numpy as np
+
+### Fields of a result row, one row per face
+result_dtype = np.dtype([
+    ("video", np.int32),                         # index of video (for batch processing)
+    ("frame", np.int64),                         # index of frame in its video
+    ("time", np.float64),                        # capture time of frame (seconds)
+    ("face", np.int16),                          # index of face in its frame
+    ("face_box", np.float32, (4,)),              # (xmin, ymin, xmax, ymax) normalized to the frame
+    ("landmarks", np.float32, (2, 2)),           # left and right eye normalized to the face box
+    ("head_pose_angles", np.float32, (3,)),
+    ("gaze_vector", np.float32, (3,)),
+    ("variant", "S16"),                          # model variant, e.g. precision (for A/B tests)
+])
+
+class ResultRecorder:
+    '''
+    Append-only recorder of result rows.
+
+    path: File to write. Paths ending with .npz are saved as .npz on close,
+          others as raw binary with a .json sidecar.
+    chunk_size: Number of rows buffered before they are written to the file.
+    metadata: Dict saved with results, e.g. frame size and fps.
+    '''
+    def __init__(self, path, chunk_size=4096, metadata=None):
+        self.path = path
+        self.is_npz = path.endswith(".npz")
+        self.metadata = dict(metadata) if metadata is not None else {}
+        self.chunk = np.zeros(chunk_size, dtype=result_dtype)
+        self.filled = 0
+        self.count = 0
+
+        # Rows of .npz files are staged in a raw file until close
+        self.data_path = path + ".part" if self.is_npz else path
+        self.file = open(self.data_path, "wb")
+        if not self.is_npz:
+            self._write_sidecar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, frame, face, face_box, landmarks, head_pose_angles, gaze_vector, time=0.0, video=0, variant=""):
+        row = self.chunk[self.filled]
+        row["video"] = video
+        row["frame"] = frame
+        row["time"] = time
+        row["face"] = face
+        row["face_box"] = face_box
+        row["landmarks"] = landmarks
+        row["head_pose_angles"] = head_pose_angles
+        row["gaze_vector"] = gaze_vector
+        row["variant"] = variant
+        self.filled += 1
+        if self.filled == len(self.chunk):
+            self.flush()
+
+    def append_columns(self, columns):
+        '''
+        Appends rows given as dict of field name to array of values of all rows.
+        Fields not given are left zero.
+        '''
+        count = len(next(iter(columns.values())))
+        rows = np.zeros(count, dtype=result_dtype)
+        for name, values in columns.items():
+            rows[name] = values
+        self.flush()
+        self.file.write(rows.tobytes())
+        self.count += count
+
+    def flush(self):
+        if self.filled > 0:
+            self.file.write(self.chunk[:self.filled].tobytes())
+            self.count += self.filled
+            self.filled = 0
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        if self.is_npz:
+            rows = np.fromfile(self.data_path, dtype=result_dtype)
+            np.savez_compressed(self.path, metadata=np.array(json.dumps(self.metadata)), \
+                **{name: rows[name] for name in result_dtype.names})
+            os.remove(self.data_path)
+        else:
+            self._write_sidecar()
+
+    def _write_sidecar(self):
+        with open(self.path + ".json", "w") as file:
+            json.dump({"dtype": np.lib.format.dtype_to_descr(result_dtype), "metadata": self.metadata}, file)
+
+class ResultReader:
+    '''
+    Reads results saved by ResultRecorder. Raw files are memory mapped and .npz
+    files load each field only when it is first accessed, so only fields used
+    are read from disk.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.columns = {}
+        if path.endswith(".npz"):
+            self.data = np.load(path)
+            self.metadata = json.loads(str(self.data["metadata"]))
+            self.fields = [name for name in self.data.files if name != "metadata"]
+            self.count = len(self["frame"])
+        else:
+            with open(path + ".json") as file:
+                sidecar = json.load(file)
+            dtype = np.lib.format.descr_to_dtype([tuple(field) for field in sidecar["dtype"]])
+            self.metadata = sidecar["metadata"]
+            self.fields = list(dtype.names)
+            # Rows of an unfinished recording are readable up to the last full row
+            self.count = os.path.getsize(path) // dtype.itemsize
+            self.data = np.memmap(path, dtype=dtype, mode="r", shape=(self.count,)) if self.count > 0 \
+                else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, field):
+        # Fields of .npz files are decompressed on each access of the file, keep them
+        column = self.columns.get(field)
+        if column is None:
+            column = self.columns[field] = self.data[field]
+        return column
+
+    def frames(self):
+        '''
+        Yields (video, frame, time, rows) for each frame with faces, in order,
+        where rows is dict of field name to values of its faces.
+        '''
+        videos = self["video"]
+        frames = self["frame"]
+        starts = np.flatnonzero((np.diff(frames) != 0) | (np.diff(videos) != 0)) + 1
+        bounds = np.concatenate([[0], starts, [self.count]]) if self.count > 0 else []
+        times = self["time"]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            rows = {name: self[name][start:end] for name in self.fields}
+            yield int(videos[start]), int(frames[start]), float(times[start]), rows
+
+    def replay(self, controller=None, renderer=None, speed=1.0):
+        '''
+        Replays stored results in order of frames.
+
+        controller: MouseController moved by gaze of the first face of each frame.
+        renderer: Function called with (video, frame, rows) of each frame, e.g. an
+                  OverlayRenderer. Replay stops if it returns False.
+        speed: Replay speed relative to capture times, 0 replays as fast as possible.
+        '''
+        start = time.perf_counter()
+        first_time = None
+        for video, frame, capture_time, rows in self.frames():
+            if speed > 0:
+                if first_time is None:
+                    first_time = capture_time
+                delay = (capture_time - first_time) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if renderer is not None and renderer(video, frame, rows) is False:
+                break
+            if controller is not None:
+                gaze_vector = rows["gaze_vector"][0]
+                controller.move(gaze_vector[0], gaze_vector[1])
@@ -0,0 +1,207 @@
+'''
+Pipeline stages running the four models, shared by the app (main.py), batch
+processing (batch_process.py), the stream scheduler (stream_scheduler.py) and
+the gaze server (gaze_server.py). Stages work on groups of frames: a group is
+a dict of 'records', each with a 'frame', and 'models', the ModelSet all
+frames of the group run on. Face detection of all frames of a group is
+submitted at once, and the faces of all of them are stacked into the same
+batches of the landmarks, head pose and gaze models. A single stream runs
+groups of one frame.
+
+Each record gets 'faces', each face a dict of:
+- 'face_box': normalized (xmin, ymin, xmax, ymax) of the face in the frame
+- 'face_rect': the same box in pixels of the frame
+- 'face': crop of the face
+- 'landmarks': normalized (x, y) of the eyes in the face
+- 'eye_pos', 'eye_coords': eye centres and eye boxes in pixels of the face
+- 'left_eye', 'right_eye': eye crops of the gaze model input size
+- 'head_pose_angles' and 'gaze_vector'
+'''
+from concurrent.futures import Future
+from contextlib import nullcontext
+import numpy as np
+from eye_roi import extract_eyes
+from infer_request_pool import chain, gather, recover
+from postprocessing import scale_boxes
+
+class GroupStages:
+    '''
+    multi_face: Process all faces of each frame instead of the first one.
+    eye_scale: Width of eye crops relative to the distance between the eyes.
+    tracker: Optional FaceTracker. Face detection runs only when the tracker
+             needs it, faces are tracked in between. Groups hold one frame.
+    gate: Optional ChangeGate. Frames whose results are reused get the earlier
+          record as 'reused_from' and skip the models. Groups hold one frame.
+    drop_empty: Drop groups without a face to process (the stage returns None),
+                instead of passing them on with empty 'faces'.
+    isolate_errors: A group failing in a stage gets the exception as 'error',
+                    skips the other stages and leaves the pipeline in order,
+                    instead of stopping the pipeline.
+    metrics: Optional Metrics, time of face tracking, cropping and change
+             checks is recorded to it.
+    '''
+    def __init__(self, multi_face=False, eye_scale=0.7, tracker=None, gate=None, \
+        drop_empty=False, isolate_errors=False, metrics=None):
+        self.multi_face = multi_face
+        self.eye_scale = eye_scale
+        self.tracker = tracker
+        self.gate = gate
+        self.drop_empty = drop_empty
+        self.isolate_errors = isolate_errors
+        self.metrics = metrics
+
+    def get_stages(self, num_requests=1):
+        '''
+        Returns stages of a Pipeline, each keeping up to num_requests groups in flight.
+        '''
+        stages = [
+            ("face_detection", self.detect_faces),
+            ("facial_landmarks_detection", self.detect_landmarks),
+            ("head_pose_estimation", self.estimate_head_pose),
+            ("gaze_estimation", self.estimate_gaze),
+        ]
+        if self.isolate_errors:
+            stages = [(name, self._isolate(stage)) for name, stage in stages]
+        return [(name, stage, num_requests) for name, stage in stages]
+
+    def detect_faces(self, group):
+        records = group["records"]
+        face_detection = group["models"].face_detection
+
+        if self.gate is not None:
+            with self._timer("change_check"):
+                source = self.gate.check(records[0])
+            if source is not None:
+                # Nothing changed, later stages pass the group on and results of source are reused
+                records[0]["reused_from"] = source
+                group["done"] = True
+                return group
+
+        if self.tracker is not None and self.tracker.redetect_interval > 1:
+            # Tracking depends on previous frame, so detection is waited for here
+            return self._crop_faces(group, [self._track(records[0], face_detection)])
+        futures = [face_detection.predict_async(record["frame"]) for record in records]
+        return chain(gather(futures), lambda batch_box_coords: self._crop_faces(group, batch_box_coords))
+
+    def detect_landmarks(self, group):
+        if group["done"]:
+            return group
+        faces = group["faces"]
+        models = group["models"]
+        eye_size = models.gaze_estimation.get_input_size()
+
+        def crop_eyes(batch_landmarks):
+            with self._timer("eye_crop"):
+                for face, landmarks in zip(faces, batch_landmarks):
+                    # Eye crops are square and sized from the distance between the eyes
+                    eyes, eye_boxes, eye_centers = extract_eyes(face["face"], landmarks, out_size=eye_size, \
+                        iod_scale=self.eye_scale)
+                    face["landmarks"] = landmarks
+                    face["eye_pos"] = eye_centers.tolist()
+                    face["eye_coords"] = eye_boxes.tolist()
+                    face["left_eye"] = eyes[0]
+                    face["right_eye"] = eyes[1]
+            if self.tracker is not None:
+                # Landmarks re-centre the tracked boxes
+                record = group["records"][0]
+                for face in record["faces"]:
+                    self.tracker.recenter(record["track_generation"], face["track_index"], face["face_rect"], \
+                        face["landmarks"])
+            if self.gate is not None:
+                # Following frames are compared with this one, eyes included
+                record = group["records"][0]
+                eye_boxes = [np.add(face["eye_coords"], np.tile(face["face_rect"][0:2], 2)) for face in record["faces"]]
+                self.gate.update(record, [face["face_rect"] for face in record["faces"]], eye_boxes)
+            return group
+
+        future = models.facial_landmarks_detection.predict_batch_async([face["face"] for face in faces])
+        return chain(future, crop_eyes)
+
+    def estimate_head_pose(self, group):
+        if group["done"]:
+            return group
+        faces = group["faces"]
+
+        def set_angles(batch_head_pose_angles):
+            for face, head_pose_angles in zip(faces, batch_head_pose_angles):
+                face["head_pose_angles"] = head_pose_angles
+            return group
+
+        future = group["models"].head_pose_estimation.predict_batch_async([face["face"] for face in faces])
+        return chain(future, set_angles)
+
+    def estimate_gaze(self, group):
+        if group["done"]:
+            return group
+        faces = group["faces"]
+
+        def set_gaze_vectors(gaze_vectors):
+            for face, gaze_vector in zip(faces, gaze_vectors):
+                face["gaze_vector"] = gaze_vector
+            return group
+
+        future = group["models"].gaze_estimation.predict_batch_async([face["left_eye"] for face in faces], \
+            [face["right_eye"] for face in faces], [face["head_pose_angles"] for face in faces])
+        return chain(future, set_gaze_vectors)
+
+    def _track(self, record, face_detection):
+        # Box coords of faces of the frame, tracked or detected
+        frame = record["frame"]
+        box_coords = None
+        if not self.tracker.needs_detection():
+            with self._timer("face_tracking"):
+                box_coords = self.tracker.track(frame)
+        if box_coords is None:
+            box_coords = face_detection.predict(frame)
+            if not self.multi_face:
+                box_coords = box_coords[0:1]
+            # Faces are cropped from tracked boxes only, so box i is track i
+            box_coords = self.tracker.update_detection(frame, box_coords)
+        return box_coords
+
+    def _crop_faces(self, group, batch_box_coords):
+        records = group["records"]
+        group["faces"] = []
+        with self._timer("face_crop"):
+            for record, box_coords in zip(records, batch_box_coords):
+                if not self.multi_face:
+                    box_coords = box_coords[0:1]
+                if self.tracker is not None:
+                    record["track_generation"] = self.tracker.generation
+                frame = record["frame"]
+                height, width, _ = frame.shape
+                boxes = np.clip(np.asarray(box_coords, dtype=np.float32).reshape(-1, 4), 0.0, 1.0)
+                record["faces"] = []
+                for i, (box, rect) in enumerate(zip(boxes, scale_boxes(boxes, width, height).tolist())):
+                    xmin, ymin, xmax, ymax = rect
+                    face = frame[ymin:ymax, xmin:xmax]
+                    if face.size > 0:
+                        record["faces"].append({"face_box": box, "face_rect": tuple(rect), "face": face, \
+                            "track_index": i})
+                group["faces"].extend(record["faces"])
+
+        # Frames without a face skip the other models
+        group["done"] = len(group["faces"]) == 0
+        if group["done"] and self.drop_empty:
+            return None
+        return group
+
+    def _timer(self, name):
+        return self.metrics.timer(name) if self.metrics is not None else nullcontext()
+
+    def _isolate(self, stage):
+        def run(group):
+            if "error" in group:
+                return group
+            try:
+                result = stage(group)
+            except Exception as e:
+                return _failed(group, e)
+            if isinstance(result, Future):
+                return recover(result, lambda e: _failed(group, e))
+            return result
+        return run
+
+def _failed(group, error):
+    group["error"] = error
+    return group
@@ -0,0 +1,165 @@
+'''
+Serving of many camera or video streams with one loaded set of models.
+Streams are InputFeeders registered with the scheduler. The scheduler takes
+frames from them round-robin, at most one frame of each stream per round,
+and runs the frames of a round as one group through a single Pipeline: face
+detection of all frames of the group is submitted at once, and the faces of
+all of them are stacked into the same batches of the landmarks, head pose and
+gaze models. A stream with frames ready never waits for a slow or stalled
+one, and every stream gets an equal share of the models, so memory and load
+time of the models do not multiply with the number of streams.
+
+Groups leave the pipeline in order, so results of each stream are in order
+of its frames. Per stream, frames per second of results and queue lag (time
+from capture of a frame until its results are ready) are reported.
+'''
+import threading
+import time
+from collections import deque
+import numpy as np
+from pipeline import Pipeline
+from stages import GroupStages
+
+class StreamStats:
+    '''
+    Frames and queue lag of one stream.
+    '''
+    def __init__(self, name, window=100):
+        self.name = name
+        self.frames = 0
+        self.results = 0
+        self.no_face = 0
+        self.start = None
+        self.lags = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def frame_read(self):
+        with self.lock:
+            if self.start is None:
+                self.start = time.perf_counter()
+            self.frames += 1
+
+    def frame_done(self, capture_time, has_faces):
+        lag = time.perf_counter() - capture_time
+        with self.lock:
+            if has_faces:
+                self.results += 1
+            else:
+                self.no_face += 1
+            self.lags.append(lag)
+        return lag
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.start if self.start is not None else 0.0
+            lags = np.array(self.lags) * 1000 if len(self.lags) > 0 else np.zeros(1)
+            return {
+                "stream": self.name,
+                "frames": self.frames,
+                "results": self.results,
+                "no_face": self.no_face,
+                "fps": round((self.results + self.no_face) / elapsed, 2) if elapsed > 0 else 0.0,
+                "lag_p50_ms": round(float(np.percentile(lags, 50)), 2),
+                "lag_p95_ms": round(float(np.percentile(lags, 95)), 2),
+            }
+
+class StreamScheduler:
+    '''
+    Runs frames of all registered streams through one set of models.
+
+    models: ModelManager whose active variant runs each group, or a ModelSet.
+    num_requests: Infer requests of each model kept in flight.
+    depth: Max groups waiting in front of each pipeline stage.
+    max_group: Max frames in a group, all streams if None. Streams beyond it
+               take turns, starting after the last stream of the previous group.
+    multi_face: Process all faces of each frame instead of the first one.
+    eye_scale: Width of eye crops relative to the distance between the eyes.
+    metrics: Optional Metrics, stage latencies and 'capture_to_gaze[<stream>]'
+             lags are recorded to it.
+    poll_interval: Seconds the scheduler waits for a frame when no stream has one.
+    '''
+    def __init__(self, models, num_requests=1, depth=2, max_group=None, multi_face=False, eye_scale=0.7, \
+        metrics=None, poll_interval=0.005):
+        self.models = models
+        self.num_requests = num_requests
+        self.depth = depth
+        self.max_group = max_group
+        self.group_stages = GroupStages(multi_face, eye_scale)
+        self.metrics = metrics
+        self.poll_interval = poll_interval
+
+        self.streams = []
+        self.stats = {}
+        self.next_stream = 0
+        self.pipeline = None
+
+    def add_stream(self, name, feeder):
+        '''
+        Registers stream of name reading frames from feeder (an InputFeeder
+        with its data loaded). Streams are added before run.
+        '''
+        if name in self.stats:
+            raise ValueError(f"Stream '{name}' is already registered")
+        self.streams.append((name, feeder))
+        self.stats[name] = StreamStats(name)
+
+    def run(self):
+        '''
+        Generator yielding (stream name, record) of each frame with a face, in
+        order of frames of each stream, until all streams have ended. Record
+        holds 'frame', 'index' (sequence number), 'time' (capture time) and
+        'faces', each face as described in stages.py.
+        '''
+        self.pipeline = Pipeline(self.group_stages.get_stages(self.num_requests), self.depth, self.metrics)
+
+        for group in self.pipeline.run(self._groups()):
+            for record in group["records"]:
+                name = record["stream"]
+                lag = self.stats[name].frame_done(record["time"], len(record["faces"]) > 0)
+                if self.metrics is not None:
+                    self.metrics.record(f"capture_to_gaze[{name}]", lag)
+                if len(record["faces"]) > 0:
+                    yield name, record
+
+    def get_stats(self):
+        '''
+        Returns stats of each stream: frames read, frames with and without a
+        face, frames per second and p50 & p95 queue lag, with stats of its feeder.
+        '''
+        return [dict(self.stats[name].summary(), feeder=feeder.get_stats()) for name, feeder in self.streams]
+
+    def get_pipeline_stats(self):
+        return self.pipeline.get_stats() if self.pipeline is not None else []
+
+    def _groups(self):
+        # Rounds of at most one frame of each stream which has one ready
+        active = list(self.streams)
+        while len(active) > 0:
+            records = []
+            visited = 0
+            for i in range(len(active)):
+                if self.max_group is not None and len(records) == self.max_group:
+                    break
+                name, feeder = active[(self.next_stream + i) % len(active)]
+                visited += 1
+                item = feeder.next_frame(0)
+                if item is not None:
+                    records.append(self._make_record(name, item))
+            if len(records) == 0:
+                # No frame ready anywhere, wait a little for one of the next stream
+                name, feeder = active[self.next_stream % len(active)]
+                item = feeder.next_frame(self.poll_interval)
+                if item is not None:
+                    records.append(self._make_record(name, item))
+            self.next_stream = (self.next_stream + visited) % len(active)
+
+            if len(records) > 0:
+                # All frames of the group run on the same models, even if the variant is swapped meanwhile
+                models = self.models.active if hasattr(self.models, "active") else self.models
+                yield {"records": records, "models": models}
+            active = [(name, feeder) for name, feeder in active if not feeder.is_done()]
+
+    def _make_record(self, name, item):
+        seq, capture_time, frame = item
+        self.stats[name].frame_read()
+        return {"stream": name, "frame": frame, "index": seq, "time": capture_time}
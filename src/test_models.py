@@ -1,8 +1,21 @@
+import asyncio
 import cv2
 from face_detection import Face_Detection
 from head_pose_estimation import Head_Pose_Estimation
 from facial_landmarks_detection import Facial_Landmarks_Detection
 from gaze_estimation import Gaze_Estimation
+from eye_roi import extract_eyes
+from backends import SyntheticBackend
+from model_registry import ModelRegistry
+from result_store import ResultRecorder, ResultReader
+from postprocessing import postprocess_detections, scale_boxes
+from frame_ring import FrameRing, RingFeeder
+from pipeline import Pipeline
+from change_gate import ChangeGate
+from model_manager import ModelSet
+from gaze_server import GazeServer
+from gaze_client import GazeClient
+import numpy as np
 
 def test_face_detection():
     model = Face_Detection("models/intel/face-detection-adas-0001/FP16-INT8/face-detection-adas-0001.xml")
@@ -47,19 +60,13 @@ def test_facial_landmarks_detection():
     model = Facial_Landmarks_Detection("models/intel/landmarks-regression-retail-0009/FP16-INT8/landmarks-regression-retail-0009.xml")
     model.load_model()
     image = cv2.imread("media/face1.jpg")
-    height, width, _ = image.shape
     eye_landmarks = model.predict(image)
-    landmarks_pos = [(int(l[0] * width), int(l[1] * height)) for l in eye_landmarks]
-    left_eye_coord = landmarks_pos[0]
-    right_eye_coord = landmarks_pos[1]
-    
-    x_offset = 50
-    y_offset = 25
-    left_eye = image[left_eye_coord[1] - y_offset:left_eye_coord[1] + y_offset, left_eye_coord[0] - x_offset:left_eye_coord[0] + x_offset]
-    right_eye = image[right_eye_coord[1] - y_offset:right_eye_coord[1] + y_offset, right_eye_coord[0] - x_offset:right_eye_coord[0] + x_offset]
-    
-    cv2.imwrite("media/left_eye.jpg", left_eye)
-    cv2.imwrite("media/right_eye.jpg", right_eye)
+    eyes, _, centers = extract_eyes(image, eye_landmarks)
+    left_eye_coord = tuple(centers[0].tolist())
+    right_eye_coord = tuple(centers[1].tolist())
+
+    cv2.imwrite("media/left_eye.jpg", eyes[0])
+    cv2.imwrite("media/right_eye.jpg", eyes[1])
 
     radius = 5
     color = (255, 0, 0)
@@ -78,6 +85,178 @@ def test_gaze_estimation():
     gaze_vector = model.predict(left_eye, right_eye, angles)
     print("GazeVector: " + str(gaze_vector))
     
+def test_eye_roi():
+    image = cv2.imread("media/face1.jpg")
+    height, width, _ = image.shape
+    # Eyes in the middle, at the top left corner and beyond the bottom right corner of face
+    for eye_landmarks in ([(0.3, 0.4), (0.7, 0.4)], [(0.0, 0.0), (0.05, 0.02)], [(0.98, 0.99), (1.2, 1.1)]):
+        eyes, boxes, _ = extract_eyes(image, eye_landmarks, (35, 20))
+        assert eyes.shape == (2, 60, 60, 3)
+        for xmin, ymin, xmax, ymax in boxes:
+            assert 0 <= xmin < xmax <= width and 0 <= ymin < ymax <= height
+            assert (xmax - xmin, ymax - ymin) == (min(70, width), min(40, height))
+    print("Eye ROI boxes stay inside face")
+
+    # Scaled eye boxes are square and grow with distance between eyes
+    _, small_boxes, _ = extract_eyes(image, [(0.4, 0.4), (0.6, 0.4)])
+    _, large_boxes, _ = extract_eyes(image, [(0.2, 0.4), (0.8, 0.4)])
+    small_size = small_boxes[0, 2] - small_boxes[0, 0]
+    large_size = large_boxes[0, 2] - large_boxes[0, 0]
+    assert small_size == small_boxes[0, 3] - small_boxes[0, 1]
+    assert small_size < large_size
+    print(f"Scaled eye box sizes: {small_size}, {large_size}")
+
+def test_synthetic_backend():
+    # Runs all models without a runtime or model files, outputs only have the right shape
+    backend = SyntheticBackend(latency=0.001)
+    registry = ModelRegistry(backend=backend)
+    face_detection = Face_Detection("face-detection-adas-0001.xml", backend=backend)
+    landmarks_detection = Facial_Landmarks_Detection("landmarks-regression-retail-0009.xml", batch_size=2, backend=backend)
+    head_pose_estimation = Head_Pose_Estimation("head-pose-estimation-adas-0001.xml", batch_size=2, backend=backend)
+    gaze_estimation = Gaze_Estimation("gaze-estimation-adas-0002.xml", batch_size=2, backend=backend)
+    registry.load_models([face_detection, landmarks_detection, head_pose_estimation, gaze_estimation], 2)
+
+    image = cv2.imread("media/sample.png")
+    box_coords = face_detection.predict(image)
+    assert len(box_coords) == 1
+    faces = [image[0:100, 0:100]] * 3
+    batch_eye_landmarks = landmarks_detection.predict_batch(faces)
+    batch_angles = head_pose_estimation.predict_batch(faces)
+    eyes = [extract_eyes(face, eye_landmarks)[0] for face, eye_landmarks in zip(faces, batch_eye_landmarks)]
+    gaze_vectors = gaze_estimation.predict_batch([e[0] for e in eyes], [e[1] for e in eyes], batch_angles)
+    assert len(batch_eye_landmarks) == len(batch_angles) == len(gaze_vectors) == 3
+    assert len(batch_angles[0]) == 3 and len(gaze_vectors[0]) == 3
+    print("Synthetic backend outputs: " + str(box_coords[0]) + " " + str(gaze_vectors[0]))
+
+def test_result_store():
+    # Same rows read back from raw (memory mapped) and .npz files, grouped by frame
+    for path in ("bin/results.bin", "bin/results.npz"):
+        with ResultRecorder(path, chunk_size=4, metadata={"input": "test"}) as recorder:
+            for frame in range(5):
+                for face in range(2):
+                    recorder.append(frame, face, (0.1, 0.2, 0.3, 0.4), [(0.3, 0.4), (0.7, 0.4)], \
+                        [frame, 0.0, 0.0], [0.1, -0.1, 1.0], frame / 30)
+        reader = ResultReader(path)
+        assert len(reader) == 10 and reader.metadata["input"] == "test"
+        assert reader["head_pose_angles"][9][0] == 4
+        frames = list(reader.frames())
+        assert len(frames) == 5 and all(len(rows["face"]) == 2 for _, _, _, rows in frames)
+        print(f"Result store {path}: {len(reader)} rows in {len(frames)} frames")
+
+def test_postprocessing():
+    # Two overlapping faces, a small separate one, one below threshold and padding
+    detections = np.zeros((1, 1, 200, 7), dtype=np.float32)
+    detections[..., 0] = -1
+    detections[0, 0, 0:4] = [
+        [0, 1, 0.9, 0.1, 0.1, 0.4, 0.5],
+        [0, 1, 0.8, 0.12, 0.1, 0.42, 0.52],
+        [0, 1, 0.7, 0.6, 0.6, 0.7, 0.7],
+        [0, 1, 0.3, 0.5, 0.5, 0.9, 0.9],
+    ]
+    boxes, scores = postprocess_detections(detections)
+    assert boxes.shape == (3, 4)
+    boxes, scores = postprocess_detections(detections, iou_threshold=0.5)
+    assert list(scores) == [np.float32(0.9), np.float32(0.7)]
+    boxes, _ = postprocess_detections(detections, iou_threshold=0.5, top_k=1, order="area")
+    assert (scale_boxes(boxes, 100, 100) == [[10, 10, 40, 50]]).all()
+    print(f"Post-processing kept boxes: {boxes.tolist()}")
+
+def test_frame_ring():
+    # Slots are reused only once released, drop_oldest takes back unread frames
+    ring = FrameRing(2, (4, 4, 3), policy="drop_oldest")
+    for seq in range(3):
+        assert ring.put(np.full((4, 4, 3), seq, dtype=np.uint8), seq, 0.0)
+    items = [ring.get(), ring.get()]
+    assert [item.seq for item in items] == [1, 2] and (items[1].frame == 2).all()
+    assert ring.get_stats()["dropped"] == 1
+    for item in items:
+        ring.release(item)
+    ring.end()
+    assert ring.get() is None and ring.is_done()
+    del items, item
+    ring.close()
+    ring.unlink()
+    print("Frame ring: oldest frame dropped, others read in place")
+
+def test_ring_drops():
+    # Frames dropped in the pipeline (as frames without a face) free their slot, so a small ring keeps flowing
+    feed = RingFeeder("video", "media/demo.mp4", "all", slots=4)
+    feed.load_data()
+
+    def frames():
+        for i in range(20):
+            item = feed.next_frame(timeout=5)
+            assert item is not None, f"Frame {i} not read, slots of dropped frames were not released"
+            yield {"index": item[0], "frame": item[2]}
+
+    pipeline = Pipeline([("face_detection", lambda record: record if record["index"] % 2 == 1 else None)], 2, \
+        on_drop=lambda record: feed.release(record["index"]))
+    results = []
+    try:
+        for record in pipeline.run(frames()):
+            results.append(record["index"])
+            feed.release(record["index"])
+    finally:
+        feed.close()
+    assert results == list(range(1, 20, 2))
+    print(f"Ring with dropped frames: results of frames {results}")
+
+def test_change_gate():
+    # Noise is reused, a change in the face region or an old reference is processed again
+    frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    gate = ChangeGate(threshold=3.0, max_age=1.0)
+    source = {"frame": frame, "time": 0.0}
+    assert gate.check(source) is None
+    gate.update(source, [(200, 100, 400, 350)])
+    noisy = np.clip(frame.astype(np.int16) + np.random.randint(-2, 3, frame.shape), 0, 255).astype(np.uint8)
+    assert gate.check({"frame": noisy, "time": 0.5}) is source
+    changed = frame.copy()
+    changed[150:300, 250:350] = 0
+    assert gate.check({"frame": changed, "time": 0.5}) is None
+    assert gate.check({"frame": frame, "time": 1.5}) is None
+    stats = gate.get_stats()
+    assert stats["frames"] == 4 and stats["reused"] == 1 and stats["inferences_saved"] == 4
+
+    # Eyes moving alone are noticed, ages of video frames are in video time
+    gate = ChangeGate(threshold=3.0, max_age=1.0, fps=30.0)
+    source = {"frame": frame, "index": 0, "time": 0.0}
+    gate.update(source, [(200, 100, 400, 350)], [(240, 180, 290, 210), (310, 180, 360, 210)])
+    assert gate.check({"frame": noisy, "index": 30, "time": 5.0}) is source
+    glance = frame.copy()
+    glance[190:200, 250:260] = 0
+    assert gate.check({"frame": glance, "index": 1, "time": 0.0}) is None
+    assert gate.check({"frame": frame, "index": 31, "time": 0.0}) is None
+    print(f"Change gate stats: {stats}")
+
+def test_gaze_server():
+    # A malformed frame gets an error, and frames sent after it still get results
+    backend = SyntheticBackend(latency=0.001)
+    models = ModelSet(Face_Detection("face-detection-adas-0001.xml", backend=backend), \
+        Facial_Landmarks_Detection("landmarks-regression-retail-0009.xml", batch_size=8, backend=backend), \
+        Head_Pose_Estimation("head-pose-estimation-adas-0001.xml", batch_size=8, backend=backend), \
+        Gaze_Estimation("gaze-estimation-adas-0002.xml", batch_size=8, backend=backend), "FP32", 1.0)
+    ModelRegistry(backend=backend).load_models(list(models[0:4]), 2)
+    image = cv2.imread("media/sample.png")
+
+    async def run():
+        server = await GazeServer(models).start(port=0)
+        port = server.server.sockets[0].getsockname()[1]
+        client = await GazeClient.connect(port=port, encoding="raw")
+        try:
+            await asyncio.wait_for(client.infer(np.zeros((480, 640), dtype=np.uint8)), 5)
+            raise AssertionError("Frame without channels was processed")
+        except RuntimeError as e:
+            print(f"Malformed frame: {e}")
+        result = await asyncio.wait_for(client.infer(image), 5)
+        assert len(result["faces"]) == 1
+        await client.close()
+        await server.close()
+        return server.get_stats()
+
+    stats = asyncio.run(run())
+    assert stats["errors"] == 1 and stats["frames"] == 1
+    print(f"Gaze server stats: {stats}")
+
 def main():
     # test_face_detection()
     # test_head_pose_estimation()
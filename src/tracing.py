@@ -0,0 +1,95 @@
+'''
+End-to-end latency tracing of frames, from capture to pointer movement.
+Tracer collects events in the Chrome trace event format, which can be opened
+in chrome://tracing or https://ui.perfetto.dev to see how stages of frames
+overlap and where they stall. Each frame gets a track, keyed by its sequence
+number, with its span from capture to gaze and the spans of model stages
+within it, and another with its span from capture to pointer movement.
+Pointer moves are slices on the track of the pointer output thread.
+'''
+import json
+import logging as log
+import threading
+import time
+
+class Tracer:
+    '''
+    path: JSON file the trace is written to on close.
+    max_events: Events after this many are dropped, to bound memory of long runs.
+    '''
+    def __init__(self, path, max_events=1000000):
+        self.path = path
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self.thread_ids = set()
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def complete(self, name, start, end, args=None):
+        '''
+        Adds slice of name from start to end (time.perf_counter() seconds) on track of calling thread.
+        '''
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": self._us(start), "dur": self._us(end) - self._us(start), \
+            "pid": 1, "tid": thread.ident}
+        if args is not None:
+            event["args"] = args
+        with self.lock:
+            if thread.ident not in self.thread_ids:
+                self.thread_ids.add(thread.ident)
+                self._add({"name": "thread_name", "ph": "M", "pid": 1, "tid": thread.ident, \
+                    "args": {"name": thread.name}})
+            self._add(event)
+
+    def span(self, name, id, start, end, category="frame"):
+        '''
+        Adds span of name from start to end on the track of id (e.g. sequence
+        number of frame) and category, so spans of different frames can overlap.
+        Spans on one track must nest.
+        '''
+        with self.lock:
+            self._add({"name": name, "cat": category, "ph": "b", "id": id, "ts": self._us(start), "pid": 1, "tid": 0})
+            self._add({"name": name, "cat": category, "ph": "e", "id": id, "ts": self._us(end), "pid": 1, "tid": 0})
+
+    def close(self):
+        with self.lock:
+            events = list(self.events)
+        with open(self.path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        if self.dropped > 0:
+            log.warning(f"Trace limited to {self.max_events} events, {self.dropped} events dropped")
+
+    def _add(self, event):
+        if len(self.events) < self.max_events:
+            self.events.append(event)
+        else:
+            self.dropped += 1
+
+    def _us(self, seconds):
+        return round((seconds - self.start) * 1e6, 1)
+
+class PointerLatency:
+    '''
+    Callback of AsyncPointerOutput recording motion-to-pointer latency: time
+    from capture of a frame until the pointer first moves towards the gaze
+    target of the frame. Moves are tagged with (seq, capture_time) of their frame.
+
+    metrics: Metrics the latencies are recorded to as 'motion_to_pointer'.
+    tracer: Optional Tracer to add pointer moves and capture to pointer spans to.
+    '''
+    def __init__(self, metrics, tracer=None):
+        self.metrics = metrics
+        self.tracer = tracer
+        self.last_seq = None
+
+    def __call__(self, tag, start, end):
+        # Later moves towards the same target are interpolation steps, not new motion
+        if tag is None or tag[0] == self.last_seq:
+            return
+        seq, capture_time = tag
+        self.last_seq = seq
+        self.metrics.record("motion_to_pointer", end - capture_time)
+        if self.tracer is not None:
+            self.tracer.complete("pointer_move", start, end, {"frame": seq})
+            self.tracer.span("capture_to_pointer", seq, capture_time, end, "pointer")
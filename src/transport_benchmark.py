@@ -0,0 +1,133 @@
+'''
+Microbenchmark of passing frames from a capture process to an inference
+process: pickled through a multiprocessing.Queue, or written into a
+frame_ring.FrameRing and read as views of shared memory. A producer process
+sends frames of each size as fast as the transport takes them, the consumer
+reads a pixel of each (so the frame is really reached) and releases it.
+Throughput and latency from send until the consumer has the frame are reported.
+
+    python3 src/transport_benchmark.py -s 640x480 1920x1080 -f 500
+'''
+import json
+import logging as log
+import multiprocessing as mp
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from frame_ring import FrameRing
+
+transports = ["queue", "ring"]
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--sizes", required=False, type=str, nargs="+", default=["640x480", "1920x1080"], \
+        help="Frame sizes, <width>x<height> (default 640x480 1920x1080)")
+
+    parser.add_argument("-t", "--transports", required=False, type=str, nargs="+", default=transports, \
+        help="Transports to compare: 'queue' and/or 'ring' (default both)")
+
+    parser.add_argument("-f", "--frames", required=False, type=int, default=300, \
+        help="Frames sent per run (default 300)")
+
+    parser.add_argument("-sl", "--slots", required=False, type=int, default=8, \
+        help="Frames in flight: ring slots and max size of the queue (default 8)")
+
+    parser.add_argument("-o", "--output", required=False, type=str, default=None, \
+        help="Save results to this JSON file")
+
+    return parser
+
+# Both producers write each frame once, as a decoder does: into a new array, or into a slot
+def _produce_queue(frames_queue, shape, count):
+    source = np.full(shape, 128, dtype=np.uint8)
+    for i in range(count):
+        frame = source.copy()
+        frame[0, 0, 0] = i % 256
+        frames_queue.put((i, time.perf_counter(), frame))
+    frames_queue.put(None)
+
+def _produce_ring(ring, shape, count):
+    frame = np.full(shape, 128, dtype=np.uint8)
+    for i in range(count):
+        frame[0, 0, 0] = i % 256
+        ring.put(frame, i, time.perf_counter())
+    ring.end()
+    ring.close()
+
+def run_queue(shape, count, slots):
+    frames_queue = mp.Queue(slots)
+    producer = mp.Process(target=_produce_queue, args=(frames_queue, shape, count))
+    latencies = []
+    start = time.perf_counter()
+    producer.start()
+    while True:
+        item = frames_queue.get()
+        if item is None:
+            break
+        seq, sent, frame = item
+        latencies.append(time.perf_counter() - sent)
+        if frame[0, 0, 0] != seq % 256:
+            raise RuntimeError(f"Frame {seq} was corrupted in transport")
+    elapsed = time.perf_counter() - start
+    producer.join()
+    return latencies, elapsed
+
+def run_ring(shape, count, slots):
+    ring = FrameRing(slots, shape)
+    producer = mp.Process(target=_produce_ring, args=(ring, shape, count))
+    latencies = []
+    start = time.perf_counter()
+    producer.start()
+    while True:
+        item = ring.get()
+        if item is None:
+            break
+        latencies.append(time.perf_counter() - item.capture_time)
+        if item.frame[0, 0, 0] != item.seq % 256:
+            raise RuntimeError(f"Frame {item.seq} was corrupted in transport")
+        ring.release(item)
+    elapsed = time.perf_counter() - start
+    producer.join()
+    ring.close()
+    ring.unlink()
+    return latencies, elapsed
+
+def benchmark(transport, size, count, slots):
+    width, height = (int(side) for side in size.split("x"))
+    shape = (height, width, 3)
+    run = run_queue if transport == "queue" else run_ring
+    latencies, elapsed = run(shape, count, slots)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "transport": transport,
+        "size": size,
+        "frames": len(latencies),
+        "fps": round(len(latencies) / elapsed, 1),
+        "mb_per_s": round(len(latencies) * int(np.prod(shape)) / elapsed / 1e6, 1),
+        "latency_p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "latency_p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "latency_p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+    }
+
+def main():
+    args = build_argparser().parse_args()
+    log.basicConfig(level = log.INFO, format = '%(levelname)s: %(message)s')
+
+    for transport in args.transports:
+        if transport not in transports:
+            raise ValueError(f"Invalid transport '{transport}'. Valid values are {', '.join(transports)}")
+    results = []
+    for size in args.sizes:
+        for transport in args.transports:
+            result = benchmark(transport, size, args.frames, args.slots)
+            log.info(f"{transport} {size}: {result['fps']} frames/s, {result['mb_per_s']} MB/s, latency " \
+                f"p50 {result['latency_p50_ms']} ms, p95 {result['latency_p95_ms']} ms, p99 {result['latency_p99_ms']} ms")
+            results.append(result)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()